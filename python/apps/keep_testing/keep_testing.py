@@ -8,11 +8,19 @@ import select
 import sys
 import threading
 import time
-from typing import List
+from typing import List, Optional, Set, Union
 
+import apps.keep_testing.util.change_stream as change_stream
+import apps.keep_testing.util.command_runner as command_runner
 import apps.keep_testing.util.config_reader as config_reader
 import apps.keep_testing.util.dir_watcher as dir_watcher
 import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.gitignore as gitignore
+import apps.keep_testing.util.hashers as hashers
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+import apps.keep_testing.util.poll_watcher as poll_watcher
+import apps.keep_testing.util.result_cache as result_cache
+import apps.keep_testing.util.watch_budget as watch_budget
 import apps.util.config_log as config_log
 
 
@@ -21,26 +29,97 @@ class EnterMonitor(threading.Thread):
 
     enter_pressed = False
 
-    def __init__(self):
+    def __init__(self, wakeup: Optional[threading.Event] = None):
+        """Creates the monitor
+
+        Args:
+            wakeup (threading.Event): event set when <ENTER> is pressed
+        """
         super().__init__()
         self._done = False
+        self._wakeup = wakeup or threading.Event()
+        # written by `stop` to interrupt the wait for stdin without a timeout
+        self._stop_read, self._stop_write = os.pipe()
 
     def run(self):
         """Enter a loop until user press Ctrl+C monitoring Enter"""
         logging.info("Start monitoring <ENTER>")
         self._done = False
-        while not self._done:
-            inp, _, _ = select.select([sys.stdin], [], [], 0.5)
-            if inp:
-                logging.info("<ENTER> detected")
-                sys.stdin.readline()
-                EnterMonitor.enter_pressed = True
+        try:
+            while not self._done:
+                inp, _, _ = select.select([sys.stdin, self._stop_read], [], [])
+                if sys.stdin in inp:
+                    if not sys.stdin.readline():
+                        logging.info("End of input, <ENTER> is not monitored anymore")
+                        break
+                    logging.info("<ENTER> detected")
+                    EnterMonitor.enter_pressed = True
+                    self._wakeup.set()
+        finally:
+            os.close(self._stop_read)
 
         logging.info("Leaving <ENTER> monitoring")
 
     def stop(self):
         """Stops the monitoring"""
         self._done = True
+        try:
+            os.write(self._stop_write, b"\0")
+            os.close(self._stop_write)
+        except OSError:
+            # monitoring already finished (end of input)
+            pass
+
+
+def __duration(text: str) -> float:
+    """Converts a duration like `50ms`, `2s` or `1.5` (seconds) to seconds
+
+    Args:
+        text (str): the duration
+
+    Raises:
+        argparse.ArgumentTypeError: if the duration is invalid
+
+    Returns:
+        float: seconds
+    """
+    number, scale = text, 1.0
+    if text.endswith("ms"):
+        number, scale = text[:-2], 0.001
+    elif text.endswith("s"):
+        number = text[:-1]
+    try:
+        seconds = float(number) * scale
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid duration '{text}'") from error
+    if seconds < 0:
+        raise argparse.ArgumentTypeError(f"negative duration '{text}'")
+    return seconds
+
+
+def __size(text: str) -> int:
+    """Converts a size like `100M`, `2G`, `512k` or `4096` (bytes) to bytes
+
+    Args:
+        text (str): the size
+
+    Raises:
+        argparse.ArgumentTypeError: if the size is invalid
+
+    Returns:
+        int: bytes
+    """
+    number, scale = text, 1
+    for suffix, suffix_scale in [("k", 1 << 10), ("M", 1 << 20), ("G", 1 << 30)]:
+        if text.endswith(suffix):
+            number, scale = text[:-1], suffix_scale
+    try:
+        size = int(float(number) * scale)
+    except ValueError as error:
+        raise argparse.ArgumentTypeError(f"invalid size '{text}'") from error
+    if size <= 0:
+        raise argparse.ArgumentTypeError(f"size should be positive '{text}'")
+    return size
 
 
 def __normalize_paths(paths: List[str], exists) -> List[str]:
@@ -86,49 +165,74 @@ def __create_regexes(texts: List[str]) -> List[re.Pattern]:
     return result
 
 
-def __execute_cmds(cmds: List[str]) -> bool:
+def __execute_cmds(
+    cmds: List[command_runner.Command],
+    jobs: int,
+    cache: Optional[result_cache.ResultCache] = None,
+    dirs_files: Optional[file_status.DirsAndFiles] = None,
+) -> bool:
     """Executes commands and returns True if all succeeded, False otherwise
 
     Args:
-        cmds (List[str]): commands to execute
+        cmds (List[Command]): commands to execute (dependencies first)
+        jobs (int): maximum number of commands running at the same time
+        cache (ResultCache): results of commands whose inputs did not change
+        dirs_files (DirsAndFiles): snapshot of the inputs of the commands (for `cache`)
 
     Returns:
         bool: True if all commands succeeded, False otherwise
     """
     logging.debug("execute_cmds(%s)", cmds)
-    for cmd in cmds:
-        logging.info("Executing: %s", cmd)
-        if os.system(cmd) == 0:
-            logging.log(config_log.OK_LEVEL, "Success: %s", cmd)
-        else:
-            logging.error("Command failed: %s", cmd)
-            return False
-    return True
+    keys = command_runner.input_keys(cmds, dirs_files) if cache and dirs_files else None
+    runner = command_runner.CommandRunner(cmds, workers=jobs, cache=cache, keys=keys)
+    runner.start()
+    try:
+        return bool(runner.wait())
+    finally:
+        # Ctrl+C does not reach commands in their own process group
+        runner.cancel()
 
 
 def __execution_loop(
     monitor: EnterMonitor,
-    cmds: List[str],
+    cmds: List[command_runner.Command],
     dirs_files: file_status.DirsAndFiles,
-    watcher: dir_watcher.DirWatcher,
-    sleep: float,
+    watcher: Union[dir_watcher.DirWatcher, poll_watcher.PollWatcher],
+    rescan: float,
     only_once: bool,
+    stream: Optional[change_stream.ChangeStream] = None,
+    restart_on_change: bool = False,
+    jobs: int = 1,
+    cache: Optional[result_cache.ResultCache] = None,
 ) -> int:
     """Loops executing `cmds` and checking `dirs` and `files` for changes
     except the ones that match `ignore`. If `only_once` is True, it will
     execute only once.
 
     Args:
-        cmds (List[str]): commands to execute
+        cmds (List[Command]): commands to execute (dependencies first)
         dirs (List[str]): directories to watch
         files (List[str]): files to watch
         ignore (List[re.Pattern]): regex applied to `dirs` and `files` to ignore
-        sleep (float): time to wait between two notifications check
+        rescan (float): time between two full rescans of `dirs` and `files` (changes in between
+            are only looked for in the paths reported by `watcher`)
         only_once (bool): if True, execute only once and exit
+        stream (change_stream.ChangeStream): where changes are also written as JSON
+        restart_on_change (bool): if True, changes (and <ENTER>) while the commands run cancel
+            them and start them over
+        jobs (int): maximum number of commands running at the same time
+        cache (ResultCache): results of commands whose inputs did not change (not used
+            after <ENTER>)
+
+    Changes only run the commands whose paths changed, the ones that did not succeed in their
+    last run and the commands depending on them. <ENTER> runs all of them.
+
+    Commands get the paths created or changed since all commands last succeeded (none on the
+    first run and after <ENTER>: everything has to be checked).
     """
 
     if only_once:
-        if __execute_cmds(cmds):
+        if __execute_cmds(cmds, jobs, cache, dirs_files):
             return 0
         else:
             return 1
@@ -136,30 +240,134 @@ def __execution_loop(
     monitor.start()
     logging.debug("Starting watching")
     watcher.start()
+    # first check is a full rescan: changes before the watcher started have no events
+    last_rescan = 0.0
+    # commands to run again
+    pending = {cmd.name for cmd in cmds}
+    # paths passed to the commands (None: all of them have to be checked)
+    batch: Optional[Set[str]] = None
+    # if False, cached results are not used (<ENTER> runs the commands again)
+    reuse = True
     while True:
-        __execute_cmds(cmds)
+        changed_paths = sorted(batch or [])
+        selected = command_runner.select(cmds, pending)
+        keys = None
+        if cache:
+            keys = command_runner.input_keys(
+                cmds, dirs_files, changed_paths, names={cmd.name for cmd in selected}
+            )
+        # sets the wakeup event when the commands end
+        runner = command_runner.CommandRunner(
+            selected,
+            watcher.wakeup,
+            workers=jobs,
+            changed=changed_paths,
+            cache=cache,
+            keys=keys,
+            reuse=reuse,
+        )
+        runner.start()
+        triggered: Set[str] = set()
+        try:
+            if not restart_on_change:
+                runner.wait()
 
-        changed: List[str] = []
-        EnterMonitor.enter_pressed = False
-        while not changed and not EnterMonitor.enter_pressed:
+            changed: List[file_status.Change] = []
             EnterMonitor.enter_pressed = False
-            begin = time.time()
-            changed = dirs_files.update()
-            end = time.time()
-            logging.debug("Time to check: %f", end - begin)
-            if changed:
-                logging.info("Changes detected:")
-                for change in changed:
-                    logging.info("- %s", change)
-                break
-            logging.info("Monitoring dir changes and <ENTER> key presses")
-            while not watcher.changed() and not EnterMonitor.enter_pressed:
-                time.sleep(sleep)
+            while not changed and not EnterMonitor.enter_pressed:
+                EnterMonitor.enter_pressed = False
+                # cleared before checking: a change during the check wakes up the wait below
+                watcher.wakeup.clear()
+                begin = time.time()
+                if watcher.in_burst():
+                    # its events are checked at once when it ends
+                    changed = []
+                elif begin - last_rescan >= rescan:
+                    watcher.pop_events()
+                    changed = dirs_files.update()
+                    last_rescan = begin
+                    logging.debug("Full rescan")
+                else:
+                    changed = dirs_files.apply_events(watcher.pop_events())
+                end = time.time()
+                logging.debug("Time to check: %f", end - begin)
+                if changed:
+                    logging.info("Changes detected:")
+                    for change in changed:
+                        logging.info("- %s", change)
+                    if stream:
+                        stream.write(changed)
+                    # commands match the paths of the files in moved directories
+                    changed = dirs_files.expand_moves(changed)
+                    paths = [change.path for change in changed]
+                    paths.extend(change.old_path for change in changed if change.old_path)
+                    triggered = command_runner.triggered(cmds, paths)
+                    if triggered:
+                        break
+                    logging.info("No command depends on the changed paths")
+                    changed = []
+                if not runner.running():
+                    logging.info("Monitoring dir changes and <ENTER> key presses")
+                # blocks until a change event (or the end of a burst), <ENTER>, the end of the
+                # commands or the next full rescan
+                timeout = max(0.0, rescan - (time.time() - last_rescan))
+                if watcher.in_burst():
+                    timeout = threading.TIMEOUT_MAX
+                watcher.wakeup.wait(min(timeout, threading.TIMEOUT_MAX))
+            if EnterMonitor.enter_pressed:
+                triggered = {cmd.name for cmd in cmds}
+            if runner.running():
+                logging.info("Restarting commands")
+        finally:
+            runner.cancel()
+        pending -= {
+            name
+            for name, (state, _) in runner.states.items()
+            if state == command_runner.SUCCEEDED
+        }
+        if not pending:
+            batch = set()
+        reuse = not EnterMonitor.enter_pressed
+        if not reuse:
+            batch = None
+        pending |= triggered
+        if batch is not None:
+            batch.update(
+                change.path for change in changed if change.kind != file_status.DELETED
+            )
+
+
+def __default_cache_dir() -> str:
+    """Returns the default directory for snapshot caches"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "keep_testing")
+
+
+def __save_cache(dirs_files: file_status.DirsAndFiles, cache_file: str) -> None:
+    """Saves the snapshot cache without stopping execution on errors
+
+    Args:
+        dirs_files (file_status.DirsAndFiles): the snapshot
+        cache_file (str): path to the cache file
+    """
+    try:
+        dirs_files.save(cache_file)
+        logging.debug("Snapshot saved in %s", cache_file)
+    except OSError as error:
+        logging.warning("Could not save snapshot in %s: %s", cache_file, error)
 
 
 def main():
     """Keep running commands watching directories"""
-    monitor = EnterMonitor()
+    # set by the watcher and the <ENTER> monitor to wake up the execution loop
+    wakeup = threading.Event()
+    monitor = EnterMonitor(wakeup)
+    watcher = None
+    stream = None
+    dirs_files = None
+    cache_file = None
     res = 0
     try:
         parser = argparse.ArgumentParser(
@@ -202,12 +410,95 @@ def main():
             action="extend",
             default=[],
         )
-        parser.add_argument("-s", "--sleep", type=float, default=0.2)
+        parser.add_argument(
+            "--use-gitignore",
+            action="store_true",
+            help="also ignore what .gitignore and .ignore files in the watched trees (and\n"
+            "their git repositories) ignore",
+        )
+        parser.add_argument(
+            "-s",
+            "--sleep",
+            type=float,
+            default=0.2,
+            help="not used: changes and <ENTER> wake up the monitoring immediately\n"
+            "(kept for compatibility)",
+        )
+        parser.add_argument(
+            "--rescan",
+            type=__duration,
+            default=300.0,
+            help="seconds between full rescans of the watched trees (in between, only the\n"
+            "paths reported by change events are checked) (default: 300)",
+        )
+        parser.add_argument(
+            "--debounce",
+            type=__duration,
+            default=0.05,
+            help="quiet period closing a burst of change events (e.g. 50ms): a burst is\n"
+            "checked once, when it ends (default: 50ms)",
+        )
+        parser.add_argument(
+            "--max-wait",
+            type=__duration,
+            default=2.0,
+            help="maximum wait for the end of a burst of change events (default: 2s)",
+        )
+        parser.add_argument(
+            "--backend",
+            type=str,
+            choices=dir_watcher.BACKENDS,
+            default=dir_watcher.WATCHDOG,
+            help="how directories are watched: watchdog (portable) or inotify (Linux only,\n"
+            "reads events in batches in a single thread) (default: watchdog)",
+        )
+        parser.add_argument(
+            "--watch-budget",
+            type=int,
+            default=watch_budget.default_budget(),
+            help="maximum number of watched directories: the least recently changed subtrees\n"
+            "that do not fit are polled (0: no limit) (default: half of\n"
+            "fs.inotify.max_user_watches if available, otherwise no limit)",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=__duration,
+            default=2.0,
+            help="interval between polls of the subtrees that are not watched (default: 2s)",
+        )
+        parser.add_argument(
+            "--poll",
+            action="store_true",
+            help="poll the watched trees instead of waiting for change events (for NFS,\n"
+            "SSHFS and other file systems without them)",
+        )
+        parser.add_argument(
+            "--poll-cpu",
+            type=float,
+            default=5.0,
+            help="with --poll, maximum percentage of time spent scanning: intervals grow\n"
+            "with the cost of scans (default: 5)",
+        )
+        parser.add_argument(
+            "--restart-on-change",
+            action="store_true",
+            help="keep watching while the commands run: changes (and <ENTER>) cancel them\n"
+            "(SIGTERM, then SIGKILL after 2s) and start them over",
+        )
+        parser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=os.cpu_count() or 1,
+            help="maximum number of commands running at the same time (commands from\n"
+            "--cmds and 'cmds' run one after the other; named 'commands' in TOML files\n"
+            "run as soon as their 'depends_on' succeeded) (default: number of CPUs)",
+        )
         parser.add_argument(
             "--config",
             type=str,
             nargs="+",
-            help="use a TOML config file with cmds, dirs, files and ignores",
+            help="use a TOML config file with cmds, commands, dirs, files, ignores and hash",
             action="extend",
             default=[],
         )
@@ -217,6 +508,52 @@ def main():
             action="store_true",
             help="execute only once and exit immediately",
         )
+        parser.add_argument(
+            "--hash",
+            type=str,
+            choices=hashers.algorithms(),
+            help="algorithm used to detect changes in file contents ('none' compares\n"
+            f"only size, modification time and inode) (default: {hashers.DEFAULT_ALGORITHM})",
+        )
+        parser.add_argument(
+            "--hash-workers",
+            type=int,
+            default=1,
+            help="number of threads hashing files concurrently (default: 1)",
+        )
+        parser.add_argument(
+            "--cache-dir",
+            type=str,
+            help="directory where snapshots of watched trees are cached\n"
+            f"(default: {__default_cache_dir()})",
+            default=__default_cache_dir(),
+        )
+        parser.add_argument(
+            "--json",
+            type=str,
+            metavar="TARGET",
+            help="also write detected changes as JSON lines (NDJSON) to TARGET: a file\n"
+            "(appended to), '-' for the standard output or a file descriptor number",
+        )
+        parser.add_argument(
+            "--result-cache",
+            action="store_true",
+            help="do not execute commands whose inputs (command, watched files matching its\n"
+            "paths and results of its dependencies) were already seen: their exit code and\n"
+            "output are replayed from a cache in --cache-dir (not after <ENTER>)",
+        )
+        parser.add_argument(
+            "--result-cache-size",
+            type=__size,
+            default=100 << 20,
+            help="maximum size of the result cache (e.g. 100M): the least recently used\n"
+            "results are removed (default: 100M)",
+        )
+        parser.add_argument(
+            "--no-cache",
+            action="store_true",
+            help="do not read nor write the snapshot cache (nor the result cache)",
+        )
         parser.add_argument(
             "--debug", action="store_true", help="set log level to DEBUG"
         )
@@ -233,12 +570,30 @@ def main():
             [cfg for config in configs for cfg in config.files()]
         ignores = args.ignores + \
             [cfg for config in configs for cfg in config.ignores()]
+        hash_algorithm = args.hash or next(
+            (
+                config.hash_algorithm()
+                for config in reversed(configs)
+                if config.hash_algorithm()
+            ),
+            hashers.DEFAULT_ALGORITHM,
+        )
         only_once = args.once
 
-        logging.info("Executing %s", cmds)
+        try:
+            cmds = command_runner.graph(
+                cmds, [cfg for config in configs for cfg in config.commands()]
+            )
+        except ValueError as error:
+            logging.critical("%s", error)
+            sys.exit(1)
+        logging.info("Executing %s", [cmd.cmd for cmd in cmds])
         if not cmds:
             logging.critical("You must inform commands to execute")
             sys.exit(1)
+        if args.jobs < 1:
+            logging.critical("Number of jobs should be at least 1")
+            sys.exit(1)
         if dirs:
             logging.info("Watching dirs %s", dirs)
         if files:
@@ -249,12 +604,74 @@ def main():
         files = __normalize_paths(files, os.path.isfile)
         dirs = __normalize_paths(dirs, os.path.isdir)
         ignores = __create_regexes(ignores)
-
-        dirs_files = file_status.DirsAndFiles(files, dirs, ignores)
+        if args.use_gitignore:
+            logging.info("Using .gitignore and .ignore files")
+            ignores = gitignore.GitignoreMatcher(ignores, dirs)
+        # compiled once, shared by scans and the watcher
+        ignores = ignore_matcher.create(ignores)
+
+        try:
+            hasher = hashers.Hasher(hash_algorithm, args.hash_workers)
+        except ValueError as error:
+            logging.critical("%s", error)
+            sys.exit(1)
+        logging.debug("Hashing with %s", hasher.algorithm)
+        if args.no_cache:
+            dirs_files = file_status.DirsAndFiles(files, dirs, ignores, hasher=hasher)
+        else:
+            key = file_status.cache_key(files, dirs, ignores, hasher.algorithm)
+            cache_file = os.path.join(args.cache_dir, f"{key}.cache")
+            dirs_files = file_status.DirsAndFiles.load(
+                cache_file, files, dirs, ignores, hasher
+            )
+            __save_cache(dirs_files, cache_file)
         logging.debug("Information gathered")
-        watcher = dir_watcher.DirWatcher(files, dirs)
-        res = __execution_loop(monitor, cmds, dirs_files,
-                               watcher, args.sleep, only_once)
+        cache = None
+        if args.result_cache and not args.no_cache:
+            cache = result_cache.ResultCache(
+                os.path.join(args.cache_dir, "results"), args.result_cache_size
+            )
+            logging.debug("Result cache: %d bytes", cache.size)
+        if args.json:
+            try:
+                stream = change_stream.ChangeStream(args.json)
+            except OSError as error:
+                logging.critical("Could not open %s: %s", args.json, error)
+                sys.exit(1)
+        try:
+            if args.poll:
+                logging.info("Polling (up to %g%% of the time)", args.poll_cpu)
+                watcher = poll_watcher.PollWatcher(
+                    files, dirs, wakeup, ignores, args.poll_cpu / 100
+                )
+            else:
+                watcher = dir_watcher.DirWatcher(
+                    files,
+                    dirs,
+                    wakeup,
+                    args.debounce,
+                    args.max_wait,
+                    ignores,
+                    args.backend,
+                    args.watch_budget or None,
+                    args.poll_interval,
+                    dirs_files.dirs,
+                )
+        except (ValueError, RuntimeError) as error:
+            logging.critical("%s", error)
+            sys.exit(1)
+        res = __execution_loop(
+            monitor,
+            cmds,
+            dirs_files,
+            watcher,
+            args.rescan,
+            only_once,
+            stream,
+            args.restart_on_change,
+            args.jobs,
+            cache,
+        )
     except KeyboardInterrupt:
         logging.info("Ctrl+C pressed")
 
@@ -263,10 +680,17 @@ def main():
         monitor.stop()
         monitor.join()
 
-    watcher.stop()
+    if stream:
+        stream.close()
+
+    if watcher:
+        watcher.stop()
+
+    if dirs_files and cache_file:
+        __save_cache(dirs_files, cache_file)
 
     logging.info("Bye")
-    sys(exit(res))
+    sys.exit(res)
 
 
 if __name__ == "__main__":
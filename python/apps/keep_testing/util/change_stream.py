@@ -0,0 +1,78 @@
+"""Stream of change records as newline-delimited JSON"""
+
+import json
+import os
+import sys
+import time
+from typing import IO, Iterable, Optional
+
+import apps.keep_testing.util.file_status as file_status
+
+STDOUT = "-"
+_STDOUT_FD = 1
+_STDERR_FD = 2
+
+
+class ChangeStream:
+    """Writes change records as NDJSON (one JSON object per line)
+
+    Each batch of changes is written and flushed at once, so a reader sees whole lines and
+    every change of a check together. Records have the fields of `Change.to_json` and the
+    time of the check (`time`, seconds since the epoch).
+
+    On the standard output, the records would be mixed with the output of the commands (which
+    inherit it) and with replayed results: the stream keeps the standard output and everything
+    else written to it goes to the standard error until the stream is closed.
+    """
+
+    def __init__(self, target: str) -> None:
+        """Opens the stream
+
+        Args:
+            target (str): `-` for the standard output, a number for an open file descriptor
+                or the path of a file (appended to)
+
+        Raises:
+            OSError: if the file or file descriptor cannot be opened
+        """
+        # duplicate of the standard output given back when closed
+        self._stdout: Optional[int] = None
+        if target == STDOUT:
+            sys.stdout.flush()
+            self._stdout = os.dup(_STDOUT_FD)
+            self._file: IO[str] = os.fdopen(self._stdout, "w", encoding="utf_8", closefd=False)
+            os.dup2(_STDERR_FD, _STDOUT_FD)
+        elif target.isdigit():
+            self._file = os.fdopen(int(target), "a", encoding="utf_8", closefd=False)
+        else:
+            self._file = open(target, "a", encoding="utf_8")  # pylint: disable=consider-using-with
+
+    def write(self, changes: Iterable[file_status.Change]) -> None:
+        """Writes a batch of changes
+
+        Args:
+            changes (Iterable[Change]): the changes
+        """
+        now = time.time()
+        lines = [
+            json.dumps({**change.to_json(), "time": now}, separators=(",", ":")) + "\n"
+            for change in changes
+        ]
+        if not lines:
+            return
+        try:
+            self._file.writelines(lines)
+            self._file.flush()
+        except BrokenPipeError:
+            # the reader is gone: changes are still logged
+            # pylint: disable=consider-using-with
+            self._file = open(os.devnull, "w", encoding="utf_8")
+
+    def close(self) -> None:
+        """Closes the stream (and gives the standard output back)"""
+        self._file.close()
+        if self._stdout is not None:
+            sys.stdout.flush()
+            os.dup2(self._stdout, _STDOUT_FD)
+            os.close(self._stdout)
+            self._stdout = None
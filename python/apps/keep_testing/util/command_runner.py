@@ -0,0 +1,633 @@
+"""Runs graphs of commands in the background, each command in its own process group"""
+
+import concurrent.futures
+import hashlib
+import io
+import logging
+import os
+import shlex
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    cast,
+)
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.gitignore as gitignore
+import apps.keep_testing.util.result_cache as result_cache
+import apps.util.config_log as config_log
+
+# seconds a cancelled command has to exit after SIGTERM before SIGKILL
+DEFAULT_GRACE = 2.0
+
+# replaced in commands by the changed paths (quoted, separated by spaces)
+CHANGED = "{changed}"
+# replaced in commands by the path of a file with the changed paths (one per line)
+CHANGED_FILE = "{changed_file}"
+# environment variables of commands with the changed paths (one per line) and that file
+CHANGED_ENV = "KEEP_TESTING_CHANGED"
+CHANGED_FILE_ENV = "KEEP_TESTING_CHANGED_FILE"
+# longest value of CHANGED_ENV in bytes (Linux refuses to run commands with variables over
+# 128 KiB)
+_MAX_ENV = 100_000
+_CHUNK_SIZE = 64 * 1024
+
+# states of commands in a run
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+SKIPPED = "skipped"
+CANCELLED = "cancelled"
+
+# a process group per command: signals reach the shell and everything it started
+if sys.version_info >= (3, 11):
+    _NEW_GROUP: Dict[str, Any] = {"process_group": 0}
+else:
+    _NEW_GROUP = {"start_new_session": True}
+
+
+class Command(NamedTuple):
+    """A command, the names of the commands that must succeed before it runs and the paths
+    whose changes trigger it (gitignore patterns relative to `base`; any change if empty)
+    """
+
+    name: str
+    cmd: str
+    depends_on: Tuple[str, ...] = ()
+    paths: Tuple[str, ...] = ()
+    # directory of relative path patterns, e.g. the one of the TOML file (empty: the default)
+    base: str = ""
+
+
+def chain(cmds: Iterable[str]) -> List[Command]:
+    """Returns commands that run one after the other (named after their text)
+
+    Args:
+        cmds (Iterable[str]): commands to execute
+
+    Returns:
+        List[Command]: each command depends on the previous one
+    """
+    commands: List[Command] = []
+    names: Set[str] = set()
+    for cmd in cmds:
+        name = cmd
+        copy = 1
+        while name in names:
+            copy += 1
+            name = f"{cmd} ({copy})"
+        names.add(name)
+        commands.append(Command(name, cmd, (commands[-1].name,) if commands else ()))
+    return commands
+
+
+def graph(cmds: Iterable[str], named: Iterable[Command]) -> List[Command]:
+    """Returns the commands to execute: the chain of `cmds`, then the `named` commands
+
+    Named commands without dependencies run after the last command of the chain.
+
+    Args:
+        cmds (Iterable[str]): commands to execute one after the other
+        named (Iterable[Command]): commands with their dependencies
+
+    Raises:
+        ValueError: if a name is repeated, a dependency is unknown, there is a cycle or a path
+            pattern is invalid
+
+    Returns:
+        List[Command]: the commands, in an order where dependencies come first
+    """
+    commands = chain(cmds)
+    after = (commands[-1].name,) if commands else ()
+    commands.extend(
+        command if command.depends_on else command._replace(depends_on=after)
+        for command in named
+    )
+    by_name: Dict[str, Command] = {}
+    for command in commands:
+        if command.name in by_name:
+            raise ValueError(f"Command '{command.name}' is defined more than once")
+        by_name[command.name] = command
+    for command in commands:
+        for dependency in command.depends_on:
+            if dependency not in by_name:
+                raise ValueError(f"Command '{command.name}' depends on unknown '{dependency}'")
+        _rules(command, os.getcwd())
+
+    # topological order (depth-first, keeping the definition order where possible)
+    ordered: List[Command] = []
+    state: Dict[str, bool] = {}  # name X True when done, False while visiting
+
+    def visit(command: Command, path: Tuple[str, ...]) -> None:
+        if state.get(command.name) is False:
+            cycle = " -> ".join(path[path.index(command.name):] + (command.name,))
+            raise ValueError(f"Commands depend on each other: {cycle}")
+        if command.name in state:
+            return
+        state[command.name] = False
+        for dependency in command.depends_on:
+            visit(by_name[dependency], path + (command.name,))
+        state[command.name] = True
+        ordered.append(command)
+
+    for command in commands:
+        visit(command, ())
+    return ordered
+
+
+def triggered(
+    commands: Iterable[Command], paths: Iterable[str], base: Optional[str] = None
+) -> Set[str]:
+    """Returns the commands whose paths match changed paths
+
+    A path matches a pattern if it or one of its directories does, the last matching pattern
+    deciding (`!` excludes), as in .gitignore files.
+
+    Args:
+        commands (Iterable[Command]): the commands
+        paths (Iterable[str]): changed paths
+        base (str): directory of relative patterns of commands without `base` (default: the
+            current directory)
+
+    Returns:
+        Set[str]: names of the commands without paths or with changed paths
+    """
+    base = os.path.realpath(base or os.getcwd())
+    paths = list(paths)
+    result = set()
+    for command in commands:
+        rules = _rules(command, base)
+        if not rules or any(_matches(rules, path) for path in paths):
+            result.add(command.name)
+    return result
+
+
+def changed_paths(
+    command: Command, paths: Sequence[str], base: Optional[str] = None
+) -> List[str]:
+    """Returns the changed paths relevant to a command
+
+    Args:
+        command (Command): the command
+        paths (Sequence[str]): changed paths
+        base (str): directory of relative patterns of commands without `base` (default: the
+            current directory)
+
+    Returns:
+        List[str]: the paths matching the paths of the command (all if it has none)
+    """
+    rules = _rules(command, os.path.realpath(base or os.getcwd()))
+    if not rules:
+        return list(paths)
+    return [path for path in paths if _matches(rules, path)]
+
+
+def select(commands: Iterable[Command], names: Set[str]) -> List[Command]:
+    """Returns the commands to run again: `names` and the commands depending on them
+
+    Dependencies that are not run again are left out (their last run is still valid).
+
+    Args:
+        commands (Iterable[Command]): commands (dependencies first)
+        names (Set[str]): names of the commands to run again
+
+    Returns:
+        List[Command]: the commands, dependencies first
+    """
+    selected: List[Command] = []
+    chosen: Set[str] = set()
+    for command in commands:
+        depends_on = tuple(name for name in command.depends_on if name in chosen)
+        if command.name in names or depends_on:
+            chosen.add(command.name)
+            selected.append(command._replace(depends_on=depends_on))
+    return selected
+
+
+def input_keys(
+    commands: Sequence[Command],
+    snapshot: file_status.DirsAndFiles,
+    changed: Sequence[str] = (),
+    base: Optional[str] = None,
+    names: Optional[Set[str]] = None,
+) -> Dict[str, str]:
+    """Returns the keys of the results of commands in a result cache
+
+    A key depends on the command, the contents of the watched files matching its paths (all
+    without paths), the keys of the commands it depends on and, if the command has `{changed}`
+    or `{changed_file}`, its changed paths.
+
+    The files matching the paths of a command are only matched again in the directories that
+    changed since the last call with the same `snapshot`.
+
+    Args:
+        commands (Sequence[Command]): the commands (dependencies first)
+        snapshot (DirsAndFiles): the watched files
+        changed (Sequence[str]): changed paths passed to the commands
+        base (str): directory of relative patterns of commands without `base` (default: the
+            current directory)
+        names (Set[str]): the commands whose keys are needed (all if None)
+
+    Returns:
+        Dict[str, str]: command name X key (hex) of `names` and the commands they depend on
+    """
+    base = os.path.realpath(base or os.getcwd())
+    needed = {command.name for command in commands} if names is None else set(names)
+    for command in reversed(commands):
+        if command.name in needed:
+            needed.update(command.depends_on)
+    keys: Dict[str, str] = {}
+    for command in commands:
+        if command.name not in needed:
+            continue
+        rules = _rules(command, base)
+        inputs = snapshot.digest(
+            _file_matcher(rules) if rules else None,
+            "\0".join((command.base or base,) + command.paths),
+        )
+        key = hashlib.blake2b(digest_size=20)
+        parts = [command.cmd, inputs.hex()] + [keys.get(name, "") for name in command.depends_on]
+        if CHANGED in command.cmd or CHANGED_FILE in command.cmd:
+            parts.extend(changed_paths(command, changed, base))
+        key.update("\0".join(parts).encode(errors="surrogateescape"))
+        keys[command.name] = key.hexdigest()
+    return keys
+
+
+def _rules(command: Command, base: str) -> List[gitignore.Rule]:
+    """Returns the rules of the path patterns of `command` (relative to `base` if it has none)
+
+    Raises:
+        ValueError: if a pattern is invalid
+    """
+    rules = []
+    for pattern in command.paths:
+        rule = gitignore.parse_line(command.base or base, pattern)
+        if rule is None:
+            raise ValueError(f"Invalid path pattern of command '{command.name}': {pattern}")
+        rules.append(rule)
+    return rules
+
+
+def _matches(rules: List[gitignore.Rule], path: str, is_dir: Optional[bool] = None) -> bool:
+    """Checks if `path` (a directory if `is_dir`, checked if None) or one of its directories
+    is matched by `rules`"""
+    if _matched(rules, path, os.path.isdir(path) if is_dir is None else is_dir):
+        return True
+    parent = os.path.dirname(path)
+    while parent != path:
+        if _matched(rules, parent, True):
+            return True
+        path, parent = parent, os.path.dirname(parent)
+    return False
+
+
+def _matched(rules: List[gitignore.Rule], path: str, is_dir: bool) -> bool:
+    """Checks if the last rule matching `path` itself (not its directories) includes it"""
+    for regex, negated, only_dirs in reversed(rules):
+        if (is_dir or not only_dirs) and regex.fullmatch(path):
+            return not negated
+    return False
+
+
+def _file_matcher(rules: List[gitignore.Rule]) -> Callable[[str], bool]:
+    """Returns a function checking if files are matched by `rules` (see `_matches`), that
+    remembers the results of their directories"""
+    # directory X if it or one of its directories is matched
+    dirs: Dict[str, bool] = {}
+
+    def dir_matches(adir: str) -> bool:
+        unknown = []
+        while adir not in dirs:
+            unknown.append(adir)
+            parent = os.path.dirname(adir)
+            if parent == adir:
+                break
+            adir = parent
+        result = dirs.get(adir, False)
+        for path in reversed(unknown):
+            result = result or _matched(rules, path, True)
+            dirs[path] = result
+        return result
+
+    def matches(path: str) -> bool:
+        return _matched(rules, path, False) or dir_matches(os.path.dirname(path))
+
+    return matches
+
+
+class CommandRunner:
+    """Runs commands in a thread, as soon as the commands they depend on succeeded
+
+    Independent commands run concurrently, up to `workers` at a time. When a command fails,
+    the commands depending on it (directly or not) are skipped; the others go on.
+
+    Commands run through the shell in their own process group, with the standard input closed
+    (the <ENTER> monitor reads it). Cancelling kills the process groups of the running
+    commands.
+
+    The changed paths that matter to each command (see `changed_paths`) replace `{changed}`
+    and are in the `KEEP_TESTING_CHANGED` environment variable, one per line (unless there are
+    too many). They are also in a temporary file, one per line, whose path replaces
+    `{changed_file}` and is in `KEEP_TESTING_CHANGED_FILE`.
+
+    With a result cache, commands with a key (see `input_keys`) found in the cache are not
+    executed: their exit code and output are replayed. The others are executed with their
+    output (standard error included) captured, written to the standard output and stored.
+    """
+
+    def __init__(
+        self,
+        commands: List[Command],
+        done: Optional[threading.Event] = None,
+        grace: float = DEFAULT_GRACE,
+        workers: int = 1,
+        changed: Optional[Sequence[str]] = None,
+        cache: Optional[result_cache.ResultCache] = None,
+        keys: Optional[Dict[str, str]] = None,
+        reuse: bool = True,
+    ) -> None:
+        """Creates the runner
+
+        Args:
+            commands (List[Command]): commands to execute (dependencies first, see `graph`
+                and `chain`)
+            done (threading.Event): event set when the run ends (even if cancelled)
+            grace (float): seconds a cancelled command has to exit before being killed
+            workers (int): maximum number of commands running at the same time
+            changed (Sequence[str]): changed paths passed to the commands (none if not set)
+            cache (ResultCache): where results are looked up and stored
+            keys (Dict[str, str]): keys of the results of the commands (not cached without)
+            reuse (bool): if False, results are stored but not looked up
+
+        Raises:
+            ValueError: if `workers` is less than 1
+        """
+        if workers < 1:
+            raise ValueError("Number of command workers should be at least 1")
+        self._commands = list(commands)
+        self._done = done or threading.Event()
+        self._grace = grace
+        self._workers = workers
+        self._changed = list(changed or [])
+        self._cache = cache
+        self._keys = keys or {}
+        self._reuse = reuse
+        self._lock = threading.Lock()
+        self._processes: Dict[str, "subprocess.Popen[bytes]"] = {}
+        self._cancelled = False
+        self._result: Optional[bool] = None
+        # name X (state, wall time in seconds)
+        self._states: Dict[str, Tuple[str, float]] = {}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        """Starts executing the commands"""
+        self._thread.start()
+
+    def wait(self) -> Optional[bool]:
+        """Waits for the end of the run
+
+        Returns:
+            Optional[bool]: True if all commands succeeded, False if one failed, None if the
+                run was cancelled
+        """
+        self._thread.join()
+        return self._result
+
+    def running(self) -> bool:
+        """Checks if the run is still going on"""
+        return self._thread.is_alive()
+
+    @property
+    def result(self) -> Optional[bool]:
+        """Returns the result of the run (None while running or if cancelled)"""
+        return self._result
+
+    @property
+    def states(self) -> Dict[str, Tuple[str, float]]:
+        """Returns the state and wall time of the commands that ended (or were skipped)"""
+        with self._lock:
+            return dict(self._states)
+
+    def cancel(self) -> None:
+        """Stops the run: running commands get SIGTERM, then SIGKILL after the grace period,
+        and the next ones are not executed. Returns when the run ended.
+        """
+        with self._lock:
+            self._cancelled = True
+            processes = list(self._processes.values())
+        for process in processes:
+            _signal_group(process, signal.SIGTERM)
+        deadline = time.monotonic() + self._grace
+        for process in processes:
+            try:
+                process.wait(max(0.0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                logging.warning("Killing: %s", process.args)
+                _signal_group(process, signal.SIGKILL)
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def _run(self) -> None:
+        """Executes the commands until all ended or the run is cancelled"""
+        try:
+            self._result = self._execute()
+        finally:
+            self._done.set()
+
+    def _execute(self) -> Optional[bool]:
+        """Schedules the commands and returns the result of the run"""
+        waiting = list(self._commands)
+        succeeded: Set[str] = set()
+        failed: Set[str] = set()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers) as executor:
+            running: Dict[concurrent.futures.Future, str] = {}
+            while waiting or running:
+                for command in list(waiting):
+                    if any(dependency in failed for dependency in command.depends_on):
+                        waiting.remove(command)
+                        failed.add(command.name)
+                        self._end(command.name, SKIPPED, 0.0)
+                        logging.warning("Skipped: %s", command.cmd)
+                    elif (
+                        all(dependency in succeeded for dependency in command.depends_on)
+                        and len(running) < self._workers
+                    ):
+                        waiting.remove(command)
+                        running[executor.submit(self._execute_one, command)] = command.name
+                if not running:
+                    # the waiting commands depend on commands that are not in the run
+                    break
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in finished:
+                    name = running.pop(future)
+                    state = future.result()
+                    if state == SUCCEEDED:
+                        succeeded.add(name)
+                    elif state == FAILED:
+                        failed.add(name)
+                    else:
+                        waiting.clear()
+        if self._cancelled:
+            return None
+        if len(self._commands) > 1:
+            logging.info(
+                "Commands: %s",
+                ", ".join(
+                    f"{name} {state} ({seconds:.2f}s)"
+                    for name, (state, seconds) in self.states.items()
+                ),
+            )
+        return not failed
+
+    def _execute_one(self, command: Command) -> str:
+        """Executes a command with the file of its changed paths and returns its state"""
+        changed = changed_paths(command, self._changed)
+        handle, changed_file = tempfile.mkstemp(prefix="keep_testing_", suffix=".changed")
+        try:
+            with os.fdopen(handle, "w", encoding="utf_8") as file:
+                file.writelines(f"{path}\n" for path in changed)
+            return self._execute_with(command, changed, changed_file)
+        finally:
+            os.remove(changed_file)
+
+    def _execute_with(self, command: Command, changed: List[str], changed_file: str) -> str:
+        """Executes a command with its changed paths and returns its state at the end"""
+        begin = time.perf_counter()
+        cmd = command.cmd.replace(
+            CHANGED, " ".join(shlex.quote(path) for path in changed)
+        ).replace(CHANGED_FILE, shlex.quote(changed_file))
+        env = {**os.environ, CHANGED_FILE_ENV: changed_file}
+        text = "\n".join(changed)
+        if len(os.fsencode(text)) <= _MAX_ENV:
+            env[CHANGED_ENV] = text
+        else:
+            env.pop(CHANGED_ENV, None)
+            logging.warning(
+                "Too many changed paths for %s: read them from %s", CHANGED_ENV, CHANGED_FILE_ENV
+            )
+        cache = self._cache
+        key = self._keys.get(command.name) if cache else None
+        if cache and key and self._reuse:
+            result = cache.get(key)
+            if result is not None:
+                return self._replay(command, result, time.perf_counter() - begin)
+        with self._lock:
+            if self._cancelled:
+                return CANCELLED
+            logging.info("Executing: %s", command.cmd)
+            logging.debug("Changed paths: %s", changed)
+            try:
+                # pylint: disable=consider-using-with
+                process = subprocess.Popen(
+                    cmd,
+                    shell=True,
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.PIPE if key else None,
+                    stderr=subprocess.STDOUT if key else None,
+                    env=env,
+                    **_NEW_GROUP,
+                )
+            except OSError as error:
+                logging.error("Command failed: %s (%s)", command.cmd, error)
+                self._states[command.name] = (FAILED, time.perf_counter() - begin)
+                return FAILED
+            self._processes[command.name] = process
+        output = None
+        if cache and key:
+            # a pipe (buffered) when there is a key
+            output = _tee(cast(io.BufferedReader, process.stdout), cache.max_size)
+        code = process.wait()
+        seconds = time.perf_counter() - begin
+        with self._lock:
+            del self._processes[command.name]
+            if self._cancelled:
+                logging.info("Cancelled: %s", command.cmd)
+                return CANCELLED
+        if cache and key and output is not None:
+            cache.put(key, result_cache.Result(code, output))
+        if code == 0:
+            logging.log(config_log.OK_LEVEL, "Success: %s (%.2fs)", command.cmd, seconds)
+            self._end(command.name, SUCCEEDED, seconds)
+            return SUCCEEDED
+        logging.error("Command failed: %s (%.2fs)", command.cmd, seconds)
+        self._end(command.name, FAILED, seconds)
+        return FAILED
+
+    def _replay(self, command: Command, result: result_cache.Result, seconds: float) -> str:
+        """Replays the cached result of a command and returns its state"""
+        logging.info(
+            "Cached result of %s (%s)",
+            command.cmd,
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(result.time)),
+        )
+        _write_output(result.output)
+        if result.code == 0:
+            logging.log(config_log.OK_LEVEL, "Success: %s (cached)", command.cmd)
+            self._end(command.name, SUCCEEDED, seconds)
+            return SUCCEEDED
+        logging.error("Command failed: %s (cached)", command.cmd)
+        self._end(command.name, FAILED, seconds)
+        return FAILED
+
+    def _end(self, name: str, state: str, seconds: float) -> None:
+        """Records the state and wall time of a command that ended"""
+        with self._lock:
+            self._states[name] = (state, seconds)
+
+
+def _tee(stream: io.BufferedReader, limit: int) -> Optional[bytes]:
+    """Copies `stream` to the standard output until its end
+
+    Args:
+        stream (io.BufferedReader): output of a command
+        limit (int): maximum size of the returned output
+
+    Returns:
+        Optional[bytes]: what was read or None if it is larger than `limit`
+    """
+    chunks: List[bytes] = []
+    size = 0
+    with stream:
+        # whatever is available, not a full chunk: the output is shown as it comes
+        for chunk in iter(lambda: stream.read1(_CHUNK_SIZE), b""):
+            _write_output(chunk)
+            size += len(chunk)
+            if size <= limit:
+                chunks.append(chunk)
+    return b"".join(chunks) if size <= limit else None
+
+
+def _write_output(output: bytes) -> None:
+    """Writes the output of a command to the standard output"""
+    sys.stdout.flush()
+    if hasattr(sys.stdout, "buffer"):
+        sys.stdout.buffer.write(output)
+    else:
+        sys.stdout.write(output.decode(errors="replace"))
+    sys.stdout.flush()
+
+
+def _signal_group(process: "subprocess.Popen[bytes]", signum: int) -> None:
+    """Sends a signal to the process group of `process` (led by it)"""
+    try:
+        os.killpg(process.pid, signum)
+    except ProcessLookupError:
+        # the group already exited
+        pass
@@ -5,13 +5,20 @@ from typing import List
 
 import tomllib
 
+import apps.keep_testing.util.command_runner as command_runner
+
 
 class ConfigReader:
     """Read TOML configuration file with execution parameters"""
 
     CMDS = "cmds"
+    COMMANDS = "commands"
+    CMD = "cmd"
+    DEPENDS_ON = "depends_on"
+    PATHS = "paths"
     DIRS = "dirs"
     FILES = "files"
+    HASH = "hash"
     IGNORES = "ignores"
 
     def __init__(self, config_file: str) -> None:
@@ -20,6 +27,8 @@ class ConfigReader:
         Args:
             config_file: path to the configuration file
         """
+        # relative paths of commands are relative to the directory of the file
+        self._dir = os.path.dirname(os.path.realpath(config_file)) if config_file else ""
         if not config_file:
             self._data = {}
             return
@@ -34,10 +43,38 @@ class ConfigReader:
             if key in self._data and not isinstance(self._data[key], list):
                 raise ValueError(f"'{key}' should be a list")
 
+        for key in [self.HASH]:
+            if key in self._data and not isinstance(self._data[key], str):
+                raise ValueError(f"'{key}' should be a string")
+
+        commands = self._data.get(self.COMMANDS, {})
+        if not isinstance(commands, dict):
+            raise ValueError(f"'{self.COMMANDS}' should be a table")
+        for name, command in commands.items():
+            if not isinstance(command, dict) or not isinstance(command.get(self.CMD), str):
+                raise ValueError(f"'{self.COMMANDS}.{name}' should have a '{self.CMD}' string")
+            for key in [self.DEPENDS_ON, self.PATHS]:
+                if not isinstance(command.get(key, []), list):
+                    raise ValueError(f"'{self.COMMANDS}.{name}.{key}' should be a list")
+
     def cmds(self) -> List[str]:
         """Returns the list of commands to execute"""
         return self._return_list(self.CMDS)
 
+    def commands(self) -> List[command_runner.Command]:
+        """Returns the named commands (`[commands.<name>]` tables), with paths relative to the
+        directory of the file"""
+        return [
+            command_runner.Command(
+                name,
+                command[self.CMD],
+                tuple(command.get(self.DEPENDS_ON, [])),
+                tuple(command.get(self.PATHS, [])),
+                self._dir,
+            )
+            for name, command in self._data.get(self.COMMANDS, {}).items()
+        ]
+
     def dirs(self) -> List[str]:
         """Returns the list of directories to watch"""
         return self._return_list(self.DIRS)
@@ -50,6 +87,10 @@ class ConfigReader:
         """Returns the list of items to ignore"""
         return self._return_list(self.IGNORES)
 
+    def hash_algorithm(self) -> str:
+        """Returns the algorithm used to hash files (empty if not set)"""
+        return self._data.get(self.HASH, "")
+
     def _return_list(self, key: str) -> List[str]:
         """Returns the list of 'key' values"""
         return self._data[key] if key in self._data else []
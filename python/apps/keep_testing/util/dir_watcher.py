@@ -2,31 +2,140 @@
 
 import logging
 import os
-from typing import List
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 import threading
+import time
 
 from watchdog.events import FileSystemEventHandler
 from watchdog.observers import Observer
 
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+import apps.keep_testing.util.watch_budget as watch_budget
+
+WATCHDOG = "watchdog"
+INOTIFY = "inotify"
+BACKENDS = [WATCHDOG, INOTIFY]
+
+
+def _create_observer(backend: str, ignore: ignore_matcher.IgnoreMatcher):
+    """Creates the object watching directories for a backend
+
+    Args:
+        backend (str): one of BACKENDS
+        ignore (IgnoreMatcher): ignore rules
+
+    Raises:
+        ValueError: if the backend is unknown
+        RuntimeError: if the backend cannot be used in this system
+
+    Returns:
+        Observer: watchdog's Observer or an object with the same interface
+    """
+    if backend == WATCHDOG:
+        return Observer()
+    if backend != INOTIFY:
+        raise ValueError(f"Unknown watcher backend '{backend}' (use one of {', '.join(BACKENDS)})")
+    try:
+        # Linux only
+        # pylint: disable=import-outside-toplevel
+        import apps.keep_testing.util.inotify_observer as inotify_observer
+    except (ImportError, AttributeError, OSError) as error:
+        raise RuntimeError(f"Backend {INOTIFY} is not available: {error}") from error
+    return inotify_observer.InotifyObserver(ignore)
+
 
 class DirWatcher(FileSystemEventHandler):
     """Watches directories for change events"""
 
-    def __init__(self, files: List[str], dirs: List[str]) -> None:
+    def __init__(
+        self,
+        files: List[str],
+        dirs: List[str],
+        wakeup: Optional[threading.Event] = None,
+        debounce: float = 0.0,
+        max_wait: float = 2.0,
+        ignore: Optional[ignore_matcher.Ignore] = None,
+        backend: str = WATCHDOG,
+        max_watches: Optional[int] = None,
+        poll_interval: float = 2.0,
+        known_dirs: Optional[List[str]] = None,
+    ) -> None:
         """Creates a watcher for directory changes
 
         Args:
-            files (List[str]): file list to watch (will extract dirs)
-            dirs (List[str]): directory list to watch
+            files (List[str]): file list to watch (their directories are watched without
+                subdirectories and only events on the files themselves are kept)
+            dirs (List[str]): directory list to watch (with subdirectories)
+            wakeup (threading.Event): event set on changes, so a waiting thread can block on
+                it instead of polling `changed`
+            debounce (float): seconds without events before a burst of events sets `wakeup`
+                (0 sets it on every event)
+            max_wait (float): maximum seconds between the first event of a burst and
+                setting `wakeup`
+            ignore (Ignore): ignore rules or their matcher: events on ignored paths (or inside
+                ignored directories) are dropped, except for watched files
+            backend (str): how directories are watched: `watchdog` (portable) or `inotify`
+                (Linux, a single thread reading events in batches)
+            max_watches (int): maximum number of watched directories (None for no limit):
+                the subtrees that do not fit are polled
+            poll_interval (float): seconds between two polls of the subtrees that are not
+                watched
+            known_dirs (List[str]): directories already scanned (e.g. of a snapshot), so
+                the watch budget does not scan the trees again (None to scan them)
+
+        Raises:
+            ValueError: if the backend is unknown
+            RuntimeError: if the backend cannot be used in this system
         """
-        unique_dirs = DirWatcher._unify_dirs(files, dirs)
+        recursive_dirs, file_dirs = DirWatcher._unify_dirs(files, dirs)
 
+        self._matcher = ignore_matcher.create(ignore or [])
+        self._files = set(files)
+        self._recursive_dirs = set(recursive_dirs)
+        self._recursive_prefixes = tuple(os.path.join(adir, "") for adir in recursive_dirs)
+        # explicitly watched directories are not ignored even under ignored directories
+        self._roots = set(dirs).union(os.path.dirname(file) for file in files)
+        # directory X if it or one of its parents under a watched directory is ignored
+        self._ignored_dirs: Dict[str, bool] = {}
+        self._wakeup = wakeup or threading.Event()
+        self._debounce = debounce
+        self._max_wait = max_wait
         self._modified = False
+        self._paths: Set[str] = set()
         self._started = False
-        self._observer = Observer()
+        self._observer = _create_observer(backend, self._matcher)
         self._lock = threading.Lock()
-        for d in unique_dirs:
-            self._observer.schedule(self, d, recursive=True)
+        # monotonic times of the first and last events of the current burst
+        self._first_event: Optional[float] = None
+        self._last_event = 0.0
+        self._burst = threading.Condition(self._lock)
+        self._debouncer: Optional[threading.Thread] = None
+        watch_plan = watch_budget.plan(
+            recursive_dirs,
+            self._matcher,
+            None if max_watches is None else max_watches - len(file_dirs),
+            known_dirs,
+        )
+        # directories created in them are not watched and are polled instead
+        self._single_dirs = set(watch_plan.single)
+        for adir in watch_plan.recursive:
+            self._observer.schedule(self, adir, recursive=True)
+        for adir in watch_plan.single + file_dirs:
+            self._observer.schedule(self, adir, recursive=False)
+        self._poller: Optional[watch_budget.Poller] = None
+        if watch_plan.polled:
+            logging.warning(
+                "Watching %d directories (budget %d), polling every %gs: %s",
+                watch_plan.watches,
+                max_watches,
+                poll_interval,
+                ", ".join(watch_plan.polled),
+            )
+        if watch_plan.single:
+            self._poller = watch_budget.Poller(
+                watch_plan.polled, poll_interval, self._matcher, self.add_events
+            )
 
     def start(self):
         """Starts monitoring"""
@@ -34,50 +143,213 @@ class DirWatcher(FileSystemEventHandler):
             if self._started:
                 return
             self._observer.start()
+            if self._poller:
+                self._poller.start()
             self._started = True
             self._modified = False
+            self._paths.clear()
+            self._first_event = None
+            if self._debounce > 0:
+                self._debouncer = threading.Thread(target=self._debounce_bursts, daemon=True)
+                self._debouncer.start()
 
     def stop(self):
         """Stops the monitoring"""
         with self._lock:
             if not self._started:
                 return
-            self._observer.stop()
-            self._observer.join()
             self._started = False
+            self._burst.notify_all()
+        # joined without the lock: handlers and the debouncer take it
+        self._observer.stop()
+        self._observer.join()
+        if self._poller:
+            self._poller.stop()
+        if self._debouncer:
+            self._debouncer.join()
+            self._debouncer = None
+        with self._lock:
             self._modified = False
+            self._paths.clear()
+            self._first_event = None
 
     def on_created(self, event):
-        with self._lock:
-            logging.debug("Created %s", event.src_path)
-            self._modified = True
+        if self._ignored(event.src_path, event.is_directory):
+            return
+        logging.debug("Created %s", event.src_path)
+        if event.is_directory:
+            self._poll_new_dir(event.src_path)
+        self._add(event.src_path)
 
     def on_deleted(self, event):
-        with self._lock:
-            logging.debug("Deleted %s", event.src_path)
-            self._modified = True
+        if self._ignored(event.src_path, event.is_directory):
+            return
+        logging.debug("Deleted %s", event.src_path)
+        self._add(event.src_path)
 
     def on_modified(self, event):
-        with self._lock:
-            logging.debug("Modified %s", event.src_path)
-            self._modified = True
+        # a modified directory only means its listing changed and the entries created or
+        # deleted in it have their own events (which may be ignored)
+        if event.is_directory or self._ignored(event.src_path, False):
+            return
+        logging.debug("Modified %s", event.src_path)
+        self._add(event.src_path)
 
     def on_moved(self, event):
+        paths = [
+            path
+            for path in (event.src_path, event.dest_path)
+            if not self._ignored(path, event.is_directory)
+        ]
+        if not paths:
+            return
+        logging.debug("Moved %s to %s", event.src_path, event.dest_path)
+        if event.is_directory and event.dest_path in paths:
+            self._poll_new_dir(event.dest_path)
+        self._add(*paths)
+
+    def _ignored(self, path: str, is_dir: bool) -> bool:
+        """Checks if events on `path` should be dropped
+
+        Args:
+            path (str): path of the event
+            is_dir (bool): if `path` is a directory
+
+        Returns:
+            bool: True if `path` is not watched or if it or one of its parents under a watched
+                directory is ignored
+        """
+        if path in self._files:
+            return False
+        if path not in self._recursive_dirs and not path.startswith(self._recursive_prefixes):
+            # other entry in the directory of a watched file
+            return True
+        if self._matcher.refresh(path) is not None:
+            # rules read from `path` changed
+            self._ignored_dirs.clear()
+        return self._matcher.matches(path, is_dir) or self._ignored_dir(os.path.dirname(path))
+
+    def _ignored_dir(self, adir: str) -> bool:
+        """Checks if `adir` or one of its parents under a watched directory is ignored"""
+        if adir in self._roots:
+            return False
+        ignored = self._ignored_dirs.get(adir)
+        if ignored is None:
+            parent = os.path.dirname(adir)
+            if parent == adir:
+                # not under a watched directory
+                return False
+            ignored = self._ignored_dir(parent) or self._matcher.matches(adir, True)
+            if len(self._ignored_dirs) >= ignore_matcher.MAX_CACHED_DIRS:
+                self._ignored_dirs.clear()
+            self._ignored_dirs[adir] = ignored
+        return ignored
+
+    def add_events(self, events: Iterable[Tuple[str, bool]]) -> None:
+        """Records a batch of change events (used by backends reading events in batches)
+
+        Args:
+            events (Iterable[Tuple[str, bool]]): paths and if they are directories
+        """
+        paths = []
+        for path, is_dir in events:
+            if not self._ignored(path, is_dir):
+                if is_dir:
+                    self._poll_new_dir(path)
+                paths.append(path)
+        if paths:
+            logging.debug("Changed %s", paths)
+            self._add(*paths)
+
+    def _poll_new_dir(self, path: str) -> None:
+        """Polls `path` if it is a directory created in a directory watched without subdirectories
+
+        Args:
+            path (str): path of a created, moved, deleted or changed directory
+        """
+        if (
+            self._poller
+            and os.path.dirname(path) in self._single_dirs
+            and os.path.isdir(path)
+            and not os.path.islink(path)
+        ):
+            self._poller.add(path)
+
+    def _add(self, *paths: str) -> None:
+        """Records a change event on `paths` and wakes up the waiting thread
+
+        Args:
+            paths (str): paths to check because of the event
+        """
         with self._lock:
-            logging.debug("Moved %s to %s", event.src_path, event.dest_path)
             self._modified = True
+            self._paths.update(paths)
+            if self._debounce > 0:
+                self._last_event = time.monotonic()
+                if self._first_event is None:
+                    self._first_event = self._last_event
+                    self._burst.notify()
+                return
+        self._wakeup.set()
+
+    def _debounce_bursts(self) -> None:
+        """Sets `wakeup` once per burst of events
+
+        A burst ends after `debounce` seconds without events or `max_wait` seconds after its
+        first event.
+        """
+        with self._lock:
+            while self._started:
+                if self._first_event is None:
+                    self._burst.wait()
+                    continue
+                deadline = min(
+                    self._last_event + self._debounce, self._first_event + self._max_wait
+                )
+                remaining = deadline - time.monotonic()
+                if remaining > 0:
+                    self._burst.wait(remaining)
+                    continue
+                self._first_event = None
+                self._wakeup.set()
 
     @staticmethod
-    def _unify_dirs(files: List[str], dirs: List[str]) -> List[str]:
-        """Removes directories that are subdirs of other directories in the set"""
-        unique_dirs = {os.path.dirname(file)
-                       for file in files} if files else set()
-        unique_dirs = unique_dirs.union(set(dirs) if dirs else set())
-        watched: list[str] = []
-        for candidate in sorted(unique_dirs):
-            if not watched or not candidate.startswith(watched[-1]):
-                watched.append(candidate)
-        return watched
+    def _unify_dirs(files: List[str], dirs: List[str]) -> Tuple[List[str], List[str]]:
+        """Returns the directories to watch with and without subdirectories
+
+        Args:
+            files (List[str]): watched files
+            dirs (List[str]): watched directories
+
+        Returns:
+            (List[str], List[str]): `dirs` without the ones inside other directories and the
+                directories of `files` that are not inside them
+        """
+        recursive: List[str] = []
+        # sorted by components, subdirectories follow their parent (`/a/b.d` sorts before
+        # `/a/b/c` as a string)
+        for candidate in sorted(set(dirs or []), key=lambda adir: adir.split(os.sep)):
+            # `/a/b` contains `/a/b/c` but not `/a/bc`
+            if not recursive or not file_status.contains(recursive[-1], candidate):
+                recursive.append(candidate)
+        file_dirs = sorted(
+            {
+                adir
+                for adir in (os.path.dirname(file) for file in files or [])
+                if not any(file_status.contains(root, adir) for root in recursive)
+            }
+        )
+        return recursive, file_dirs
+
+    @property
+    def wakeup(self) -> threading.Event:
+        """Returns the event set on every change"""
+        return self._wakeup
+
+    def in_burst(self) -> bool:
+        """Checks if a burst of events is being debounced (`wakeup` is set when it ends)"""
+        with self._lock:
+            return self._first_event is not None
 
     def changed(self) -> bool:
         """Checks if there were any change events in watched dirs"""
@@ -85,3 +357,10 @@ class DirWatcher(FileSystemEventHandler):
             res = self._modified
             self._modified = False
         return res
+
+    def pop_events(self) -> Set[str]:
+        """Returns the paths with change events since the last call and forgets them"""
+        with self._lock:
+            res = self._paths
+            self._paths = set()
+        return res
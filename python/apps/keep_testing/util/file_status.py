@@ -1,43 +1,265 @@
 """Keep information on files and directories being watched"""
 
+import bisect
+import concurrent.futures
 import hashlib
+import json
+import logging
 import os
-import re
-from typing import Dict, List, Tuple
+from stat import S_ISREG
+import struct
+import sys
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+import zlib
+
+import apps.keep_testing.util.hashers as hashers
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+
+StatKey = Tuple[int, ...]
+
+# (size, mtime_ns, inode, device) packed in 32 bytes
+_STAT_STRUCT = struct.Struct("<qqQQ")
+# a file modified shortly before it was read can be rewritten without a new mtime (timestamps
+# can be as coarse as 2s): like git's "racily clean" entries, its hash is not reused
+_RACY_NS = 2_000_000_000
+# appended to the packed stat of those files, so it never equals a stat again
+_RACY = b"r"
+
+
+def stat_key(stat: os.stat_result) -> StatKey:
+    """Return the part of a stat that changes when a file is rewritten
+
+    Args:
+        stat (os.stat_result): the file stat
+
+    Returns:
+        StatKey: (size, mtime_ns, inode, device)
+    """
+    return (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev)
+
+
+def _entry_stat(entry: os.DirEntry) -> Optional[os.stat_result]:
+    """Return the stat of a scanned entry or None if it is gone"""
+    try:
+        return entry.stat()
+    except OSError:
+        return None
 
 
 class FileInfo:  # pylint: disable=too-few-public-methods
-    """Class that manages file info"""
+    """Class that manages file info
 
-    def __init__(self, path: str):
-        if os.path.isfile(path):
-            self._hash = FileInfo._calculate_hash(path)
-        else:
-            self._hash = ""
+    The content hash is only calculated when the stat differs from the `previous` info of the
+    same file, so unchanged files cost a stat and a touched file is still seen as unchanged.
+    Files modified less than 2s before they were read are hashed again on the next check: a
+    rewrite in the same timestamp tick keeps the same stat.
+
+    To keep big trees small in memory, the stat is packed in 32 bytes and the hash is the raw
+    digest. With a hasher that does not read contents the hash is empty and the stats are
+    compared instead.
+    """
+
+    __slots__ = ("_stat", "_hash")
+
+    def __init__(
+        self,
+        path: str,
+        stat: Optional[os.stat_result] = None,
+        previous: Optional["FileInfo"] = None,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+        pending: Optional[List[Tuple[str, "FileInfo"]]] = None,
+    ):
+        """Creates the info of file `path`
+
+        Args:
+            path (str): path to file
+            stat (os.stat_result): stat of the file (if None, it is read from `path`)
+            previous (FileInfo): info of the same file in the previous snapshot
+            hasher (hashers.Hasher): algorithm used to hash the file
+            pending (List[Tuple[str, FileInfo]]): if given, the hash is not calculated and
+                (path, self) is appended to it to be hashed later by `hash_pending`
+        """
+        self._stat = b""
+        self._hash = b""
+        if stat is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return
+        if not S_ISREG(stat.st_mode):
+            return
+        self._stat = _STAT_STRUCT.pack(*stat_key(stat))
+        if not hasher.content:
+            return
+        if previous is not None and previous._stat == self._stat:
+            self._hash = previous._hash
+            return
+        if pending is not None:
+            pending.append((path, self))
+            return
+        started = time.time_ns()
+        try:
+            self._hash = FileInfo._calculate_hash(path, hasher)
+        except OSError:
+            # file removed after stat
+            self._stat = b""
+            return
+        self._check_racy(started)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, FileInfo):
             return NotImplemented
-        return self._hash == other._hash
+        if self._hash or other._hash:
+            return self._hash == other._hash
+        # not hashed: not regular files or stat only comparison
+        return self._stat == other._stat
+
+    def _check_racy(self, started: int) -> None:
+        """Marks the stat of a file modified less than `_RACY_NS` before `started` (when its
+        contents started to be read) so its hash is not reused"""
+        if _STAT_STRUCT.unpack_from(self._stat)[1] >= started - _RACY_NS:
+            self._stat += _RACY
+
+    @property
+    def racy(self) -> bool:
+        """Checks if the hash may miss a rewrite that kept the stat (it is not reused)"""
+        return len(self._stat) > _STAT_STRUCT.size
+
+    @staticmethod
+    def from_cache(stat: StatKey, hash_: bytes) -> "FileInfo":
+        """Creates a FileInfo from values saved in a cache without touching the file
+
+        Args:
+            stat (StatKey): stat key of the file when the hash was calculated
+            hash_ (bytes): content hash
+
+        Returns:
+            FileInfo: the file info
+        """
+        file_info = FileInfo.__new__(FileInfo)
+        file_info._stat = _STAT_STRUCT.pack(*stat) if stat else b""
+        file_info._hash = hash_
+        return file_info
+
+    @property
+    def stat(self) -> StatKey:
+        """Returns the stat key (size, mtime_ns, inode, device) or () if not a regular file"""
+        return _STAT_STRUCT.unpack_from(self._stat) if self._stat else ()
+
+    @property
+    def digest(self) -> bytes:
+        """Returns the content hash (empty if not hashed)"""
+        return self._hash
+
+    @property
+    def key(self) -> bytes:
+        """Returns what comparisons use: the content hash, or the packed stat if not hashed"""
+        return self._hash or self._stat
 
     @staticmethod
-    def _calculate_hash(path: str):
+    def _calculate_hash(path: str, hasher: hashers.Hasher = hashers.DEFAULT) -> bytes:
         """Create a hash of file content
 
         Args:
             path (str): path to file
+            hasher (hashers.Hasher): algorithm used to hash the file
         """
-        hasher = hashlib.sha1()
-        with open(path, "rb") as file:
-            while True:
-                data = file.read(65536)
-                if not data:
-                    break
-                hasher.update(data)
-        return hasher.hexdigest()
+        return hasher.hash_file(path)
+
+
+def _hash_or_none(path: str, hasher: hashers.Hasher) -> Optional[bytes]:
+    """Return the hash of file `path` or None if it cannot be read"""
+    try:
+        return FileInfo._calculate_hash(path, hasher)  # pylint: disable=protected-access
+    except OSError:
+        return None
+
+
+def hash_pending(pending: List[Tuple[str, FileInfo]], hasher: hashers.Hasher) -> None:
+    """Calculate the hashes of FileInfos created with `pending`
+
+    Args:
+        pending (List[Tuple[str, FileInfo]]): files to hash and their FileInfos
+        hasher (hashers.Hasher): algorithm and threads used to hash files
+    """
+    paths = [path for path, _ in pending]
+    started = time.time_ns()
+    if hasher.workers > 1 and len(paths) > 1:
+        # hashlib releases the GIL while hashing, so threads read and hash in parallel
+        with concurrent.futures.ThreadPoolExecutor(max_workers=hasher.workers) as executor:
+            hashes = list(executor.map(lambda path: _hash_or_none(path, hasher), paths))
+    else:
+        hashes = [_hash_or_none(path, hasher) for path in paths]
+
+    # pylint: disable=protected-access
+    for (_, file_info), hash_ in zip(pending, hashes):
+        if hash_ is None:
+            # file removed after stat
+            file_info._stat = b""
+        else:
+            file_info._hash = hash_
+            file_info._check_racy(started)
+
+
+CREATED = "created"
+CHANGED = "changed"
+DELETED = "deleted"
+MOVED = "moved"
+
+
+class Change(NamedTuple):
+    """A created, changed, deleted or moved file or directory
+
+    Sorting changes sorts them by kind and path. `str` gives the text that is logged.
+    """
+
+    kind: str
+    path: str
+    # stat keys before and after the change (empty for directories and missing files)
+    old: StatKey = ()
+    new: StatKey = ()
+    # previous path of a moved file or directory (empty if not moved)
+    old_path: str = ""
+    # content hash of the file after the change (before if deleted; empty if not hashed)
+    digest: bytes = b""
+
+    def __str__(self) -> str:
+        if self.kind == MOVED:
+            return f"{self.kind} {self.old_path} to {self.path}"
+        return f"{self.kind} {self.path}"
+
+    def to_json(self) -> Dict[str, object]:
+        """Returns the change as a JSON object
+
+        Returns:
+            Dict[str, object]: kind, path, old and new stats (size, mtime_ns, ino and dev, or
+                null), old_path for moves and the hex digest of hashed files
+        """
+        result: Dict[str, object] = {
+            "kind": self.kind,
+            "path": self.path,
+            "old": _stat_json(self.old),
+            "new": _stat_json(self.new),
+        }
+        if self.old_path:
+            result["old_path"] = self.old_path
+        if self.digest:
+            result["digest"] = self.digest.hex()
+        return result
+
 
+_STAT_FIELDS = ("size", "mtime_ns", "ino", "dev")
 
-def _changed_files(lhs: Dict[str, FileInfo], rhs: Dict[str, FileInfo]) -> List[str]:
+
+def _stat_json(stat: StatKey) -> Optional[Dict[str, int]]:
+    """Returns a stat key as a JSON object (None if empty)"""
+    return dict(zip(_STAT_FIELDS, stat)) if stat else None
+
+
+def _changed_files(lhs: Dict[str, FileInfo], rhs: Dict[str, FileInfo]) -> List[Change]:
     """Return a list of files that has changed from lhs to rhs
 
     Args:
@@ -45,102 +267,642 @@ def _changed_files(lhs: Dict[str, FileInfo], rhs: Dict[str, FileInfo]) -> List[s
         rhs (Dict[str, FileInfo]): the second list
 
     Returns:
-        List[str]: list of changed files
+        List[Change]: list of changed files
     """
     if lhs == rhs:
         return []
 
     result = []
     for file_name, file_info in lhs.items():
-        if file_name not in rhs:
-            result.append(f"deleted {file_name}")
-        elif file_info != rhs[file_name]:
-            result.append(f"changed {file_name}")
+        other = rhs.get(file_name)
+        if other is None:
+            result.append(Change(DELETED, file_name, file_info.stat, digest=file_info.digest))
+        elif file_info != other:
+            result.append(
+                Change(CHANGED, file_name, file_info.stat, other.stat, digest=other.digest)
+            )
 
-    for file_name in rhs:
+    for file_name, file_info in rhs.items():
         if file_name not in lhs:
-            result.append(f"created {file_name}")
+            result.append(Change(CREATED, file_name, (), file_info.stat, digest=file_info.digest))
 
     return result
 
 
+FileTree = Dict[str, Dict[str, FileInfo]]
+
+_NO_FILES: Dict[str, FileInfo] = {}
+
+
+def _changed_trees(lhs: FileTree, rhs: FileTree) -> List[Change]:
+    """Return a list of files and directories that changed from lhs to rhs
+
+    Args:
+        lhs (FileTree): the first tree (directory X file name X FileInfo)
+        rhs (FileTree): the second tree (directory X file name X FileInfo)
+
+    Returns:
+        List[Change]: list of changed files and directories
+    """
+    result = []
+    for adir, files in lhs.items():
+        other = rhs.get(adir)
+        if other is None:
+            result.append(Change(DELETED, adir))
+            other = {}
+        if files != other:
+            result.extend(
+                _changed_files(
+                    {os.path.join(adir, name): info for name, info in files.items()},
+                    {os.path.join(adir, name): info for name, info in other.items()},
+                )
+            )
+
+    for adir, files in rhs.items():
+        if adir not in lhs:
+            result.append(Change(CREATED, adir))
+            result.extend(
+                Change(CREATED, os.path.join(adir, name), (), info.stat, digest=info.digest)
+                for name, info in files.items()
+            )
+
+    return result
+
+
+def detect_moves(changes: List[Change]) -> List[Change]:
+    """Pairs deleted and created files with the same content into moves
+
+    A deleted and a created file are the same file moved if they have the same stat (a rename
+    keeps inode, size and modification time) or, for files that are not empty, the same
+    content hash (preferring files with the same name). A moved directory whose whole
+    contents moved with it is a single move.
+
+    Args:
+        changes (List[Change]): changes of a comparison
+
+    Returns:
+        List[Change]: the changes with moves instead of their deletions and creations
+    """
+    deleted = [change for change in changes if change.kind == DELETED and change.old]
+    created = [change for change in changes if change.kind == CREATED and change.new]
+    if not deleted or not created:
+        return changes
+
+    # deleted path X move
+    moves: Dict[str, Change] = {}
+    by_stat = {change.old: change for change in deleted}
+    unpaired = []
+    for change in created:
+        old = by_stat.get(change.new)
+        if old is not None and old.path not in moves:
+            moves[old.path] = _moved(old, change)
+        else:
+            unpaired.append(change)
+    by_digest: Dict[bytes, List[Change]] = {}
+    for change in deleted:
+        # empty files all have the same content
+        if change.path not in moves and change.digest and change.old[0] > 0:
+            by_digest.setdefault(change.digest, []).append(change)
+    for change in unpaired:
+        candidates = by_digest.get(change.digest) if change.digest else None
+        if not candidates:
+            continue
+        name = os.path.basename(change.path)
+        old = next(
+            (old for old in candidates if os.path.basename(old.path) == name), candidates[0]
+        )
+        candidates.remove(old)
+        moves[old.path] = _moved(old, change)
+    if not moves:
+        return changes
+
+    moved_to = {move.path for move in moves.values()}
+    result = [
+        change
+        for change in changes
+        if not (change.kind == DELETED and change.path in moves)
+        and not (change.kind == CREATED and change.path in moved_to)
+    ]
+    result.extend(moves.values())
+    return _collapse_dir_moves(result)
+
+
+def _moved(old: Change, new: Change) -> Change:
+    """Returns the move of deleted file `old` to created file `new`"""
+    return Change(MOVED, new.path, old.old, new.new, old.path, new.digest)
+
+
+def _collapse_dir_moves(changes: List[Change]) -> List[Change]:
+    """Replaces the changes of directories moved with all their contents by single moves
+
+    Args:
+        changes (List[Change]): changes with moves of files
+
+    Returns:
+        List[Change]: the changes with moves of directories
+    """
+    # entries without stat: directories (and other entries that are not regular files)
+    deleted_dirs = {
+        change.path for change in changes if change.kind == DELETED and not change.old
+    }
+    created_dirs = {
+        change.path for change in changes if change.kind == CREATED and not change.new
+    }
+    candidates = set()
+    for move in changes:
+        if move.kind != MOVED:
+            continue
+        old_dir, new_dir = os.path.dirname(move.old_path), os.path.dirname(move.path)
+        # the moved directory may be any parent with the same relative path
+        while old_dir in deleted_dirs and new_dir in created_dirs:
+            candidates.add((old_dir, new_dir))
+            if os.path.basename(old_dir) != os.path.basename(new_dir):
+                break
+            old_dir, new_dir = os.path.dirname(old_dir), os.path.dirname(new_dir)
+    if not candidates:
+        return changes
+
+    by_path = sorted(changes, key=lambda change: change.path)
+    paths = [change.path for change in by_path]
+    moves = sorted(
+        (change for change in changes if change.kind == MOVED), key=lambda move: move.old_path
+    )
+    old_paths = [move.old_path for move in moves]
+
+    def _subtree(keys: List[str], values: List[Change], adir: str) -> List[Change]:
+        # `adir` and the paths inside it
+        start = bisect.bisect_left(keys, adir)
+        end = bisect.bisect_left(keys, adir + chr(ord(os.sep) + 1))
+        return [
+            value
+            for key, value in zip(keys[start:end], values[start:end])
+            if key == adir or key.startswith(os.path.join(adir, ""))
+        ]
+
+    removed: Set[int] = set()
+    collapsed: List[Tuple[str, str]] = []
+    # outermost first: the moves of its subdirectories are part of it
+    for old_dir, new_dir in sorted(candidates, key=lambda pair: len(pair[1])):
+        if any(contains(new, new_dir) for _, new in collapsed):
+            continue
+
+        def mirror(path: str, old_dir=old_dir, new_dir=new_dir) -> str:
+            return new_dir + path[len(old_dir):]
+
+        olds = _subtree(paths, by_path, old_dir)
+        news = _subtree(paths, by_path, new_dir)
+        moved = _subtree(old_paths, moves, old_dir)
+        mirrored = {mirror(change.path) for change in olds}
+        if (
+            all(change.kind == DELETED and not change.old for change in olds)
+            and mirrored <= created_dirs
+            and all(
+                (change.kind == CREATED and not change.new and change.path in mirrored)
+                or (change.kind == MOVED and mirror(change.old_path) == change.path)
+                for change in news
+            )
+            and all(mirror(move.old_path) == move.path for move in moved)
+        ):
+            collapsed.append((old_dir, new_dir))
+            removed.update(id(change) for change in olds + news + moved)
+    if not collapsed:
+        return changes
+    return [change for change in changes if id(change) not in removed] + [
+        Change(MOVED, new_dir, old_path=old_dir) for old_dir, new_dir in collapsed
+    ]
+
+
+def contains(adir: str, path: str) -> bool:
+    """Checks if `path` is `adir` or inside it"""
+    return path == adir or path.startswith(os.path.join(adir, ""))
+
+
+def _digest(files: Dict[str, FileInfo], children: List[Tuple[str, bytes]]) -> bytes:
+    """Return the digest of a directory from its files and the digests of its subdirectories
+
+    Args:
+        files (Dict[str, FileInfo]): files of the directory
+        children (List[Tuple[str, bytes]]): names and digests of its subdirectories (sorted)
+
+    Returns:
+        bytes: the digest (equal digests mean equal subtrees)
+    """
+    names = sorted(files)
+    # what FileInfo.__eq__ compares: the content hash, or the stat if not hashed
+    # pylint: disable=protected-access
+    keys = [files[name]._hash or files[name]._stat for name in names]
+    digest = hashlib.blake2b(b"%d\0%d" % (len(names), len(children)), digest_size=16)
+    # names cannot contain `/` and keys are shorter than 256 bytes
+    digest.update(os.fsencode("/".join(names + [name for name, _ in children])))
+    digest.update(bytes(map(len, keys)))
+    digest.update(b"".join(keys))
+    digest.update(b"".join(child for _, child in children))
+    return digest.digest()
+
+
+def _entries_digest(entries: List[Tuple[str, bytes]]) -> bytes:
+    """Returns the digest of (path, key) pairs (sorted)"""
+    digest = hashlib.blake2b(digest_size=16)
+    for path, key in entries:
+        encoded = os.fsencode(path)
+        digest.update(b"%d:%s%d:%s" % (len(encoded), encoded, len(key), key))
+    return digest.digest()
+
+
 class DirInfo:  # pylint: disable=too-few-public-methods
-    """Class that manages file info"""
+    """Class that manages file info
 
-    def __init__(self, path: str, ignore: List[re.Pattern]):
+    Files are kept per directory (directory X file name X FileInfo) so the entries of a subtree
+    can be found without going through all files.
+
+    Each directory also has a digest of its files and of the digests of its subdirectories
+    (like a Merkle tree), calculated with the scan and again when events change it. A directory
+    whose files and subdirectories kept their stats and digests since the `previous_info` scan
+    keeps its digest, so an unchanged tree is not digested again. Comparisons only descend into
+    subdirectories whose digests differ, so comparing equal snapshots checks one digest and a
+    changed file costs the depth of its directory.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        ignore: ignore_matcher.Ignore,
+        previous: Optional[FileTree] = None,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+        previous_info: Optional["DirInfo"] = None,
+    ):
         if not os.path.isdir(path):
             raise RuntimeError(f"File not found {path}")
         self._path = path
-        self._files, self._dirs = DirInfo._create_files_dirs(path, ignore)
+        self._hasher = hasher
+        # directory X digest of its subtree (missing if outdated)
+        self._tree, self._dirs, self._digests = DirInfo._create_files_dirs(
+            path, ignore, previous, hasher, previous_info
+        )
+        # directory X names of its subdirectories (None if outdated)
+        self._children: Optional[Dict[str, List[str]]] = None
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, DirInfo):
             return NotImplemented
-        return self._files == other._files and self._dirs == other._dirs
+        return self._path == other._path and self.digest() == other.digest()
 
-    def changed(self, other: object) -> List[str]:
+    def changed(self, other: object) -> List[Change]:
         """Return a list of changed files and directories
 
         Args:
             other (object): the other object
 
         Returns:
-            List[str]: changed files and directories
+            List[Change]: changed files and directories
         """
         if not isinstance(other, DirInfo):
             return []
 
-        if self._files == other.files and self._dirs == other.dirs:
+        if self._path != other._path:
+            return _changed_trees(self._tree, other._tree)
+
+        result = []
+        pending = [self._path]
+        while pending:
+            adir = pending.pop()
+            if self.digest(adir) == other.digest(adir):
+                continue
+            result.extend(
+                _changed_files(
+                    {os.path.join(adir, name): info for name, info in self._tree[adir].items()},
+                    {os.path.join(adir, name): info for name, info in other._tree[adir].items()},
+                )
+            )
+            children = self._children_of(adir)
+            other_children = other._children_of(adir)
+            for name in children:
+                child = os.path.join(adir, name)
+                if name in other_children:
+                    pending.append(child)
+                else:
+                    result.extend(_changed_trees(self._subtree(child), {}))
+            for name in other_children:
+                if name not in children:
+                    result.extend(_changed_trees({}, other._subtree(os.path.join(adir, name))))
+        return result
+
+    def digest(self, adir: Optional[str] = None) -> bytes:
+        """Returns the digest of the subtree in `adir`
+
+        Args:
+            adir (str): a directory of the tree (None for its root)
+
+        Returns:
+            bytes: the digest of its files and the digests of its subdirectories
+        """
+        adir = adir or self._path
+        digest = self._digests.get(adir)
+        if digest is not None:
+            return digest
+        # subdirectories first, without recursion (trees can be deep)
+        pending = [adir]
+        while pending:
+            current = pending[-1]
+            missing = [
+                child
+                for child in (os.path.join(current, name) for name in self._children_of(current))
+                if child not in self._digests
+            ]
+            if missing:
+                pending.extend(missing)
+                continue
+            pending.pop()
+            self._digests[current] = _digest(
+                self._tree[current],
+                [
+                    (name, self._digests[os.path.join(current, name)])
+                    for name in self._children_of(current)
+                ],
+            )
+        return self._digests[adir]
+
+    def matching_digest(
+        self, match: Callable[[str], bool], memo: Dict[str, Tuple[bytes, Optional[bytes]]]
+    ) -> Optional[bytes]:
+        """Returns the digest of the files of the tree accepted by `match` (None if there are
+        none)
+
+        Subtrees whose digests are the ones in `memo` have the same files as then: their
+        results are reused instead of matching their files again.
+
+        Args:
+            match (Callable[[str], bool]): accepts the paths of the files that count
+            memo (Dict[str, Tuple[bytes, Optional[bytes]]]): directory X digest of its subtree
+                and result, from previous calls with the same `match` (updated)
+
+        Returns:
+            Optional[bytes]: the digest of the relative paths and contents (or stats if not
+                hashed) of the accepted files
+        """
+        results: Dict[str, Optional[bytes]] = {}
+        # subdirectories first, without recursion (trees can be deep)
+        pending = [self._path]
+        while pending:
+            current = pending[-1]
+            digest = self.digest(current)
+            known = memo.get(current)
+            if known is not None and known[0] == digest:
+                results[current] = known[1]
+                pending.pop()
+                continue
+            names = self._children_of(current)
+            missing = [
+                child
+                for child in (os.path.join(current, name) for name in names)
+                if child not in results
+            ]
+            if missing:
+                pending.extend(missing)
+                continue
+            pending.pop()
+            entries = [
+                (name, info.key)
+                for name, info in self._tree[current].items()
+                if info.key and match(os.path.join(current, name))
+            ]
+            for name in names:
+                child = results[os.path.join(current, name)]
+                if child is not None:
+                    entries.append((name + os.sep, child))
+            result = _entries_digest(sorted(entries)) if entries else None
+            memo[current] = (digest, result)
+            results[current] = result
+        return results[self._path]
+
+    def files_in(self, path: str) -> List[str]:
+        """Returns the paths of the files in the subtree in `path` (none if it is not a
+        directory of the tree)"""
+        if path not in self._tree:
             return []
+        return [
+            os.path.join(adir, name)
+            for adir, files in self._subtree(path).items()
+            for name in files
+        ]
+
+    def _children_of(self, adir: str) -> List[str]:
+        """Returns the sorted names of the subdirectories of `adir`"""
+        if self._children is None:
+            self._children = {path: [] for path in self._tree}
+            for path in self._dirs:
+                parent, name = os.path.split(path)
+                self._children[parent].append(name)
+        return self._children[adir]
 
-        result = _changed_files(self._files, other.files)
+    def _subtree(self, path: str) -> FileTree:
+        """Returns the entries of the subtree in `path`"""
+        prefix = os.path.join(path, "")
+        start = bisect.bisect_left(self._dirs, prefix)
+        end = bisect.bisect_left(self._dirs, path + chr(ord(os.sep) + 1))
+        subtree = {path: self._tree[path]}
+        subtree.update((adir, self._tree[adir]) for adir in self._dirs[start:end])
+        return subtree
 
-        for adir in self._dirs:
-            if adir not in other.dirs:
-                result.append(f"deleted {adir}")
+    def _outdate(self, path: str) -> None:
+        """Forgets the digests of `path` and its parents"""
+        self._digests.pop(path, None)
+        while path != self._path:
+            path = os.path.dirname(path)
+            self._digests.pop(path, None)
 
-        for adir in other.dirs:
-            if adir not in self._dirs:
-                result.append(f"created {adir}")
+    def apply_event(self, path: str, ignore: ignore_matcher.Ignore) -> List[Change]:
+        """Update only the entries affected by a change event on `path`
+
+        Args:
+            path (str): path of the created, deleted or modified file or directory
+            ignore (Ignore): list of ignore rules or their matcher
 
+        Returns:
+            List[Change]: changed files and directories
+        """
+        matcher = ignore_matcher.create(ignore)
+        is_dir = os.path.isdir(path)
+        if path != self._path:
+            parent = os.path.dirname(path)
+            if parent not in self._tree or matcher.matches(path, is_dir):
+                # parent is ignored or not known yet (it will be scanned when created)
+                return []
+
+        result = []
+        if is_dir or path in self._tree:
+            result.extend(self._rescan(path, matcher, is_dir))
+        if path != self._path:
+            result.extend(self._update_file(path, is_dir))
+        if result:
+            self._outdate(path)
         return result
 
+    def _rescan(self, path: str, ignore: ignore_matcher.Ignore, is_dir: bool) -> List[Change]:
+        """Replace the entries of the subtree in `path` by a new scan
+
+        Args:
+            path (str): path of the directory
+            ignore (Ignore): list of ignore rules or their matcher
+            is_dir (bool): if `path` is currently a directory
+
+        Returns:
+            List[Change]: changed files and directories
+        """
+        old_tree = self._pop_subtree(path)
+        new_tree: FileTree = {}
+        new_dirs: List[str] = []
+        new_digests: Dict[str, bytes] = {}
+        if is_dir and not os.path.islink(path):
+            new_tree, new_dirs, new_digests = DirInfo._create_files_dirs(
+                path, ignore, old_tree, self._hasher
+            )
+        elif is_dir or path == self._path:
+            new_tree = {path: {}}
+
+        self._tree.update(new_tree)
+        for adir in old_tree:
+            self._digests.pop(adir, None)
+        self._digests.update(new_digests)
+        if old_tree.keys() != new_tree.keys():
+            self._children = None
+        if path != self._path and is_dir:
+            bisect.insort(self._dirs, path)
+        start = bisect.bisect_left(self._dirs, os.path.join(path, ""))
+        self._dirs[start:start] = new_dirs
+        return _changed_trees(old_tree, new_tree)
+
+    def _pop_subtree(self, path: str) -> FileTree:
+        """Remove and return the entries of the subtree in `path`
+
+        Args:
+            path (str): path of the directory
+
+        Returns:
+            FileTree: the removed entries
+        """
+        subtree: FileTree = {}
+        if path in self._tree:
+            subtree[path] = self._tree.pop(path)
+            if path != self._path:
+                del self._dirs[bisect.bisect_left(self._dirs, path)]
+
+        prefix = os.path.join(path, "")
+        start = end = bisect.bisect_left(self._dirs, prefix)
+        while end < len(self._dirs) and self._dirs[end].startswith(prefix):
+            subtree[self._dirs[end]] = self._tree.pop(self._dirs[end])
+            end += 1
+        del self._dirs[start:end]
+        return subtree
+
+    def _update_file(self, path: str, is_dir: bool) -> List[Change]:
+        """Update the entry of file `path`
+
+        Args:
+            path (str): path of the file
+            is_dir (bool): if `path` is currently a directory
+
+        Returns:
+            List[Change]: changed files
+        """
+        parent, name = os.path.split(path)
+        files = self._tree[parent]
+        old = files.pop(name, None)
+        if is_dir or not os.path.lexists(path):
+            if old is None:
+                return []
+            return [Change(DELETED, path, old.stat, digest=old.digest)]
+
+        new = FileInfo(path, previous=old, hasher=self._hasher)
+        files[sys.intern(name)] = new
+        if old is None:
+            return [Change(CREATED, path, (), new.stat, digest=new.digest)]
+        if new == old:
+            return []
+        return [Change(CHANGED, path, old.stat, new.stat, digest=new.digest)]
+
     @staticmethod
     def _create_files_dirs(
-        path: str, ignore: List[re.Pattern]
-    ) -> Tuple[Dict[str, FileInfo], List[str]]:
-        """Create a dict of files from the tree in path
+        path: str,
+        ignore: ignore_matcher.Ignore,
+        previous: Optional[FileTree] = None,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+        previous_info: Optional["DirInfo"] = None,
+    ) -> Tuple[FileTree, List[str], Dict[str, bytes]]:
+        """Create a tree of files from the tree in path
 
         Args:
             path (str): path to directory
-            ignore (List[re.Pattern]): list of ignore rules
-
-        Returns:
-            (Dict[str, FileInfo], List[str]): dictionary mapping file names to FileInfo and
-                a list of directories
-        """
-
-        def _is_matched(full_file: str, ignore: List[re.Pattern]):
-            for ign in ignore:
-                if ign.fullmatch(full_file):
-                    return True
-            return False
-
-        files = {}
-        dirs: list[str] = []
-        for dirpath, dirnames, filenames in os.walk(path):
-            for filename in filenames:
-                full_file = os.path.join(dirpath, filename)
-                if not _is_matched(full_file, ignore):
-                    files[full_file] = FileInfo(full_file)
-            for dirname in dirnames:
-                full_dir = os.path.join(dirpath, dirname)
-                if not _is_matched(full_dir, ignore):
-                    dirs.append(full_dir)
-                    subfiles, subdirs = DirInfo._create_files_dirs(full_dir, ignore)
-                    files.update(subfiles)
-                    dirs.extend(subdirs)
-        return files, sorted(dirs)
+            ignore (Ignore): list of ignore rules or their matcher
+            previous (FileTree): files of the previous snapshot
+            hasher (hashers.Hasher): algorithm and threads used to hash files
+            previous_info (DirInfo): previous scan of `path` whose digests are reused for the
+                directories that did not change
+
+        Returns:
+            (FileTree, List[str], Dict[str, bytes]): dictionary mapping directories (including
+                `path`) to their files, a sorted list of directories and their digests
+        """
+        entries, dirs = tree_scanner.scan_tree(path, ignore)
+        previous = previous or {}
+        # pylint: disable=protected-access
+        old_tree = previous_info._tree if previous_info is not None else {}
+        tree: FileTree = {adir: {} for adir in [path] + dirs}
+        # directory X number of files with the same stat as in `previous_info`
+        kept: Dict[str, int] = {}
+        pending: List[Tuple[str, FileInfo]] = []
+        for entry in entries:
+            adir = os.path.dirname(entry.path)
+            info = FileInfo(
+                entry.path,
+                _entry_stat(entry),
+                previous.get(adir, _NO_FILES).get(entry.name),
+                hasher,
+                pending,
+            )
+            # file names repeat a lot across directories (__init__.py, CMakeLists.txt, ...)
+            tree[adir][sys.intern(entry.name)] = info
+            old = old_tree.get(adir, _NO_FILES).get(entry.name)
+            if old is not None and old._stat == info._stat:
+                kept[adir] = kept.get(adir, 0) + 1
+        hash_pending(pending, hasher)
+
+        children: Dict[str, List[str]] = {adir: [] for adir in tree}
+        for adir in dirs:
+            parent, name = os.path.split(adir)
+            children[parent].append(name)
+        old_digests = previous_info._digests if previous_info is not None else {}
+        digests: Dict[str, bytes] = {}
+        reused: Set[str] = set()
+        # sorted paths follow their parents: reversed, subdirectories come first
+        for adir in reversed([path] + dirs):
+            names = children[adir]
+            digest = old_digests.get(adir)
+            if (
+                digest is not None
+                and previous_info is not None
+                and adir in old_tree
+                and kept.get(adir, 0) == len(tree[adir]) == len(old_tree[adir])
+                and len(names) == len(previous_info._children_of(adir))
+                and all(os.path.join(adir, name) in reused for name in names)
+            ):
+                # same files with the same stats and same subdirectories
+                reused.add(adir)
+            else:
+                digest = _digest(
+                    tree[adir], [(name, digests[os.path.join(adir, name)]) for name in names]
+                )
+            digests[adir] = digest
+        return tree, dirs, digests
+
+    @property
+    def tree(self) -> FileTree:
+        """Returns the files per directory (including this directory)
+
+        Returns:
+            FileTree: directory X file name X FileInfo
+        """
+        return self._tree
 
     @property
     def files(self) -> Dict[str, FileInfo]:
@@ -149,7 +911,11 @@ class DirInfo:  # pylint: disable=too-few-public-methods
         Returns:
             Dict[str, FileInfo]: the files
         """
-        return self._files
+        return {
+            os.path.join(adir, name): info
+            for adir, files in self._tree.items()
+            for name, info in files.items()
+        }
 
     @property
     def dirs(self) -> List[str]:
@@ -161,7 +927,7 @@ class DirInfo:  # pylint: disable=too-few-public-methods
         return self._dirs
 
 
-def _changed_dirs(lhs: Dict[str, DirInfo], rhs: Dict[str, DirInfo]) -> List[str]:
+def _changed_dirs(lhs: Dict[str, DirInfo], rhs: Dict[str, DirInfo]) -> List[Change]:
     """Return a list of files that has changed from lhs to rhs
 
     Args:
@@ -169,7 +935,7 @@ def _changed_dirs(lhs: Dict[str, DirInfo], rhs: Dict[str, DirInfo]) -> List[str]
         rhs (Dict[str, DirInfo]): the second list
 
     Returns:
-        List[str]: list of changed files
+        List[Change]: list of changed files
     """
     if lhs == rhs:
         return []
@@ -177,13 +943,13 @@ def _changed_dirs(lhs: Dict[str, DirInfo], rhs: Dict[str, DirInfo]) -> List[str]
     result = []
     for dir_name, dir_info in lhs.items():
         if dir_name not in rhs:
-            result.append(f"deleted {dir_name}")
+            result.append(Change(DELETED, dir_name))
         else:
             result.extend(dir_info.changed(rhs[dir_name]))
 
     for dir_name in rhs:
         if dir_name not in lhs:
-            result.append(f"created {dir_name}")
+            result.append(Change(CREATED, dir_name))
 
     return result
 
@@ -191,16 +957,51 @@ def _changed_dirs(lhs: Dict[str, DirInfo], rhs: Dict[str, DirInfo]) -> List[str]
 class DirsAndFiles:  # pylint: disable=too-few-public-methods
     """Class that manages DirInfos and FileInfos"""
 
-    def __init__(self, files: List[str], dirs: List[str], ignore: List[re.Pattern]):
-        self._file_infos = DirsAndFiles._create_file_infos(sorted(files))
+    def __init__(
+        self,
+        files: List[str],
+        dirs: List[str],
+        ignore: ignore_matcher.Ignore,
+        previous: Optional[FileTree] = None,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+    ):
+        """Creates the snapshot of the watched files and directories
+
+        Args:
+            files (List[str]): files to watch
+            dirs (List[str]): directories to watch
+            ignore (Ignore): list of ignore rules or their matcher
+            previous (FileTree): files of a previous snapshot (e.g. from a cache) used
+                to avoid hashing files whose stat did not change
+            hasher (hashers.Hasher): algorithm and threads used to hash files
+        """
+        self._hasher = hasher
+        self._file_infos = DirsAndFiles._create_file_infos(
+            sorted(files), previous, hasher
+        )
         self._ignore = ignore
-        self._dir_infos = DirsAndFiles._create_dir_infos(sorted(dirs), ignore)
+        # compiled once and shared by all scans and events
+        self._matcher = ignore_matcher.create(ignore)
+        self._dir_infos = DirsAndFiles._create_dir_infos(
+            sorted(dirs), self._matcher, previous, hasher
+        )
+        # key of a filter X directory X digest of its subtree and of its accepted files
+        self._matched: Dict[str, Dict[str, Tuple[bytes, Optional[bytes]]]] = {}
 
-    def update(self) -> List[str]:
+    def update(self) -> List[Change]:
         """Update directory and files info and return if anything changed"""
-        file_infos = DirsAndFiles._create_file_infos(sorted(self._file_infos.keys()))
+        # rules read from files (.gitignore) are read again too
+        self._matcher.refresh()
+        previous = self.snapshot()
+        file_infos = DirsAndFiles._create_file_infos(
+            sorted(self._file_infos.keys()), previous, self._hasher
+        )
         dir_infos = DirsAndFiles._create_dir_infos(
-            sorted(self._dir_infos.keys()), self._ignore
+            sorted(self._dir_infos.keys()),
+            self._matcher,
+            previous,
+            self._hasher,
+            self._dir_infos,
         )
 
         changed = _changed_files(self._file_infos, file_infos) + _changed_dirs(
@@ -209,29 +1010,308 @@ class DirsAndFiles:  # pylint: disable=too-few-public-methods
         self._file_infos = file_infos
         self._dir_infos = dir_infos
 
-        return sorted(changed)
+        return sorted(detect_moves(changed))
+
+    def apply_events(self, paths: Iterable[str]) -> List[Change]:
+        """Update only the entries affected by change events and return what changed
+
+        Args:
+            paths (Iterable[str]): paths of created, deleted, modified or moved files and
+                directories
+
+        Returns:
+            List[Change]: changed files and directories
+        """
+        changed = []
+        paths = set(paths)
+        # a changed ignore file changes which entries of its directory are watched
+        paths.update(
+            adir for adir in [self._matcher.refresh(path) for path in list(paths)] if adir
+        )
+        # parents before children: a created directory is scanned before its contents
+        for path in sorted(paths):
+            old = self._file_infos.get(path)
+            if old is not None:
+                new = FileInfo(path, previous=old, hasher=self._hasher)
+                if new != old:
+                    changed.append(Change(CHANGED, path, old.stat, new.stat, digest=new.digest))
+                self._file_infos[path] = new
+            for root, dir_info in self._dir_infos.items():
+                if path == root or path.startswith(os.path.join(root, "")):
+                    changed.extend(dir_info.apply_event(path, self._matcher))
+
+        return sorted(detect_moves(changed))
+
+    def expand_moves(self, changes: List[Change]) -> List[Change]:
+        """Returns `changes` plus the moves of the files in moved directories
+
+        A moved directory is a single change (see `detect_moves`): this gives the paths of the
+        files it moved, for what depends on them (e.g. the path patterns of commands).
+
+        Args:
+            changes (List[Change]): changes returned by `update` or `apply_events`
+
+        Returns:
+            List[Change]: the changes, sorted
+        """
+        result = list(changes)
+        for change in changes:
+            if change.kind != MOVED:
+                continue
+            for root, dir_info in self._dir_infos.items():
+                if contains(root, change.path):
+                    result.extend(
+                        Change(MOVED, path, old_path=change.old_path + path[len(change.path):])
+                        for path in dir_info.files_in(change.path)
+                    )
+                    break
+        return sorted(result)
+
+    @property
+    def dirs(self) -> List[str]:
+        """Returns the watched directories and the directories found in them
+
+        Returns:
+            List[str]: the directories (sorted)
+        """
+        result = set(self._dir_infos)
+        for dir_info in self._dir_infos.values():
+            result.update(dir_info.dirs)
+        return sorted(result)
+
+    def snapshot(self) -> FileTree:
+        """Returns all watched files (including the ones found in watched directories)
+
+        The dictionaries of files may be shared with the snapshot and must not be changed.
+
+        Returns:
+            FileTree: directory X file name X FileInfo
+        """
+        result: FileTree = {}
+        for dir_info in self._dir_infos.values():
+            for adir, files in dir_info.tree.items():
+                result[adir] = {**result[adir], **files} if adir in result else files
+        for path, file_info in self._file_infos.items():
+            adir, name = os.path.split(path)
+            result[adir] = {**result.get(adir, _NO_FILES), name: file_info}
+        return result
+
+    def digest(
+        self, match: Optional[Callable[[str], bool]] = None, key: Optional[str] = None
+    ) -> bytes:
+        """Returns a digest of the watched files (equal digests mean equal files)
+
+        Without `match`, the digests of the watched directories are reused, so it costs little
+        after a comparison. With `match` and `key`, only the subtrees that changed since the
+        last call with the same `key` are matched again.
+
+        Args:
+            match (Callable[[str], bool]): if given, only the files whose paths it accepts count
+            key (str): identifies `match` between calls (None: nothing is reused)
+
+        Returns:
+            bytes: the digest of the paths and contents (or stats if not hashed) of the files
+        """
+        if match is None:
+            entries = [(path, info.key) for path, info in self._file_infos.items()]
+            entries.extend(
+                (adir, dir_info.digest()) for adir, dir_info in self._dir_infos.items()
+            )
+        else:
+            memo = self._matched.setdefault(key, {}) if key is not None else {}
+            entries = [
+                (path, info.key)
+                for path, info in self._file_infos.items()
+                if info.key and match(path)
+            ]
+            for adir, dir_info in self._dir_infos.items():
+                digest = dir_info.matching_digest(match, memo)
+                if digest is not None:
+                    entries.append((adir, digest))
+        return _entries_digest(sorted(entries))
+
+    def cache_key(self) -> str:
+        """Returns the key identifying the watched roots and ignore rules in a cache"""
+        return cache_key(
+            list(self._file_infos.keys()),
+            list(self._dir_infos.keys()),
+            self._ignore,
+            self._hasher.algorithm,
+        )
+
+    def save(self, cache_file: str) -> None:
+        """Saves the snapshot to `cache_file` so it can be reloaded with `load`
+
+        Args:
+            cache_file (str): path to the cache file
+        """
+        entries = {
+            adir: [
+                [name, *file_info.stat, file_info.digest.hex()]
+                for name, file_info in files.items()
+                # racy files are hashed again when loaded
+                if file_info.stat and not file_info.racy
+            ]
+            for adir, files in self.snapshot().items()
+        }
+        data = {"version": _CACHE_VERSION, "key": self.cache_key(), "dirs": entries}
+        os.makedirs(os.path.dirname(os.path.abspath(cache_file)), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as file:
+            file.write(zlib.compress(json.dumps(data, separators=(",", ":")).encode()))
+        os.replace(tmp_file, cache_file)
 
     @staticmethod
-    def _create_file_infos(files: List[str]) -> Dict[str, FileInfo]:
+    def load(
+        cache_file: str,
+        files: List[str],
+        dirs: List[str],
+        ignore: ignore_matcher.Ignore,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+    ) -> "DirsAndFiles":
+        """Creates the snapshot reusing the hashes saved in `cache_file`
+
+        Only files whose stat changed since the cache was saved are hashed. If the cache file
+        does not exist, is invalid or was saved for other roots or ignore rules, it is not used.
+
+        Args:
+            cache_file (str): path to the cache file
+            files (List[str]): files to watch
+            dirs (List[str]): directories to watch
+            ignore (Ignore): list of ignore rules or their matcher
+            hasher (hashers.Hasher): algorithm and threads used to hash files
+
+        Returns:
+            DirsAndFiles: the snapshot
+        """
+        return DirsAndFiles(
+            files,
+            dirs,
+            ignore,
+            _read_cache(cache_file, cache_key(files, dirs, ignore, hasher.algorithm)),
+            hasher,
+        )
+
+    @staticmethod
+    def _create_file_infos(
+        files: List[str],
+        previous: Optional[FileTree] = None,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+    ) -> Dict[str, FileInfo]:
         """Create a dict of file X FileInfo
 
         Args:
             files (List[str]): list of files
+            previous (FileTree): files of the previous snapshot
+            hasher (hashers.Hasher): algorithm and threads used to hash files
 
         Returns:
             [Dict[str, FileInfo]: dictionary mapping file names to FileInfo
         """
-        return {file: FileInfo(file) for file in files}
+        previous = previous or {}
+        pending: List[Tuple[str, FileInfo]] = []
+        file_infos = {}
+        for file in files:
+            adir, name = os.path.split(file)
+            file_infos[file] = FileInfo(
+                file,
+                previous=previous.get(adir, _NO_FILES).get(name),
+                hasher=hasher,
+                pending=pending,
+            )
+        hash_pending(pending, hasher)
+        return file_infos
 
     @staticmethod
-    def _create_dir_infos(dirs: List[str], ignore: List[re.Pattern]):
+    def _create_dir_infos(
+        dirs: List[str],
+        ignore: ignore_matcher.Ignore,
+        previous: Optional[FileTree] = None,
+        hasher: hashers.Hasher = hashers.DEFAULT,
+        previous_infos: Optional[Dict[str, DirInfo]] = None,
+    ):
         """Create a dict of dir X DirInfo
 
         Args:
             dirs (List[str]): list of directories
-            ignore (List[re.Pattern]): list of ignore rules
+            ignore (Ignore): list of ignore rules or their matcher
+            previous (FileTree): files of the previous snapshot
+            hasher (hashers.Hasher): algorithm and threads used to hash files
+            previous_infos (Dict[str, DirInfo]): DirInfos of the previous snapshot, whose
+                digests are reused for unchanged directories
 
         Returns:
             [Dict[str, DirInfo]: dictionary mapping dir names to DirInfo
         """
-        return {adir: DirInfo(adir, ignore) for adir in dirs}
+        previous_infos = previous_infos or {}
+        return {
+            adir: DirInfo(adir, ignore, previous, hasher, previous_infos.get(adir))
+            for adir in dirs
+        }
+
+
+_CACHE_VERSION = 2
+
+
+def cache_key(
+    files: List[str],
+    dirs: List[str],
+    ignore: ignore_matcher.Ignore,
+    algorithm: str = hashers.DEFAULT_ALGORITHM,
+) -> str:
+    """Returns the key identifying watched roots, ignore rules and hash algorithm in a cache
+
+    Args:
+        files (List[str]): files to watch
+        dirs (List[str]): directories to watch
+        ignore (Ignore): list of ignore rules or their matcher
+        algorithm (str): name of the hash algorithm
+
+    Returns:
+        str: the key
+    """
+    text = json.dumps(
+        [sorted(files), sorted(dirs), ignore_matcher.create(ignore).key(), algorithm]
+    )
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _read_cache(cache_file: str, key: str) -> FileTree:
+    """Reads the files saved in `cache_file` if it was saved with `key`
+
+    Args:
+        cache_file (str): path to the cache file
+        key (str): expected cache key
+
+    Returns:
+        FileTree: directory X file name X FileInfo (empty if cache is not usable)
+    """
+    try:
+        with open(cache_file, "rb") as file:
+            data = json.loads(zlib.decompress(file.read()))
+        if data["version"] != _CACHE_VERSION or data["key"] != key:
+            logging.info("Ignoring cache %s created for other settings", cache_file)
+            return {}
+        return {
+            adir: {
+                sys.intern(entry[0]): FileInfo.from_cache(
+                    tuple(entry[1:-1]), bytes.fromhex(entry[-1])
+                )
+                for entry in entries
+            }
+            for adir, entries in data["dirs"].items()
+        }
+    except FileNotFoundError:
+        return {}
+    except (
+        OSError,
+        ValueError,
+        KeyError,
+        IndexError,
+        TypeError,
+        AttributeError,
+        struct.error,
+        zlib.error,
+    ) as error:
+        logging.warning("Ignoring invalid cache %s: %s", cache_file, error)
+        return {}
@@ -0,0 +1,252 @@
+"""Ignore rules read from .gitignore and .ignore files"""
+
+import logging
+import os
+import re
+from typing import Dict, List, Optional, Set, Tuple
+
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+
+# read in this order in each directory: later rules take precedence
+RULES_FILES = (".gitignore", ".ignore")
+_GIT_DIR = ".git"
+
+# (regex matching the full path, negated, only directories)
+Rule = Tuple[re.Pattern, bool, bool]
+
+
+def _translate_glob(pattern: str) -> Optional[str]:
+    """Translates a gitignore glob to a regex
+
+    Args:
+        pattern (str): glob without leading `!`, leading `/` and trailing `/`
+
+    Returns:
+        str: the regex or None if the glob is invalid
+    """
+    result = []
+    index = 0
+    size = len(pattern)
+    while index < size:
+        char = pattern[index]
+        if char == "*":
+            end = index
+            while end < size and pattern[end] == "*":
+                end += 1
+            whole_part = (index == 0 or pattern[index - 1] == "/") and (
+                end == size or pattern[end] == "/"
+            )
+            if end - index == 2 and whole_part:
+                if end == size:
+                    # `dir/**`: everything inside
+                    result.append(".*")
+                else:
+                    # `**/`: zero or more directories
+                    result.append("(?:.*/)?")
+                    end += 1
+            else:
+                result.append("[^/]*")
+            index = end
+            continue
+        if char == "?":
+            result.append("[^/]")
+        elif char == "[":
+            end = index + 1
+            if end < size and pattern[end] in "!^":
+                end += 1
+            if end < size and pattern[end] == "]":
+                end += 1
+            while end < size and pattern[end] != "]":
+                end += 1
+            if end >= size:
+                result.append(re.escape(char))
+            else:
+                content = pattern[index + 1: end]
+                negated = content[0] in "!^"
+                content = "".join(
+                    member if member == "-" else re.escape(member)
+                    for member in (content[1:] if negated else content)
+                )
+                result.append(f"(?!/)[{'^' if negated else ''}{content}]")
+                index = end
+        elif char == "\\":
+            index += 1
+            if index >= size:
+                return None
+            result.append(re.escape(pattern[index]))
+        else:
+            result.append(re.escape(char))
+        index += 1
+    return "".join(result)
+
+
+def parse_line(base: str, line: str) -> Optional[Rule]:
+    """Creates the rule of a line of an ignore file
+
+    Args:
+        base (str): directory of the ignore file
+        line (str): the line
+
+    Returns:
+        Rule: the rule or None if the line is blank, a comment or invalid
+    """
+    line = line.rstrip("\r\n")
+    if line.startswith("#"):
+        return None
+    # trailing spaces are ignored unless escaped
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    only_dirs = line.endswith("/")
+    if only_dirs:
+        line = line[:-1]
+    if not line:
+        return None
+    # a slash at the beginning or middle makes the pattern relative to `base`
+    anchored = "/" in line
+    body = _translate_glob(line[1:] if line.startswith("/") else line)
+    if body is None:
+        return None
+    prefix = re.escape(os.path.join(base, "")) + ("" if anchored else "(?:.*/)?")
+    try:
+        # `*` matches any character but `/`, new lines included
+        return re.compile(prefix + body, re.DOTALL), negated, only_dirs
+    except re.error:
+        return None
+
+
+def read_rules(adir: str, files: Tuple[str, ...] = RULES_FILES) -> List[Rule]:
+    """Reads the rules of the ignore files in `adir`
+
+    Args:
+        adir (str): the directory
+        files (Tuple[str, ...]): relative paths of the ignore files, in order of precedence
+
+    Returns:
+        List[Rule]: the rules (last matching rule wins)
+    """
+    rules: List[Rule] = []
+    for name in files:
+        path = os.path.join(adir, name)
+        try:
+            with open(path, "r", encoding="utf_8", errors="replace") as file:
+                lines = file.readlines()
+        except FileNotFoundError:
+            continue
+        except OSError as error:
+            logging.warning("Could not read %s: %s", path, error)
+            continue
+        rules.extend(rule for rule in (parse_line(adir, line) for line in lines) if rule)
+    return rules
+
+
+class _DirRules:  # pylint: disable=too-few-public-methods
+    """Rules that apply to the entries of a directory (its own and its parents')"""
+
+    def __init__(self, rules: Tuple[Rule, ...]) -> None:
+        self.rules = rules
+        self._any: Optional[re.Pattern] = None
+        self._dirs: Optional[re.Pattern] = None
+        if not any(negated for _, negated, _ in rules):
+            # without negations the order does not matter: a single check per path
+            self._any = _DirRules._fuse([regex for regex, _, only_dirs in rules if not only_dirs])
+            self._dirs = _DirRules._fuse([regex for regex, _, _ in rules])
+
+    @staticmethod
+    def _fuse(regexes: List[re.Pattern]) -> re.Pattern:
+        """Returns a regex matching any of `regexes`"""
+        if not regexes:
+            # never matches
+            return re.compile(r"(?!)")
+        return re.compile("|".join(f"(?:{regex.pattern})" for regex in regexes), re.DOTALL)
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        """Checks if `path`, an entry of the directory, is ignored"""
+        fused = self._dirs if is_dir else self._any
+        if fused is not None:
+            return fused.fullmatch(path) is not None
+        for regex, negated, only_dirs in reversed(self.rules):
+            if (is_dir or not only_dirs) and regex.fullmatch(path):
+                return not negated
+        return False
+
+
+_NO_RULES = _DirRules(())
+
+
+class GitignoreMatcher(ignore_matcher.IgnoreMatcher):
+    """Ignore rules plus the rules of .gitignore and .ignore files
+
+    The ignore files of each directory are read once, when its entries are first checked, and
+    combined with the ones of its parents (up to the root of the git repository or the watched
+    directory). `.git` directories are always ignored.
+    """
+
+    def __init__(self, rules: List[re.Pattern], roots: List[str]) -> None:
+        """Creates the matcher
+
+        Args:
+            rules (List[re.Pattern]): ignore rules (regexes that must match the full path)
+            roots (List[str]): watched directories
+        """
+        super().__init__(rules)
+        self._tops: Set[str] = {GitignoreMatcher._top(root) for root in roots}
+        self._dir_rules: Dict[str, _DirRules] = {}
+
+    @staticmethod
+    def _top(root: str) -> str:
+        """Returns the root of the git repository of `root` (or `root` if not in one)"""
+        adir = root
+        while True:
+            if os.path.exists(os.path.join(adir, _GIT_DIR)):
+                return adir
+            parent = os.path.dirname(adir)
+            if parent == adir:
+                return root
+            adir = parent
+
+    def key(self) -> List[str]:
+        return super().key() + list(RULES_FILES)
+
+    def refresh(self, path: Optional[str] = None) -> Optional[str]:
+        if path is None:
+            self._dir_rules.clear()
+            self._dir_cache.clear()
+            return None
+        adir, name = os.path.split(path)
+        if name not in RULES_FILES:
+            return None
+        prefix = os.path.join(adir, "")
+        # the watcher thread may be adding rules meanwhile
+        for cached in [cached for cached in list(self._dir_rules) if cached.startswith(prefix)]:
+            del self._dir_rules[cached]
+        self._dir_rules.pop(adir, None)
+        self._dir_cache.clear()
+        return adir
+
+    def _rules_of(self, adir: str) -> _DirRules:
+        """Returns the rules that apply to the entries of `adir`"""
+        dir_rules = self._dir_rules.get(adir)
+        if dir_rules is None:
+            parent = os.path.dirname(adir)
+            if adir in self._tops or parent == adir:
+                inherited = _NO_RULES
+                own = read_rules(adir, (os.path.join(_GIT_DIR, "info", "exclude"),))
+            else:
+                inherited = self._rules_of(parent)
+                own = []
+            own.extend(read_rules(adir))
+            # most directories have no ignore files: share the parent's rules
+            dir_rules = _DirRules(inherited.rules + tuple(own)) if own else inherited
+            self._dir_rules[adir] = dir_rules
+        return dir_rules
+
+    def _matches(self, path: str, is_dir: bool) -> bool:
+        if super()._matches(path, is_dir):
+            return True
+        adir, name = os.path.split(path)
+        if name == _GIT_DIR:
+            return True
+        return self._rules_of(adir).matches(path, is_dir)
@@ -0,0 +1,155 @@
+"""Algorithms used to hash the content of watched files"""
+
+import functools
+import hashlib
+import io
+import os
+import zlib
+from typing import Any, Callable, Dict, List, Optional, Union
+
+Buffer = Union[bytes, memoryview]
+
+HashFunction = Callable[[str], bytes]
+
+DEFAULT_ALGORITHM = "sha1"
+NONE = "none"
+
+# files from this size on are read into a single reusable buffer instead of one bytes object
+# per read (files are not memory mapped: a file truncated while mapped kills the process)
+_LARGE_FILE_SIZE = 2**20
+_BUFFER_SIZE = 2**20
+
+
+def _feed(file: io.RawIOBase, size: int, update: Callable[[Buffer], object]) -> None:
+    """Passes the content of `file` to `update` without allocating per read
+
+    Args:
+        file (io.RawIOBase): file opened without buffering
+        size (int): size of the file
+        update (Callable): function receiving each piece of content
+    """
+    if size < _LARGE_FILE_SIZE:
+        update(file.read())
+        return
+    buffer = bytearray(_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        count = file.readinto(buffer)
+        if not count:
+            break
+        update(view[:count])
+
+
+def _hashlib_file(factory: Callable[[], Any]) -> HashFunction:
+    """Creates a function that hashes a file with a hashlib algorithm
+
+    Args:
+        factory (Callable): creates the hashlib object (e.g. a `functools.partial` with parameters)
+
+    Returns:
+        HashFunction: function that returns the digest of a file
+    """
+
+    def _hash(path: str) -> bytes:
+        with open(path, "rb", buffering=0) as file:
+            size = os.fstat(file.fileno()).st_size
+            if size >= _LARGE_FILE_SIZE and hasattr(hashlib, "file_digest"):
+                return hashlib.file_digest(file, factory).digest()
+            hasher = factory()
+            _feed(file, size, hasher.update)
+        return hasher.digest()
+
+    return _hash
+
+
+def _crc32_file(path: str) -> bytes:
+    """Returns the CRC-32 of a file"""
+    crc = 0
+
+    def _update(data: Buffer) -> None:
+        nonlocal crc
+        crc = zlib.crc32(data, crc)
+
+    with open(path, "rb", buffering=0) as file:
+        _feed(file, os.fstat(file.fileno()).st_size, _update)
+    return crc.to_bytes(4, "big")
+
+
+_ALGORITHMS: Dict[str, Optional[HashFunction]] = {
+    "sha1": _hashlib_file(hashlib.sha1),
+    "blake2b": _hashlib_file(functools.partial(hashlib.blake2b, digest_size=20)),
+    "crc32": _crc32_file,
+    NONE: None,
+}
+
+
+def register(name: str, function: HashFunction) -> None:
+    """Registers a hash algorithm
+
+    Args:
+        name (str): name used to select the algorithm
+        function (HashFunction): function that returns the hash of a file as bytes
+    """
+    _ALGORITHMS[name] = function
+
+
+def algorithms() -> List[str]:
+    """Returns the names of the registered algorithms"""
+    return sorted(_ALGORITHMS)
+
+
+class Hasher:
+    """Hashes file contents with a registered algorithm
+
+    Algorithm `none` does not read files: changes are detected comparing stats only.
+    """
+
+    def __init__(self, algorithm: str = DEFAULT_ALGORITHM, workers: int = 1) -> None:
+        """Creates the hasher
+
+        Args:
+            algorithm (str): name of a registered algorithm
+            workers (int): number of threads hashing files concurrently
+
+        Raises:
+            ValueError: if the algorithm is unknown or `workers` is less than 1
+        """
+        if algorithm not in _ALGORITHMS:
+            raise ValueError(
+                f"Unknown hash algorithm '{algorithm}' (use one of {', '.join(algorithms())})"
+            )
+        if workers < 1:
+            raise ValueError("Number of hash workers should be at least 1")
+        self._algorithm = algorithm
+        self._function = _ALGORITHMS[algorithm]
+        self._workers = workers
+
+    @property
+    def algorithm(self) -> str:
+        """Returns the name of the algorithm"""
+        return self._algorithm
+
+    @property
+    def workers(self) -> int:
+        """Returns the number of threads hashing files"""
+        return self._workers
+
+    @property
+    def content(self) -> bool:
+        """Returns if the algorithm reads the content of files (False for `none`)"""
+        return self._function is not None
+
+    def hash_file(self, path: str) -> bytes:
+        """Returns the hash of the content of file `path` (empty for `none`)
+
+        Args:
+            path (str): path to file
+        """
+        if self._function is None:
+            return b""
+        return self._function(path)
+
+
+DEFAULT = Hasher()
+# files compared by their stats only (e.g. polling)
+STAT_ONLY = Hasher(NONE)
@@ -0,0 +1,187 @@
+"""Matcher of ignore rules fusing all rules in a single check"""
+
+import re
+from typing import Dict, List, Optional, Union
+
+_METACHARS = set(".^$*+?{}[]|()")
+_ANY = ".*"
+# group numbers and names change when regexes are fused
+_BACKREFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+# directory decisions are reused between scans and events; bounded to not grow forever
+MAX_CACHED_DIRS = 100000
+
+
+def _literal(text: str) -> Optional[str]:
+    """Returns the text matched by regex `text` if it only matches a literal
+
+    Args:
+        text (str): regular expression
+
+    Returns:
+        str: the literal text or None if `text` has special constructions
+    """
+    result = []
+    escaped = False
+    for char in text:
+        if escaped:
+            if char.isalnum():
+                # \d, \b, \1, ...
+                return None
+            result.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in _METACHARS:
+            return None
+        else:
+            result.append(char)
+    return None if escaped else "".join(result)
+
+
+class IgnoreMatcher:
+    """Checks paths against all ignore rules (regexes that must match the full path)
+
+    Rules like `.*literal`, `literal.*`, `.*literal.*` and `literal` are checked with string
+    operations and the others are fused in a single alternation, so each path is checked once
+    instead of once per rule. Results for directories are cached.
+    """
+
+    def __init__(self, rules: List[re.Pattern]) -> None:
+        """Creates the matcher
+
+        Args:
+            rules (List[re.Pattern]): ignore rules
+        """
+        self._rules = list(rules)
+        self._exact = set()
+        prefixes = []
+        suffixes = []
+        self._contains: List[str] = []
+        regexes: List[re.Pattern] = []
+        for rule in self._rules:
+            text = rule.pattern
+            starts_any = text.startswith(_ANY)
+            body = text[len(_ANY):] if starts_any else text
+            ends_any = body.endswith(_ANY) and not body.endswith("\\" + _ANY)
+            body = body[: -len(_ANY)] if ends_any else body
+            literal = _literal(body) if not rule.flags & ~re.UNICODE else None
+            if literal is None or (starts_any and ends_any and not literal):
+                regexes.append(rule)
+            elif starts_any and ends_any:
+                self._contains.append(literal)
+            elif starts_any:
+                suffixes.append(literal)
+            elif ends_any:
+                prefixes.append(literal)
+            else:
+                self._exact.add(literal)
+        self._prefixes = tuple(prefixes)
+        self._suffixes = tuple(suffixes)
+        self._regexes = IgnoreMatcher._fuse(regexes)
+        self._dir_cache: Dict[str, bool] = {}
+
+    @staticmethod
+    def _fuse(regexes: List[re.Pattern]) -> List[re.Pattern]:
+        """Fuses regexes in a single alternation when possible
+
+        Args:
+            regexes (List[re.Pattern]): the regexes
+
+        Returns:
+            List[re.Pattern]: the fused regex followed by the ones that cannot be fused (flags
+                or backreferences)
+        """
+        fusable = [
+            regex
+            for regex in regexes
+            if not regex.flags & ~re.UNICODE and not _BACKREFERENCE.search(regex.pattern)
+        ]
+        others = [regex for regex in regexes if regex not in fusable]
+        if len(fusable) < 2:
+            return regexes
+        try:
+            fused = re.compile("|".join(f"(?:{regex.pattern})" for regex in fusable))
+        except re.error:
+            # e.g. inline global flags or repeated group names
+            return regexes
+        return [fused] + others
+
+    @property
+    def rules(self) -> List[re.Pattern]:
+        """Returns the ignore rules"""
+        return self._rules
+
+    def key(self) -> List[str]:
+        """Returns what identifies the rules in snapshot caches"""
+        return [rule.pattern for rule in self._rules]
+
+    def refresh(self, path: Optional[str] = None) -> Optional[str]:
+        """Forgets results that depend on the content of `path` (everything if None)
+
+        Rules given as regexes never change; subclasses reading rules from files override it.
+
+        Args:
+            path (str): path of a created, deleted or modified file
+
+        Returns:
+            str: directory whose entries must be checked again because its rules changed (None
+                if no rules changed)
+        """
+        # pylint: disable=unused-argument
+        return None
+
+    def matches(self, path: str, is_dir: bool = False) -> bool:
+        """Checks if `path` should be ignored
+
+        Args:
+            path (str): full path of file or directory
+            is_dir (bool): if `path` is a directory (its result is cached)
+
+        Returns:
+            bool: True if the path should be ignored
+        """
+        if is_dir:
+            cached = self._dir_cache.get(path)
+            if cached is None:
+                if len(self._dir_cache) >= MAX_CACHED_DIRS:
+                    self._dir_cache.clear()
+                cached = self._dir_cache[path] = self._matches(path, True)
+            return cached
+        return self._matches(path, False)
+
+    def _matches(self, path: str, is_dir: bool) -> bool:
+        """Checks `path` against all rules"""
+        # pylint: disable=unused-argument
+        if "\n" in path:
+            # string checks assume `.` matches any character
+            return any(rule.fullmatch(path) for rule in self._rules)
+        if path in self._exact:
+            return True
+        if self._suffixes and path.endswith(self._suffixes):
+            return True
+        if self._prefixes and path.startswith(self._prefixes):
+            return True
+        for literal in self._contains:
+            if literal in path:
+                return True
+        for regex in self._regexes:
+            if regex.fullmatch(path):
+                return True
+        return False
+
+
+Ignore = Union[List[re.Pattern], IgnoreMatcher]
+
+
+def create(ignore: Ignore) -> IgnoreMatcher:
+    """Returns a matcher for `ignore`
+
+    Args:
+        ignore (Ignore): ignore rules or a matcher (returned as is)
+
+    Returns:
+        IgnoreMatcher: the matcher
+    """
+    if isinstance(ignore, IgnoreMatcher):
+        return ignore
+    return IgnoreMatcher(ignore)
@@ -0,0 +1,207 @@
+"""Linux inotify backend for DirWatcher reading raw events in batches"""
+
+import logging
+import os
+import select
+import struct
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import inotify.calls
+import inotify.constants as flags
+
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+# (path, is directory)
+Event = Tuple[str, bool]
+
+# wd, mask, cookie, length of name (struct inotify_event)
+_HEADER = struct.Struct("iIII")
+# many events per read: one system call and one batch for the whole burst
+_READ_SIZE = 2**16
+
+_MASK = (
+    flags.IN_CREATE
+    | flags.IN_DELETE
+    | flags.IN_MODIFY
+    | flags.IN_ATTRIB
+    | flags.IN_MOVED_FROM
+    | flags.IN_MOVED_TO
+    | flags.IN_DELETE_SELF
+    | flags.IN_MOVE_SELF
+    | flags.IN_ONLYDIR
+)
+# a modified directory only means its listing changed
+_DIR_CHANGES = flags.IN_CREATE | flags.IN_DELETE | flags.IN_MOVED_FROM | flags.IN_MOVED_TO
+_NEW_DIR = flags.IN_CREATE | flags.IN_MOVED_TO
+_SELF = flags.IN_DELETE_SELF | flags.IN_MOVE_SELF
+
+
+class InotifyObserver:
+    """Watches directories with inotify and passes batches of events to the handler
+
+    It has the interface of watchdog's `Observer` used by DirWatcher (`schedule`, `start`,
+    `stop` and `join`), but a single thread reads the events of all watches from one file
+    descriptor and calls `handler.add_events` once per read. Ignored directories get no
+    watches.
+    """
+
+    def __init__(self, ignore: ignore_matcher.Ignore) -> None:
+        """Creates the observer
+
+        Args:
+            ignore (Ignore): ignore rules or their matcher (ignored directories are not watched)
+
+        Raises:
+            RuntimeError: if inotify cannot be used
+        """
+        self._matcher = ignore_matcher.create(ignore)
+        try:
+            self._fd = inotify.calls.inotify_init()
+        except inotify.calls.InotifyError as error:
+            raise RuntimeError(f"Could not use inotify: {error}") from error
+        # `add_events` of the handler, set by `schedule`
+        self._add_events: Optional[Callable[[List[Event]], None]] = None
+        # watch descriptor X directory
+        self._dirs: Dict[int, str] = {}
+        self._recursive: Set[int] = set()
+        self._roots: List[str] = []
+        self._stop_read, self._stop_write = os.pipe()
+        self._thread = threading.Thread(target=self._read_events, daemon=True)
+
+    def schedule(self, handler, path: str, recursive: bool = False) -> None:
+        """Watches `path` (and its subdirectories if `recursive`)
+
+        Args:
+            handler (DirWatcher): receives the events through `add_events`
+            path (str): the directory
+            recursive (bool): if subdirectories are watched too
+        """
+        self._add_events = handler.add_events
+        self._roots.append(path)
+        if recursive:
+            self._watch_tree(path)
+        else:
+            self._watch(path, False)
+
+    def start(self) -> None:
+        """Starts reading events"""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops reading events"""
+        try:
+            os.write(self._stop_write, b"\0")
+        except OSError:
+            # already stopped
+            pass
+
+    def join(self) -> None:
+        """Waits for the reading thread and releases the watches"""
+        if self._thread.is_alive():
+            self._thread.join()
+        for fd in (self._fd, self._stop_read, self._stop_write):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    @property
+    def watches(self) -> int:
+        """Returns the number of watched directories"""
+        return len(self._dirs)
+
+    def _watch(self, path: str, recursive: bool) -> None:
+        """Adds the watch of directory `path`"""
+        try:
+            wd = inotify.calls.inotify_add_watch(self._fd, os.fsencode(path), _MASK)
+        except inotify.calls.InotifyError as error:
+            # gone, not a directory or out of watches (fs.inotify.max_user_watches)
+            logging.warning("Could not watch %s: %s", path, error)
+            return
+        self._dirs[wd] = path
+        if recursive:
+            self._recursive.add(wd)
+
+    def _watch_tree(self, path: str) -> None:
+        """Adds the watches of `path` and of its subdirectories that are not ignored"""
+        self._watch(path, True)
+        _, dirs = tree_scanner.scan_tree(path, self._matcher)
+        for adir in dirs:
+            if not os.path.islink(adir):
+                self._watch(adir, True)
+
+    def _unwatch_tree(self, path: str) -> None:
+        """Removes the watches of `path` and its subdirectories (e.g. moved away)"""
+        prefix = os.path.join(path, "")
+        for wd, adir in list(self._dirs.items()):
+            if adir == path or adir.startswith(prefix):
+                try:
+                    inotify.calls.inotify_rm_watch(self._fd, wd)
+                except inotify.calls.InotifyError:
+                    pass
+                self._forget(wd)
+
+    def _forget(self, wd: int) -> None:
+        """Forgets a removed watch"""
+        self._dirs.pop(wd, None)
+        self._recursive.discard(wd)
+
+    def _read_events(self) -> None:
+        """Reads and passes events until stopped"""
+        while True:
+            ready, _, _ = select.select([self._fd, self._stop_read], [], [])
+            if self._stop_read in ready:
+                return
+            try:
+                data = os.read(self._fd, _READ_SIZE)
+            except OSError as error:
+                logging.error("Could not read inotify events: %s", error)
+                return
+            events = self._parse(data)
+            if events and self._add_events:
+                self._add_events(events)
+
+    def _parse(self, data: bytes) -> List[Event]:
+        """Converts raw events to paths and updates the watches of created/moved directories
+
+        Args:
+            data (bytes): a read of the inotify file descriptor (whole events)
+
+        Returns:
+            List[Event]: changed paths and if they are directories
+        """
+        events: List[Event] = []
+        offset = 0
+        size = len(data)
+        while offset + _HEADER.size <= size:
+            wd, mask, _, length = _HEADER.unpack_from(data, offset)
+            offset += _HEADER.size
+            name = data[offset: offset + length].rstrip(b"\0")
+            offset += length
+            if mask & flags.IN_Q_OVERFLOW:
+                # events were lost: everything is checked again
+                logging.warning("Too many change events, checking all watched directories")
+                events.extend((root, True) for root in self._roots)
+                continue
+            adir = self._dirs.get(wd)
+            if adir is None:
+                continue
+            if mask & flags.IN_IGNORED:
+                self._forget(wd)
+                continue
+            if mask & _SELF:
+                events.append((adir, True))
+                continue
+            is_dir = bool(mask & flags.IN_ISDIR)
+            if is_dir and not mask & _DIR_CHANGES:
+                continue
+            path = os.path.join(adir, os.fsdecode(name))
+            if is_dir and wd in self._recursive:
+                if mask & flags.IN_MOVED_FROM:
+                    self._unwatch_tree(path)
+                elif mask & _NEW_DIR and not self._matcher.matches(path, True):
+                    self._watch_tree(path)
+            events.append((path, is_dir))
+        return events
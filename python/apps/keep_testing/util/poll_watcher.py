@@ -0,0 +1,188 @@
+"""Watcher polling directories for file systems without change events (NFS, SSHFS, ...)"""
+
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.hashers as hashers
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+
+# seconds without changes before a directory is cold again
+_HOT_FOR = 30.0
+# hot directories rescanned between full scans (the most recently changed)
+_MAX_HOT = 32
+
+
+class PollWatcher:
+    """Watches directories by comparing stat-only snapshots
+
+    It has the interface of DirWatcher used by the execution loop. A thread rescans all trees
+    (`DirsAndFiles.update`) and, more often, the directories that changed recently
+    (`DirsAndFiles.apply_events`). Each kind of scan waits long enough for the time spent
+    scanning to stay under half of `target_cpu`; full scans wait twice as long after each
+    scan without changes, up to `max_interval` (or the cost limit if longer).
+    """
+
+    def __init__(
+        self,
+        files: List[str],
+        dirs: List[str],
+        wakeup: Optional[threading.Event] = None,
+        ignore: Optional[ignore_matcher.Ignore] = None,
+        target_cpu: float = 0.05,
+        min_interval: float = 0.1,
+        max_interval: float = 10.0,
+    ) -> None:
+        """Creates the watcher and takes the first snapshot
+
+        Args:
+            files (List[str]): files to watch
+            dirs (List[str]): directories to watch (with subdirectories)
+            wakeup (threading.Event): event set on changes
+            ignore (Ignore): ignore rules or their matcher
+            target_cpu (float): share of time spent scanning (e.g. 0.05 for 5%)
+            min_interval (float): minimum seconds between two scans
+            max_interval (float): maximum seconds between two full scans (unless a scan
+                costs more)
+
+        Raises:
+            ValueError: if `target_cpu` is not positive
+        """
+        if target_cpu <= 0:
+            raise ValueError(f"Invalid share of time spent polling: {target_cpu}")
+        self._files = list(files)
+        self._wakeup = wakeup or threading.Event()
+        self._share = target_cpu / 2
+        self._min_interval = min_interval
+        self._max_interval = max_interval
+        self._snapshot = file_status.DirsAndFiles(
+            files, dirs, ignore_matcher.create(ignore or []), hasher=hashers.STAT_ONLY
+        )
+        # directory X monotonic time of its last change
+        self._hot: Dict[str, float] = {}
+        self._full_interval = min_interval
+        self._hot_interval = min_interval
+        self._lock = threading.Lock()
+        self._modified = False
+        self._paths: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Starts polling"""
+        if self._thread:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops polling"""
+        if not self._thread:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _poll(self) -> None:
+        """Polls until stopped"""
+        now = time.monotonic()
+        next_full = now + self._full_interval
+        next_hot = now + self._hot_interval
+        while not self._stop.wait(max(0.0, min(next_full, next_hot) - time.monotonic())):
+            if time.monotonic() >= next_full:
+                self.scan_all()
+                next_full = time.monotonic() + self._full_interval
+                # a full scan covers the hot directories too
+                next_hot = time.monotonic() + self._hot_interval
+            else:
+                self.scan_hot()
+                next_hot = time.monotonic() + self._hot_interval
+
+    def scan_all(self) -> List[file_status.Change]:
+        """Rescans all trees and adapts the interval between full scans
+
+        Returns:
+            List[Change]: changed files and directories
+        """
+        begin = time.perf_counter()
+        changed = self._snapshot.update()
+        cost = time.perf_counter() - begin
+        floor = max(self._min_interval, cost / self._share)
+        if changed:
+            self._full_interval = floor
+        else:
+            self._full_interval = max(floor, min(self._full_interval * 2, self._max_interval))
+        logging.debug(
+            "Full poll in %fs, next in %gs (%d hot directories)",
+            cost,
+            self._full_interval,
+            len(self._hot),
+        )
+        self._record(changed)
+        return changed
+
+    def scan_hot(self) -> List[file_status.Change]:
+        """Rescans the watched files and the directories that changed recently
+
+        Returns:
+            List[Change]: changed files and directories
+        """
+        now = time.monotonic()
+        for adir in [adir for adir, last in self._hot.items() if now - last > _HOT_FOR]:
+            del self._hot[adir]
+        paths: List[str] = []
+        # a subtree is rescanned with its parent
+        for adir in sorted(self._hot):
+            if not paths or not adir.startswith(os.path.join(paths[-1], "")):
+                paths.append(adir)
+        begin = time.perf_counter()
+        changed = self._snapshot.apply_events(paths + self._files)
+        cost = time.perf_counter() - begin
+        self._hot_interval = max(self._min_interval, cost / self._share)
+        self._record(changed)
+        return changed
+
+    def _record(self, changed: List[file_status.Change]) -> None:
+        """Marks the directories of `changed` as hot and wakes up the waiting thread"""
+        if not changed:
+            return
+        paths = [change.path for change in changed]
+        paths.extend(change.old_path for change in changed if change.old_path)
+        now = time.monotonic()
+        for path in paths:
+            self._hot[path if os.path.isdir(path) else os.path.dirname(path)] = now
+        if len(self._hot) > _MAX_HOT:
+            recent = sorted(self._hot, key=self._hot.__getitem__, reverse=True)[:_MAX_HOT]
+            self._hot = {adir: self._hot[adir] for adir in recent}
+        logging.debug("Polled changes %s", paths)
+        with self._lock:
+            self._modified = True
+            self._paths.update(paths)
+        self._wakeup.set()
+
+    @property
+    def wakeup(self) -> threading.Event:
+        """Returns the event set on every change"""
+        return self._wakeup
+
+    def in_burst(self) -> bool:
+        """Checks if a burst of events is being debounced (never: changes come in batches)"""
+        return False
+
+    def changed(self) -> bool:
+        """Checks if there were any changes in watched dirs"""
+        with self._lock:
+            res = self._modified
+            self._modified = False
+        return res
+
+    def pop_events(self) -> Set[str]:
+        """Returns the changed paths since the last call and forgets them"""
+        with self._lock:
+            res = self._paths
+            self._paths = set()
+        return res
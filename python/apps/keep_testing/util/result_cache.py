@@ -0,0 +1,138 @@
+"""Results of commands stored by the fingerprint of their inputs"""
+
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from typing import Dict, NamedTuple, Optional
+
+# exit code and time when the result was stored
+_HEADER = struct.Struct("<id")
+_SUFFIX = ".result"
+
+
+class Result(NamedTuple):
+    """Exit code and output of a command"""
+
+    code: int
+    output: bytes
+    time: float = 0.0
+
+
+class ResultCache:
+    """Results in a directory, a file per key, evicting the least recently used over a size
+
+    The modification time of each file is the time of its last use, so the order survives
+    restarts. Several processes can share the directory: each one only evicts what it knows.
+    """
+
+    def __init__(self, directory: str, max_size: int) -> None:
+        """Opens the cache (the directory is created when the first result is stored)
+
+        Args:
+            directory (str): directory of the results
+            max_size (int): maximum size in bytes of all results
+
+        Raises:
+            ValueError: if `max_size` is not positive
+        """
+        if max_size <= 0:
+            raise ValueError(f"Invalid size of the result cache: {max_size}")
+        self._directory = directory
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # key X size, least recently used first
+        self._sizes: Dict[str, int] = {}
+        self._size = 0
+        # last use, key and size of the stored results
+        stored = []
+        try:
+            for entry in os.scandir(directory):
+                if not entry.name.endswith(_SUFFIX) or not entry.is_file():
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    # evicted by another process
+                    continue
+                stored.append((stat.st_mtime_ns, entry.name[: -len(_SUFFIX)], stat.st_size))
+        except OSError:
+            pass
+        for _, key, size in sorted(stored):
+            self._sizes[key] = size
+        self._size = sum(self._sizes.values())
+
+    @property
+    def max_size(self) -> int:
+        """Returns the maximum size in bytes of all results"""
+        return self._max_size
+
+    @property
+    def size(self) -> int:
+        """Returns the size in bytes of all results"""
+        return self._size
+
+    def get(self, key: str) -> Optional[Result]:
+        """Returns the result stored with `key` (None if there is none)"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                data = file.read()
+            code, stored = _HEADER.unpack_from(data)
+            output = zlib.decompress(data[_HEADER.size:])
+            os.utime(path)
+        except (OSError, struct.error, zlib.error):
+            with self._lock:
+                self._forget(key)
+            return None
+        with self._lock:
+            if key in self._sizes:
+                self._sizes[key] = self._sizes.pop(key)
+        return Result(code, output, stored)
+
+    def put(self, key: str, result: Result) -> None:
+        """Stores a result (not if it is larger than the cache), evicting the least recently
+        used ones to stay within the maximum size
+
+        Args:
+            key (str): the key (a file name)
+            result (Result): the result
+        """
+        data = _HEADER.pack(result.code, result.time or time.time()) + zlib.compress(
+            result.output
+        )
+        if len(data) > self._max_size:
+            logging.debug("Result %s not cached: %d bytes", key, len(data))
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            tmp_file = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_file, "wb") as file:
+                file.write(data)
+            os.replace(tmp_file, path)
+        except OSError as error:
+            logging.warning("Could not cache result in %s: %s", path, error)
+            return
+        with self._lock:
+            self._forget(key)
+            self._sizes[key] = len(data)
+            self._size += len(data)
+            while self._size > self._max_size:
+                oldest = next(iter(self._sizes))
+                self._forget(oldest)
+                try:
+                    os.remove(self._path(oldest))
+                except OSError:
+                    # removed by another process
+                    pass
+
+    def _forget(self, key: str) -> None:
+        """Removes `key` from the sizes (the lock must be held)"""
+        self._size -= self._sizes.pop(key, 0)
+
+    def _path(self, key: str) -> str:
+        """Returns the file of the result stored with `key`"""
+        return os.path.join(self._directory, key + _SUFFIX)
@@ -0,0 +1,47 @@
+"""Single pass scanner of directory trees"""
+
+import os
+from typing import List, Tuple
+
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+
+
+def scan_tree(
+    path: str, ignore: ignore_matcher.Ignore
+) -> Tuple[List[os.DirEntry], List[str]]:
+    """Scans the tree under `path` visiting every entry exactly once
+
+    Ignored directories are pruned before descending, so their contents are never listed.
+    Symbolic links to directories are reported as directories but are not followed.
+
+    Args:
+        path (str): path to directory
+        ignore (Ignore): list of ignore rules or their matcher
+
+    Returns:
+        (List[os.DirEntry], List[str]): entries of the files found and a sorted list of
+            directories
+    """
+    matcher = ignore_matcher.create(ignore)
+    files: List[os.DirEntry] = []
+    dirs: List[str] = []
+    pending = [path]
+    while pending:
+        current = pending.pop()
+        try:
+            with os.scandir(current) as entries:
+                for entry in entries:
+                    is_dir = entry.is_dir()
+                    if matcher.matches(entry.path, is_dir):
+                        continue
+                    if is_dir:
+                        dirs.append(entry.path)
+                        if not entry.is_symlink():
+                            pending.append(entry.path)
+                    else:
+                        files.append(entry)
+        except OSError:
+            # directory removed or not readable: same as os.walk, skip it
+            continue
+    dirs.sort()
+    return files, dirs
@@ -0,0 +1,234 @@
+"""Split of watched trees between change notifications and polling"""
+
+import heapq
+import os
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.hashers as hashers
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+_MAX_USER_WATCHES = "/proc/sys/fs/inotify/max_user_watches"
+# other programs (editors, IDEs, ...) need watches too
+_SHARE_OF_SYSTEM_LIMIT = 0.5
+
+
+def default_budget() -> Optional[int]:
+    """Returns the default number of watched directories (None if there is no limit)"""
+    try:
+        with open(_MAX_USER_WATCHES, "r", encoding="utf_8") as file:
+            return int(int(file.read()) * _SHARE_OF_SYSTEM_LIMIT)
+    except (OSError, ValueError):
+        return None
+
+
+class WatchPlan:  # pylint: disable=too-few-public-methods
+    """Directories watched with and without subdirectories and subtrees that are polled"""
+
+    def __init__(self) -> None:
+        self.recursive: List[str] = []
+        self.single: List[str] = []
+        self.polled: List[str] = []
+        self.watches = 0
+
+
+class _Subtree:  # pylint: disable=too-few-public-methods
+    """Number of directories and last change of the directories of a subtree"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.dirs = 1
+        self.mtime = 0
+        self.children: List["_Subtree"] = []
+
+    def __lt__(self, other: "_Subtree") -> bool:
+        # the most recently changed first
+        return (-self.mtime, self.path) < (-other.mtime, other.path)
+
+
+def _subtrees(
+    root: str, ignore: ignore_matcher.IgnoreMatcher, known: Optional[List[str]]
+) -> _Subtree:
+    """Returns the subtree of `root` with the counts of its directories
+
+    Args:
+        root (str): the watched directory
+        ignore (IgnoreMatcher): ignore rules (used only if the tree is scanned)
+        known (List[str]): directories already scanned (None to scan the tree)
+
+    Returns:
+        _Subtree: the subtree of `root`
+    """
+    if known is None:
+        _, dirs = tree_scanner.scan_tree(root, ignore)
+    else:
+        prefix = os.path.join(root, "")
+        dirs = [adir for adir in known if adir.startswith(prefix)]
+    subtrees = {root: _Subtree(root)}
+    for adir in dirs:
+        if not os.path.islink(adir):
+            subtrees[adir] = _Subtree(adir)
+    for path, subtree in subtrees.items():
+        try:
+            subtree.mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            pass
+    # deepest first: children are complete before their parents
+    for path in sorted(subtrees, key=lambda path: path.count(os.sep), reverse=True):
+        if path == root:
+            continue
+        subtree = subtrees[path]
+        parent = subtrees[os.path.dirname(path)]
+        parent.dirs += subtree.dirs
+        parent.mtime = max(parent.mtime, subtree.mtime)
+        parent.children.append(subtree)
+    return subtrees[root]
+
+
+def plan(
+    roots: List[str],
+    ignore: ignore_matcher.Ignore,
+    budget: Optional[int],
+    known: Optional[List[str]] = None,
+) -> WatchPlan:
+    """Chooses the subtrees to watch within `budget` watched directories
+
+    Roots are always watched. If all directories do not fit, subtrees where directory entries
+    changed most recently are watched first; a subtree that does not fit has its directory
+    watched and its subtrees considered in turn; the remaining (coldest) subtrees are polled.
+
+    Args:
+        roots (List[str]): directories watched with their subdirectories
+        ignore (Ignore): ignore rules or their matcher (ignored directories are not counted)
+        budget (int): maximum number of watched directories (None for no limit)
+        known (List[str]): directories already scanned (e.g. of a snapshot), so the trees are
+            not scanned again (None to scan them)
+
+    Returns:
+        WatchPlan: the plan
+    """
+    result = WatchPlan()
+    if budget is None:
+        result.recursive = list(roots)
+        return result
+    matcher = ignore_matcher.create(ignore)
+    trees = [_subtrees(root, matcher, known) for root in roots]
+    if sum(tree.dirs for tree in trees) <= budget:
+        result.recursive = list(roots)
+        result.watches = sum(tree.dirs for tree in trees)
+        return result
+
+    remaining = budget
+    pending: List[_Subtree] = []
+    for tree in trees:
+        result.single.append(tree.path)
+        remaining -= 1
+        pending.extend(tree.children)
+    heapq.heapify(pending)
+    while pending:
+        subtree = heapq.heappop(pending)
+        if subtree.dirs <= remaining:
+            result.recursive.append(subtree.path)
+            remaining -= subtree.dirs
+        elif remaining > 0 and subtree.children:
+            result.single.append(subtree.path)
+            remaining -= 1
+            for child in subtree.children:
+                heapq.heappush(pending, child)
+        else:
+            result.polled.append(subtree.path)
+    result.watches = budget - remaining
+    for values in (result.recursive, result.single, result.polled):
+        values.sort()
+    return result
+
+
+class Poller:
+    """Polls subtrees comparing snapshots of the stats of their files"""
+
+    def __init__(
+        self,
+        subtrees: List[str],
+        interval: float,
+        ignore: ignore_matcher.Ignore,
+        callback: Callable[[Iterable[Tuple[str, bool]]], None],
+    ) -> None:
+        """Creates the poller
+
+        Args:
+            subtrees (List[str]): directories polled with their subdirectories
+            interval (float): seconds between two polls
+            ignore (Ignore): ignore rules or their matcher
+            callback (Callable): receives the changed subtrees (path, True)
+        """
+        self._matcher = ignore_matcher.create(ignore)
+        self._interval = interval
+        self._callback = callback
+        self._snapshots: Dict[str, file_status.FileTree] = {
+            subtree: self._snapshot(subtree, None) for subtree in subtrees
+        }
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._poll, daemon=True)
+
+    @property
+    def subtrees(self) -> List[str]:
+        """Returns the polled subtrees"""
+        with self._lock:
+            return list(self._snapshots)
+
+    def add(self, subtree: str) -> None:
+        """Polls `subtree` too (e.g. created after the plan)
+
+        Its files are found by the next poll, which reports it as changed.
+
+        Args:
+            subtree (str): directory polled with its subdirectories
+        """
+        with self._lock:
+            self._snapshots.setdefault(subtree, {})
+
+    def start(self) -> None:
+        """Starts polling"""
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops polling"""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def poll(self) -> List[str]:
+        """Polls all subtrees once
+
+        Returns:
+            List[str]: subtrees with changes
+        """
+        changed = []
+        with self._lock:
+            snapshots = list(self._snapshots.items())
+        for subtree, previous in snapshots:
+            snapshot = self._snapshot(subtree, previous)
+            if snapshot != previous:
+                changed.append(subtree)
+            with self._lock:
+                self._snapshots[subtree] = snapshot
+        return changed
+
+    def _snapshot(
+        self, subtree: str, previous: Optional[file_status.FileTree]
+    ) -> file_status.FileTree:
+        """Returns the stats of the files in `subtree` (empty if it does not exist)"""
+        try:
+            return file_status.DirInfo(subtree, self._matcher, previous, hashers.STAT_ONLY).tree
+        except RuntimeError:
+            return {}
+
+    def _poll(self) -> None:
+        """Polls until stopped"""
+        while not self._stop.wait(self._interval):
+            changed = self.poll()
+            if changed:
+                self._callback([(subtree, True) for subtree in changed])
@@ -0,0 +1,13 @@
+"""Benchmarks main driver"""
+
+import os
+import sys
+import unittest
+
+dir_benchmarks = os.path.dirname(os.path.realpath(__file__))
+
+bench_loader = unittest.defaultTestLoader.discover(dir_benchmarks, pattern="bench_*.py")
+bench_runner = unittest.TextTestRunner(verbosity=2)
+result = bench_runner.run(bench_loader)
+if not result.wasSuccessful():
+    sys.exit(1)
@@ -0,0 +1,226 @@
+"""Benchmarks keep_testing module"""
+
+import contextlib
+import os
+import queue
+import re
+import statistics
+import threading
+import time
+import unittest
+from unittest import mock
+
+import apps.keep_testing.keep_testing as keep_testing
+import apps.keep_testing.util.command_runner as command_runner
+import apps.keep_testing.util.dir_watcher as dir_watcher
+import apps.keep_testing.util.file_status as file_status
+
+import benchmarks.util.utils_bench_lib as utils
+
+_EDITS = 20
+_OLD_SLEEP = 0.2
+_BURST_FILES = 2000
+_IGNORED_WRITES = 500
+
+
+class _Stop(Exception):
+    """Raised from the commands to leave the execution loop"""
+
+
+@contextlib.contextmanager
+def _execution_loop(dirs_files, watcher, starts: queue.Queue):
+    """Runs the execution loop in a thread, putting the start time of each run in `starts`"""
+    stop = threading.Event()
+
+    class _Runner:
+        """Runs the commands instantly, successfully"""
+
+        def __init__(self, cmds, *_args, **_kwargs):
+            self.states = {cmd.name: (command_runner.SUCCEEDED, 0.0) for cmd in cmds}
+
+        def start(self):
+            starts.put(time.perf_counter())
+            if stop.is_set():
+                raise _Stop()
+
+        def wait(self):
+            return True
+
+        def running(self):
+            return False
+
+        def cancel(self):
+            pass
+
+    def _run():
+        try:
+            getattr(keep_testing, "__execution_loop")(
+                mock.Mock(), command_runner.chain(["cmd"]), dirs_files, watcher, 300.0, False
+            )
+        except _Stop:
+            pass
+
+    with mock.patch.object(command_runner, "CommandRunner", _Runner):
+        thread = threading.Thread(target=_run)
+        thread.start()
+        starts.get(timeout=10)
+        try:
+            yield
+        finally:
+            stop.set()
+            # <ENTER> makes the loop run the commands once more and leave
+            watcher.wakeup.set()
+            keep_testing.EnterMonitor.enter_pressed = True
+            thread.join(timeout=10)
+            keep_testing.EnterMonitor.enter_pressed = False
+            watcher.stop()
+
+
+def _write(file_path):
+    with open(file_path, "ab") as file:
+        file.write(b"edit")
+
+
+class BenchLatency(utils.BenchWithTmpDir):
+    """Benchmarks the time from a file write to the start of the commands"""
+
+    def _latencies(self, polling: bool):
+        root = os.path.join(self.tmp_dir, f"tree{polling}")
+        files = utils.create_tree(root, 200)
+        dirs_files = file_status.DirsAndFiles([], [root], [])
+        watcher = dir_watcher.DirWatcher([], [root])
+        starts: queue.Queue = queue.Queue()
+
+        def _poll(_timeout):
+            # previous implementation: sleep until the watcher reports changes
+            while not watcher.changed():
+                time.sleep(_OLD_SLEEP)
+
+        latencies = []
+        with (
+            mock.patch.object(watcher.wakeup, "wait", _poll)
+            if polling
+            else contextlib.nullcontext()
+        ), _execution_loop(dirs_files, watcher, starts):
+            for file_path in files[:_EDITS]:
+                # let the loop go back to wait
+                time.sleep(0.05)
+                begin = time.perf_counter()
+                _write(file_path)
+                latencies.append(starts.get(timeout=10) - begin)
+            if polling:
+                _write(files[-1])
+        return latencies
+
+    def test_latency(self):
+        """Blocking on the wakeup event should start commands right after a write"""
+        polling = self._latencies(polling=True)
+        blocking = self._latencies(polling=False)
+
+        utils.report(
+            "latency from file write to commands start",
+            ["wait", "median (ms)", "max (ms)"],
+            [
+                [f"sleep {_OLD_SLEEP}s", statistics.median(polling) * 1e3, max(polling) * 1e3],
+                ["wakeup event", statistics.median(blocking) * 1e3, max(blocking) * 1e3],
+            ],
+        )
+        self.assertLess(statistics.median(blocking), statistics.median(polling))
+
+
+class BenchBurst(utils.BenchWithTmpDir):
+    """Benchmarks the checks and command runs caused by a burst of changes (e.g. a checkout)"""
+
+    def _runs(self, debounce: float):
+        root = os.path.join(self.tmp_dir, f"tree{debounce}")
+        files = utils.create_tree(root, _BURST_FILES)
+        dirs_files = file_status.DirsAndFiles([], [root], [])
+        watcher = dir_watcher.DirWatcher([], [root], debounce=debounce, max_wait=2.0)
+        starts: queue.Queue = queue.Queue()
+        checks = []
+        apply_events = dirs_files.apply_events
+
+        def _apply_events(paths):
+            checks.append(len(paths))
+            return apply_events(paths)
+
+        with mock.patch.object(dirs_files, "apply_events", _apply_events), _execution_loop(
+            dirs_files, watcher, starts
+        ):
+            time.sleep(0.1)
+            checks.clear()
+            for file_path in files:
+                _write(file_path)
+            # wait for the last run
+            time.sleep(1.0 + debounce)
+            runs = starts.qsize()
+            checks_with_events = len([check for check in checks if check])
+        return runs, checks_with_events
+
+    def test_burst(self):
+        """A debounced burst should be checked and run fewer times (once unless the writes are
+        slowed down by the load of the machine)"""
+        rows = []
+        for debounce in [0.0, 0.05]:
+            runs, checks = self._runs(debounce)
+            rows.append([f"{debounce * 1e3:g}ms", _BURST_FILES, checks, runs])
+        utils.report(
+            "burst of writes",
+            ["debounce", "files written", "checks", "command runs"],
+            rows,
+        )
+        # checks and runs
+        self.assertLessEqual(rows[-1][2], rows[0][2])
+        self.assertLessEqual(rows[-1][3], rows[0][3])
+
+
+class BenchIgnoredEvents(utils.BenchWithTmpDir):
+    """Benchmarks the wakeups caused by writes in ignored directories (e.g. build outputs)"""
+
+    def _wakeups(self, ignore_in_watcher: bool):
+        root = os.path.join(self.tmp_dir, f"tree{ignore_in_watcher}")
+        utils.create_tree(os.path.join(root, "src"), 200)
+        build = os.path.join(root, "build")
+        os.makedirs(build)
+        ignore = [re.compile(r".*/build")]
+        dirs_files = file_status.DirsAndFiles([], [root], ignore)
+        watcher = dir_watcher.DirWatcher(
+            [], [root], ignore=ignore if ignore_in_watcher else None
+        )
+        starts: queue.Queue = queue.Queue()
+        checks = []
+        apply_events = dirs_files.apply_events
+
+        def _apply_events(paths):
+            checks.append(len(paths))
+            return apply_events(paths)
+
+        with mock.patch.object(dirs_files, "apply_events", _apply_events), _execution_loop(
+            dirs_files, watcher, starts
+        ):
+            time.sleep(0.1)
+            checks.clear()
+            for index in range(_IGNORED_WRITES):
+                _write(os.path.join(build, f"output{index}.o"))
+                time.sleep(0.001)
+            time.sleep(0.5)
+            runs = starts.qsize()
+            wakeups = len(checks)
+        return wakeups, runs
+
+    def test_ignored_events(self):
+        """Writes in ignored directories should not wake up the loop"""
+        rows = []
+        for ignore_in_watcher in [False, True]:
+            wakeups, runs = self._wakeups(ignore_in_watcher)
+            rows.append(["yes" if ignore_in_watcher else "no", _IGNORED_WRITES, wakeups, runs])
+        utils.report(
+            "writes in an ignored directory",
+            ["watcher ignores", "files written", "checks", "command runs"],
+            rows,
+        )
+        self.assertEqual(rows[-1][2:], [0, 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+"""Benchmarks command_runner module"""
+
+import os
+import time
+import unittest
+
+import apps.keep_testing.util.command_runner as command_runner
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.result_cache as result_cache
+
+import benchmarks.util.utils_bench_lib as utils
+
+_RUN = 1.0
+_STEP = 0.3
+_FILES = 10_000
+
+
+class BenchRestart(unittest.TestCase):
+    """Benchmarks the wait for a fresh run after a change in the middle of a run"""
+
+    def test_cancel(self):
+        """Cancelling the stale run should take a fraction of letting it finish"""
+
+        def stale_run(cancel):
+            runner = command_runner.CommandRunner(command_runner.chain([f"sleep {_RUN}"]))
+            runner.start()
+            # the change arrives shortly after the run started
+            time.sleep(0.05)
+            begin = time.perf_counter()
+            if cancel:
+                runner.cancel()
+            else:
+                runner.wait()
+            return time.perf_counter() - begin
+
+        wait = min(stale_run(False) for _ in range(3))
+        cancel = min(stale_run(True) for _ in range(3))
+        utils.report(
+            f"wait before the fresh run ({_RUN}s commands)",
+            ["stale run", "time (s)"],
+            [["finished", wait], ["cancelled", cancel]],
+        )
+        self.assertLess(cancel * 10, wait)
+
+
+class BenchGraph(unittest.TestCase):
+    """Benchmarks a build followed by independent checks"""
+
+    def test_parallel_checks(self):
+        """Checks depending only on the build should take the time of the slowest one"""
+        commands = [
+            command_runner.Command("build", f"sleep {_STEP}"),
+            *[
+                command_runner.Command(name, f"sleep {_STEP}", ("build",))
+                for name in ["test", "lint", "types"]
+            ],
+        ]
+
+        def run(workers):
+            runner = command_runner.CommandRunner(commands, workers=workers)
+            runner.start()
+            self.assertTrue(runner.wait())
+
+        serial = utils.best_time(lambda: run(1), repeat=1)
+        parallel = utils.best_time(lambda: run(3), repeat=1)
+        utils.report(
+            f"build then 3 checks ({_STEP}s each)",
+            ["workers", "time (s)"],
+            [[1, serial], [3, parallel]],
+        )
+        self.assertLess(parallel * 1.5, serial)
+
+
+class BenchResultCache(utils.BenchWithTmpDir):
+    """Benchmarks a run whose inputs did not change"""
+
+    def test_replay(self):
+        """Replaying the stored results should take a fraction of running the commands"""
+        cache = result_cache.ResultCache(os.path.join(self.tmp_dir, "results"), 1 << 20)
+        commands = command_runner.chain([f"sleep {_STEP}; echo done"] * 3)
+        keys = {command.name: str(index) for index, command in enumerate(commands)}
+
+        def run(reuse):
+            runner = command_runner.CommandRunner(commands, cache=cache, keys=keys, reuse=reuse)
+            runner.start()
+            self.assertTrue(runner.wait())
+
+        executed = utils.best_time(lambda: run(False), repeat=1)
+        replayed = utils.best_time(lambda: run(True), repeat=3)
+        utils.report(
+            f"3 commands ({_STEP}s each)",
+            ["results", "time (s)"],
+            [["executed", executed], ["replayed", replayed]],
+        )
+        self.assertLess(replayed * 10, executed)
+
+
+class BenchInputKeys(utils.BenchWithTmpDir):
+    """Benchmarks the keys of the results of commands with paths before each run"""
+
+    def test_changed_file(self):
+        """After a change, only the changed directories should be matched again"""
+        root = os.path.join(self.tmp_dir, "tree")
+        files = utils.create_tree(root, _FILES)
+        snapshot = file_status.DirsAndFiles([], [root], [])
+        commands = [
+            command_runner.Command(name, "true", (), (pattern, "!**/d1/**"), root)
+            for name, pattern in [("a", "*.dat"), ("b", "*1*"), ("c", "*2*"), ("d", "*3*")]
+        ]
+        first = utils.best_time(
+            lambda: command_runner.input_keys(commands, snapshot), repeat=1
+        )
+
+        def after_change():
+            with open(files[0], "ab") as file:
+                file.write(b"edit")
+            snapshot.apply_events([files[0]])
+            command_runner.input_keys(commands, snapshot)
+
+        changed = utils.best_time(after_change, repeat=3)
+        utils.report(
+            f"keys of 4 commands with paths ({_FILES} files)",
+            ["keys", "time (s)"],
+            [["first", first], ["after a change", changed]],
+        )
+        self.assertLess(changed * 10, first)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Benchmarks dir_watcher module"""
+
+import os
+import time
+import unittest
+
+import apps.keep_testing.util.dir_watcher as dir_watcher
+
+import benchmarks.util.utils_bench_lib as utils
+
+_FILES = 500
+_WRITES = 20000
+
+
+def _storm(files):
+    """Writes `_WRITES` times in `files`"""
+    for index in range(_WRITES):
+        with open(files[index % len(files)], "ab") as file:
+            file.write(b"x")
+
+
+class BenchEventStorm(utils.BenchWithTmpDir):
+    """Benchmarks how fast each backend gets through a storm of change events"""
+
+    def _process(self, backend, files, root):
+        """Returns the wall time until the last event is seen and the CPU time used"""
+        watcher = dir_watcher.DirWatcher([], [root], backend=backend)
+        watcher.start()
+        sentinel = os.path.join(root, f"sentinel-{backend}")
+        cpu = time.process_time()
+        begin = time.perf_counter()
+        _storm(files)
+        with open(sentinel, "wb"):
+            pass
+        seen = set()
+        while sentinel not in seen and time.perf_counter() - begin < 120:
+            seen |= watcher.pop_events()
+            time.sleep(0.001)
+        wall = time.perf_counter() - begin
+        cpu = time.process_time() - cpu
+        watcher.stop()
+        self.assertIn(sentinel, seen)
+        return wall, cpu
+
+    def test_event_storm(self):
+        """The inotify backend should use less CPU than watchdog for the same events"""
+        root = os.path.join(self.tmp_dir, "tree")
+        files = utils.create_tree(root, _FILES)
+        cpu = time.process_time()
+        begin = time.perf_counter()
+        _storm(files)
+        base_wall, base_cpu = time.perf_counter() - begin, time.process_time() - cpu
+
+        rows = [["writes only", _WRITES, base_wall, base_cpu, "-"]]
+        results = {}
+        for backend in dir_watcher.BACKENDS:
+            wall, cpu = self._process(backend, files, root)
+            results[backend] = cpu - base_cpu
+            rows.append([backend, _WRITES, wall, cpu, _WRITES / wall])
+        utils.report(
+            "event storm (watcher CPU = CPU - writes only CPU)",
+            ["backend", "writes", "wall (s)", "CPU (s)", "events/s"],
+            rows,
+        )
+        self.assertLess(results[dir_watcher.INOTIFY], results[dir_watcher.WATCHDOG])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""Benchmarks file_status module"""
+
+import gc
+import os
+import tracemalloc
+import unittest
+from unittest import mock
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.hashers as hashers
+
+import benchmarks.util.utils_bench_lib as utils
+
+_WORKERS = [1, 2, 4, 8]
+
+
+class BenchHashWorkers(utils.BenchWithTmpDir):
+    """Benchmarks the creation of a snapshot with threads hashing files"""
+
+    def test_hash_workers(self):
+        """Compare the cold build of a DirInfo with 1, 2, 4 and 8 hashing threads"""
+        num_files = 400
+        file_size = 256 * 1024
+        root = os.path.join(self.tmp_dir, "tree")
+        utils.create_tree(root, num_files, file_size=file_size)
+        megabytes = num_files * file_size / 2**20
+
+        rows = []
+        reference = None
+        for workers in _WORKERS:
+            seconds = utils.best_time(
+                lambda workers=workers: file_status.DirInfo(
+                    root, [], hasher=hashers.Hasher(workers=workers)
+                )
+            )
+            dir_info = file_status.DirInfo(root, [], hasher=hashers.Hasher(workers=workers))
+            reference = reference or dir_info
+            self.assertEqual(dir_info, reference)
+            rows.append([workers, seconds, megabytes / seconds])
+
+        utils.report(
+            f"DirInfo with {num_files} files of {file_size // 1024} KiB "
+            f"(page cache warm, {os.cpu_count()} CPUs)",
+            ["workers", "time (s)", "MB/s"],
+            rows,
+        )
+
+
+class BenchSnapshotDiff(utils.BenchWithTmpDir):
+    """Benchmarks the update of a snapshot (scan, digests and comparison)"""
+
+    def test_update(self):
+        """Compare updates digesting every directory with updates reusing unchanged digests"""
+        num_files = 50000
+        root = os.path.join(self.tmp_dir, "tree")
+        files = utils.create_tree(root, num_files, file_size=16)
+        dirs_files = file_status.DirsAndFiles([], [root], [])
+        create_dir_infos = file_status.DirsAndFiles._create_dir_infos
+
+        # pylint: disable=unused-argument
+        def _fresh_dir_infos(dirs, ignore, previous=None, hasher=None, previous_infos=None):
+            return create_dir_infos(dirs, ignore, previous, hasher)
+
+        def _edit_and_update():
+            with open(files[-1], "ab") as file:
+                file.write(b"x")
+            return dirs_files.update()
+
+        rows = []
+        for name, update in [
+            ("nothing changed", dirs_files.update),
+            ("one file changed", _edit_and_update),
+        ]:
+            with mock.patch.object(
+                file_status.DirsAndFiles, "_create_dir_infos", staticmethod(_fresh_dir_infos)
+            ):
+                fresh = utils.best_time(update)
+            reused = utils.best_time(update)
+            rows.append([name, fresh, reused, fresh / reused])
+        utils.report(
+            f"update of a snapshot of {num_files} files",
+            ["case", "all digests (s)", "reused (s)", "speedup"],
+            rows,
+        )
+        self.assertEqual([change.path for change in _edit_and_update()], [files[-1]])
+        # the scan dominates: reusing digests must not make it slower (beyond noise)
+        for _, fresh, reused, _ in rows:
+            self.assertLess(reused, fresh * 1.5)
+
+
+class BenchSnapshotMemory(utils.BenchWithTmpDir):
+    """Benchmarks the memory used by a snapshot"""
+
+    def test_memory_per_file(self):
+        """Compare the per file footprint of DirInfo with the former flat layout"""
+        num_files = 20000
+        root = os.path.join(self.tmp_dir, "tree")
+        utils.create_tree(root, num_files, file_size=16)
+
+        rows = []
+        for name, build in [
+            ("flat dict + __dict__", lambda: _former_layout(file_status.DirInfo(root, []))),
+            ("DirInfo", lambda: file_status.DirInfo(root, [])),
+        ]:
+            gc.collect()
+            tracemalloc.start()
+            snapshot = build()
+            gc.collect()
+            size, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del snapshot
+            rows.append([name, size // 1024, size / num_files])
+
+        utils.report(
+            f"snapshot of {num_files} files", ["layout", "total (KiB)", "bytes/file"], rows
+        )
+        self.assertLess(rows[1][2], rows[0][2])
+
+
+class _FormerFileInfo:  # pylint: disable=too-few-public-methods
+    """FileInfo as it was: instance __dict__, stat tuple and hex digest"""
+
+    def __init__(self, file_info: file_status.FileInfo):
+        self._stat = tuple(file_info.stat)
+        self._hash = file_info.digest.hex()
+
+
+def _former_layout(dir_info: file_status.DirInfo):
+    """Full path X FileInfo with a __dict__, as files were kept before"""
+    return {path: _FormerFileInfo(info) for path, info in dir_info.files.items()}
+
+
+if __name__ == "__main__":
+    unittest.main()
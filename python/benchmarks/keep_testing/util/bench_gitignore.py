@@ -0,0 +1,48 @@
+"""Benchmarks gitignore module"""
+
+import os
+import unittest
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.gitignore as gitignore
+
+import benchmarks.util.utils_bench_lib as utils
+
+_TRACKED = 2000
+_BUILD_OUTPUTS = [0, 4000, 16000]
+
+
+class BenchGitignore(utils.BenchWithTmpDir):
+    """Benchmarks snapshots of a repository with build outputs listed in .gitignore"""
+
+    def test_cost_follows_tracked_files(self):
+        """With ignore files, the snapshot time should not grow with the ignored outputs"""
+        rows = []
+        times = []
+        for outputs in _BUILD_OUTPUTS:
+            root = os.path.join(self.tmp_dir, f"repo{outputs}")
+            os.makedirs(os.path.join(root, ".git"))
+            with open(os.path.join(root, ".gitignore"), "w", encoding="utf_8") as file:
+                print("build/\n*.log", file=file)
+            utils.create_tree(os.path.join(root, "src"), _TRACKED)
+            if outputs:
+                utils.create_tree(os.path.join(root, "build"), outputs)
+            plain = utils.best_time(lambda root=root: file_status.DirsAndFiles([], [root], []))
+            ignored = utils.best_time(
+                lambda root=root: file_status.DirsAndFiles(
+                    [], [root], gitignore.GitignoreMatcher([], [root])
+                )
+            )
+            times.append(ignored)
+            rows.append([_TRACKED, outputs, plain, ignored])
+
+        utils.report(
+            "DirsAndFiles with build outputs in .gitignore",
+            ["tracked files", "build outputs", "all files (s)", "gitignore (s)"],
+            rows,
+        )
+        self.assertLess(times[-1], times[0] * 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
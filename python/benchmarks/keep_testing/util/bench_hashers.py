@@ -0,0 +1,75 @@
+"""Benchmarks hashers module"""
+
+import hashlib
+import os
+import tracemalloc
+import unittest
+
+import apps.keep_testing.util.hashers as hashers
+
+import benchmarks.util.utils_bench_lib as utils
+
+
+class BenchHashers(utils.BenchWithTmpDir):
+    """Benchmarks the throughput of each hash algorithm"""
+
+    def test_throughput(self):
+        """Report MB/s of each registered algorithm hashing a file in the page cache"""
+        size = 64 * 2**20
+        file_path = os.path.join(self.tmp_dir, "file.bin")
+        with open(file_path, "wb") as file:
+            file.write(os.urandom(size))
+
+        rows = []
+        for algorithm in hashers.algorithms():
+            hasher = hashers.Hasher(algorithm)
+            seconds = utils.best_time(lambda hasher=hasher: hasher.hash_file(file_path))
+            rows.append([algorithm, seconds, size / 2**20 / seconds])
+
+        utils.report(
+            f"hash of a {size // 2**20} MiB file", ["algorithm", "time (s)", "MB/s"], rows
+        )
+
+    def test_large_file(self):
+        """Compare throughput and memory of the former 64 KiB read loop with the buffer reuse"""
+        size = 256 * 2**20
+        file_path = os.path.join(self.tmp_dir, "large.bin")
+        with open(file_path, "wb") as file:
+            for _ in range(size // 2**20):
+                file.write(os.urandom(2**20))
+
+        rows = []
+        for name, function in [
+            ("sha1 before", _sha1_read_loop),
+            ("sha1 after", hashers.Hasher("sha1").hash_file),
+            ("crc32 after", hashers.Hasher("crc32").hash_file),
+        ]:
+            seconds = utils.best_time(lambda function=function: function(file_path))
+            tracemalloc.start()
+            function(file_path)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rows.append([name, seconds, size / 2**20 / seconds, peak // 1024])
+
+        self.assertEqual(_sha1_read_loop(file_path), hashers.Hasher("sha1").hash_file(file_path))
+        utils.report(
+            f"hash of a {size // 2**20} MiB file",
+            ["implementation", "time (s)", "MB/s", "peak (KiB)"],
+            rows,
+        )
+
+
+def _sha1_read_loop(path: str) -> bytes:
+    """Former implementation: a new 64 KiB bytes object per read"""
+    hasher = hashlib.sha1()
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(65536)
+            if not data:
+                break
+            hasher.update(data)
+    return hasher.digest()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+"""Benchmarks ignore_matcher module"""
+
+import os
+import re
+import unittest
+
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+import benchmarks.util.utils_bench_lib as utils
+
+# typical rules of a project: extensions, tool directories and generated files
+_RULES = [
+    r".*\.o", r".*\.a", r".*\.so", r".*\.pyc", r".*\.pyo", r".*\.class", r".*\.log",
+    r".*\.tmp", r".*\.swp", r".*~", r".*/\.git", r".*/\.hg", r".*/\.svn", r".*/\.tox",
+    r".*/\.mypy_cache", r".*/__pycache__", r".*/node_modules", r".*/build", r".*/dist",
+    r".*/\.venv", r".*/\.idea", r".*/\.vscode", r".*/coverage", r".*/\.cache",
+    r".*/out/.*", r".*/tmp[0-9]+", r".*/CMakeFiles", r".*\.(bak|orig)", r".*/\.DS_Store",
+    r".*/generated_.*\.h",
+]
+
+
+def _per_regex(path: str, regexes) -> bool:
+    """Previous implementation: one fullmatch per rule"""
+    for regex in regexes:
+        if regex.fullmatch(path):
+            return True
+    return False
+
+
+class BenchIgnoreMatcher(utils.BenchWithTmpDir):
+    """Benchmarks the matcher against checking every rule"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.regexes = [re.compile(rule) for rule in _RULES]
+        self.root = os.path.join(self.tmp_dir, "project")
+        utils.create_tree(os.path.join(self.root, "src"), 2000)
+        utils.create_tree(os.path.join(self.root, "node_modules"), 4000)
+        utils.create_tree(os.path.join(self.root, "build"), 4000)
+
+    def test_match(self):
+        """Matching all paths of a tree with the matcher should be faster than rule by rule"""
+        paths = [os.path.join(adir, name)
+                 for adir, _, names in os.walk(self.root) for name in names]
+        matcher = ignore_matcher.IgnoreMatcher(self.regexes)
+        old = utils.best_time(lambda: [_per_regex(path, self.regexes) for path in paths])
+        new = utils.best_time(lambda: [matcher.matches(path) for path in paths])
+        self.assertEqual([_per_regex(path, self.regexes) for path in paths],
+                         [matcher.matches(path) for path in paths])
+
+        utils.report(
+            f"ignore rules ({len(_RULES)} rules)",
+            ["paths", "per rule (s)", "matcher (s)", "speedup"],
+            [[len(paths), old, new, old / new]],
+        )
+        self.assertLess(new, old)
+
+    def test_scan(self):
+        """Scanning with pruned node_modules and build lists only the tracked files"""
+        full = utils.best_time(lambda: tree_scanner.scan_tree(self.root, []))
+        pruned = utils.best_time(lambda: tree_scanner.scan_tree(self.root, self.regexes))
+        files, _ = tree_scanner.scan_tree(self.root, self.regexes)
+
+        utils.report(
+            "scan_tree with ignored node_modules and build",
+            ["files kept", "no rules (s)", "rules (s)"],
+            [[len(files), full, pruned]],
+        )
+        self.assertEqual(len(files), 2000)
+        self.assertLess(pruned, full)
+
+
+if __name__ == "__main__":
+    unittest.main()
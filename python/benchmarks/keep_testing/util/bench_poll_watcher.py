@@ -0,0 +1,41 @@
+"""Benchmarks poll_watcher module"""
+
+import os
+import unittest
+
+import apps.keep_testing.util.poll_watcher as poll_watcher
+
+import benchmarks.util.utils_bench_lib as utils
+
+_FILES = 20000
+
+
+class BenchAdaptivePolling(utils.BenchWithTmpDir):
+    """Benchmarks full polls against polls of the recently changed directories"""
+
+    def test_hot_polls(self):
+        """Polling the directories being edited should cost a fraction of a full poll"""
+        root = os.path.join(self.tmp_dir, "tree")
+        files = utils.create_tree(root, _FILES)
+        watcher = poll_watcher.PollWatcher([], [root])
+        edited = files[len(files) // 2]
+
+        def edit_and_scan(scan):
+            with open(edited, "ab") as file:
+                file.write(b"x")
+            self.assertEqual([str(change) for change in scan()], [f"changed {edited}"])
+
+        full = utils.best_time(lambda: edit_and_scan(watcher.scan_all))
+        full_interval = watcher._full_interval  # pylint: disable=protected-access
+        hot = utils.best_time(lambda: edit_and_scan(watcher.scan_hot))
+        hot_interval = watcher._hot_interval  # pylint: disable=protected-access
+        utils.report(
+            f"adaptive polling ({_FILES} files, 5% of the time scanning)",
+            ["poll", "time (s)", "interval (s)"],
+            [["all trees", full, full_interval], ["hot directories", hot, hot_interval]],
+        )
+        self.assertLess(hot * 10, full)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Benchmarks tree_scanner module"""
+
+import os
+import unittest
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+import benchmarks.util.utils_bench_lib as utils
+
+_SIZES = [1000, 2000, 4000, 8000]
+
+
+class BenchScanTree(utils.BenchWithTmpDir):
+    """Benchmarks scan time against the number of files in the tree"""
+
+    def test_scan_scales_linearly(self):
+        """Scan and DirInfo creation time per file should not grow with the tree"""
+        rows = []
+        per_file = []
+        for size in _SIZES:
+            root = os.path.join(self.tmp_dir, f"tree{size}")
+            utils.create_tree(root, size)
+            scan = utils.best_time(lambda root=root: tree_scanner.scan_tree(root, []))
+            build = utils.best_time(lambda root=root: file_status.DirInfo(root, []))
+            per_file.append(scan / size)
+            rows.append([size, scan, build, scan / size * 1e6, build / size * 1e6])
+
+        utils.report(
+            "scan_tree / DirInfo",
+            ["files", "scan (s)", "DirInfo (s)", "scan (us/file)", "DirInfo (us/file)"],
+            rows,
+        )
+        # linear scaling: the cost per file of the biggest tree stays close to the smallest
+        self.assertLess(per_file[-1], per_file[0] * 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Helpers for benchmarks"""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from typing import Callable, List
+
+
+class BenchWithTmpDir(unittest.TestCase):
+    """Base class for benchmarks that need a scratch directory"""
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.mkdtemp(prefix="keep_testing_bench_")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmp_dir)
+
+
+def create_tree(root: str, num_files: int, files_per_dir: int = 20, fanout: int = 4,
+                file_size: int = 256) -> List[str]:
+    """Creates a tree with `num_files` files spread over nested directories, modified a minute
+    ago (as in a checkout: hashes of files modified less than 2s ago are not reused)
+
+    Args:
+        root (str): directory where the tree is created
+        num_files (int): number of files to create
+        files_per_dir (int): number of files in each directory
+        fanout (int): number of subdirectories per directory
+        file_size (int): size in bytes of each file
+
+    Returns:
+        List[str]: the created files
+    """
+    content = os.urandom(file_size)
+    past = time.time() - 60
+    files: List[str] = []
+    pending = [root]
+    while len(files) < num_files:
+        current = pending.pop(0)
+        os.makedirs(current, exist_ok=True)
+        for index in range(min(files_per_dir, num_files - len(files))):
+            file_path = os.path.join(current, f"file{index}.dat")
+            with open(file_path, "wb") as file:
+                file.write(content)
+            os.utime(file_path, (past, past))
+            files.append(file_path)
+        pending.extend(os.path.join(current, f"dir{index}") for index in range(fanout))
+    return files
+
+
+def best_time(func: Callable[[], object], repeat: int = 3) -> float:
+    """Returns the best wall time in seconds of `repeat` executions of `func`"""
+    best = float("inf")
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - begin)
+    return best
+
+
+def report(title: str, header: List[str], rows: List[List[object]]) -> None:
+    """Prints a table with the results of a benchmark"""
+    print(f"\n{title}")
+    print(" | ".join(f"{col:>14}" for col in header))
+    for row in rows:
+        print(" | ".join(f"{col:>14.6g}" if isinstance(col, float) else f"{col:>14}"
+                         for col in row))
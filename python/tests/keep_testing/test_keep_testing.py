@@ -0,0 +1,180 @@
+"""Tests keep_testing module"""
+
+import unittest
+from typing import List, Set, Tuple
+from unittest import mock
+
+import apps.keep_testing.keep_testing as keep_testing
+import apps.keep_testing.util.command_runner as command_runner
+import apps.keep_testing.util.file_status as file_status
+
+_BASE = "/project"
+_ENTER = "<ENTER>"
+
+
+class _Stop(Exception):
+    """Raised when the script of changes ends to leave the execution loop"""
+
+
+def _changes(*paths, kind=file_status.CHANGED):
+    return [file_status.Change(kind, f"{_BASE}/{path}") for path in paths]
+
+
+class TestExecutionLoop(unittest.TestCase):
+    """Tests the commands and changed paths of each run of the execution loop"""
+
+    def setUp(self) -> None:
+        self.cmds = [
+            command_runner.Command("build", "make", (), ("src/",), _BASE),
+            command_runner.Command("test", "make test", ("build",), ("tests/",), _BASE),
+        ]
+        # (names of the commands, changed paths, reuse of cached results) of each run
+        self.runs: List[Tuple[List[str], List[str], bool]] = []
+        # names of the commands failing in each run (the others succeed)
+        self.failures: List[Set[str]] = []
+
+    def tearDown(self) -> None:
+        keep_testing.EnterMonitor.enter_pressed = False
+
+    def _run(self, *script):
+        """Runs the loop, each check returning the next changes of `script` (or pressing
+        <ENTER>), until the script ends"""
+        steps = list(script)
+        runs = self.runs
+        failures = self.failures
+
+        class _Runner:
+            """Records the runs and fails the commands in `failures`"""
+
+            # pylint: disable=unused-argument
+            def __init__(
+                self, cmds, wakeup, workers=1, changed=None, cache=None, keys=None, reuse=True
+            ):
+                failed = failures.pop(0) if failures else set()
+                runs.append(([cmd.name for cmd in cmds], list(changed or []), reuse))
+                self.states = {
+                    cmd.name: (
+                        command_runner.FAILED if cmd.name in failed else command_runner.SUCCEEDED,
+                        0.0,
+                    )
+                    for cmd in cmds
+                }
+
+            def start(self):
+                pass
+
+            def wait(self):
+                return True
+
+            def running(self):
+                return False
+
+            def cancel(self):
+                pass
+
+        def _check(*_args):
+            if not steps:
+                raise _Stop()
+            step = steps.pop(0)
+            if step == _ENTER:
+                keep_testing.EnterMonitor.enter_pressed = True
+                return []
+            return step
+
+        dirs_files = mock.Mock()
+        dirs_files.update.side_effect = _check
+        dirs_files.apply_events.side_effect = _check
+        dirs_files.expand_moves.side_effect = lambda changes: changes
+        watcher = mock.Mock()
+        watcher.in_burst.return_value = False
+        with mock.patch.object(command_runner, "CommandRunner", _Runner), self.assertRaises(
+            _Stop
+        ):
+            getattr(keep_testing, "__execution_loop")(
+                mock.Mock(), self.cmds, dirs_files, watcher, 300.0, False
+            )
+
+    def test_triggered_commands(self):
+        """Test that changes run the commands matching them and the ones depending on them"""
+        self._run(_changes("tests/a.py"), [], _changes("src/a.c"))
+        self.assertEqual(
+            self.runs,
+            [
+                (["build", "test"], [], True),
+                (["test"], [f"{_BASE}/tests/a.py"], True),
+                (["build", "test"], [f"{_BASE}/src/a.c"], True),
+            ],
+        )
+
+    def test_failed_commands_keep_changed_paths(self):
+        """Test that the paths changed since all commands succeeded are passed until they do"""
+        self.failures = [set(), {"test"}, set()]
+        self._run(_changes("tests/a.py"), _changes("tests/b.py"), _changes("tests/c.py"))
+        self.assertEqual(
+            self.runs,
+            [
+                (["build", "test"], [], True),
+                (["test"], [f"{_BASE}/tests/a.py"], True),
+                (["test"], [f"{_BASE}/tests/a.py", f"{_BASE}/tests/b.py"], True),
+                (["test"], [f"{_BASE}/tests/c.py"], True),
+            ],
+        )
+
+    def test_failed_first_run(self):
+        """Test that until all commands succeeded once they get no changed paths (everything
+        has to be checked)"""
+        self.failures = [{"test"}, {"test"}]
+        self._run(_changes("tests/a.py"), _changes("src/a.c"), _changes("tests/b.py"))
+        self.assertEqual(
+            self.runs,
+            [
+                (["build", "test"], [], True),
+                (["test"], [], True),
+                (["build", "test"], [], True),
+                (["test"], [f"{_BASE}/tests/b.py"], True),
+            ],
+        )
+
+    def test_enter(self):
+        """Test that <ENTER> runs all commands without cached results nor changed paths"""
+        self.failures = [set(), {"test"}]
+        self._run(_changes("tests/a.py"), _ENTER, _changes("tests/b.py"))
+        self.assertEqual(
+            self.runs,
+            [
+                (["build", "test"], [], True),
+                (["test"], [f"{_BASE}/tests/a.py"], True),
+                (["build", "test"], [], False),
+                (["test"], [f"{_BASE}/tests/b.py"], True),
+            ],
+        )
+
+    def test_deleted_and_moved_paths(self):
+        """Test that deleted paths trigger commands but are not passed to them"""
+        moved = file_status.Change(
+            file_status.MOVED, f"{_BASE}/tests/new.py", old_path=f"{_BASE}/src/old.c"
+        )
+        self._run(_changes("src/gone.c", kind=file_status.DELETED), [moved])
+        self.assertEqual(
+            self.runs,
+            [
+                (["build", "test"], [], True),
+                (["build", "test"], [], True),
+                (["build", "test"], [f"{_BASE}/tests/new.py"], True),
+            ],
+        )
+
+    def test_untriggered_changes(self):
+        """Test that changes no command depends on do not run commands"""
+        self._run(_changes("docs/a.md"), _changes("tests/a.py"))
+        self.assertEqual(
+            self.runs,
+            [
+                (["build", "test"], [], True),
+                (["test"], [f"{_BASE}/tests/a.py"], True),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Tests change_stream module"""
+
+import json
+import os
+import subprocess
+import unittest
+
+import apps.keep_testing.util.change_stream as change_stream
+import apps.keep_testing.util.file_status as file_status
+
+import tests.util.utils_tests_lib as utils
+
+_STAT = (5, 10**9, 7, 8)
+
+
+class TestChangeStream(utils.TestWithTmpDir):
+    """Tests ChangeStream class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.changes = [
+            file_status.Change(file_status.CHANGED, "/a/b.txt", _STAT, (6,) + _STAT[1:]),
+            file_status.Change(file_status.CREATED, "/a/dir"),
+        ]
+
+    def test_file(self):
+        """Test that each change is a JSON line appended to the file"""
+        path = os.path.join(utils.TEST_DIR_PATH, "changes.ndjson")
+        stream = change_stream.ChangeStream(path)
+        stream.write(self.changes)
+        stream.write([])
+        stream.close()
+        stream = change_stream.ChangeStream(path)
+        stream.write(self.changes[1:])
+        stream.close()
+        with open(path, "r", encoding="utf_8") as file:
+            records = [json.loads(line) for line in file]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(
+            {key: value for key, value in records[0].items() if key != "time"},
+            {
+                "kind": "changed",
+                "path": "/a/b.txt",
+                "old": {"size": 5, "mtime_ns": 10**9, "ino": 7, "dev": 8},
+                "new": {"size": 6, "mtime_ns": 10**9, "ino": 7, "dev": 8},
+            },
+        )
+        self.assertEqual(records[1]["old"], None)
+        self.assertEqual(records[0]["time"], records[1]["time"])
+
+    def test_fd(self):
+        """Test writing to a file descriptor"""
+        read_fd, write_fd = os.pipe()
+        stream = change_stream.ChangeStream(str(write_fd))
+        stream.write(self.changes[1:])
+        stream.close()
+        os.close(write_fd)
+        with os.fdopen(read_fd, "r", encoding="utf_8") as file:
+            self.assertEqual(json.loads(file.read())["path"], "/a/dir")
+
+    def test_stdout(self):
+        """Test that on the standard output other output goes to the standard error"""
+        paths = [os.path.join(utils.TEST_DIR_PATH, name) for name in ["stdout", "stderr"]]
+        saved = [os.dup(1), os.dup(2)]
+        try:
+            with open(paths[0], "w", encoding="utf_8") as out, open(
+                paths[1], "w", encoding="utf_8"
+            ) as err:
+                os.dup2(out.fileno(), 1)
+                os.dup2(err.fileno(), 2)
+                stream = change_stream.ChangeStream(change_stream.STDOUT)
+                subprocess.run(["echo", "command output"], check=True)
+                stream.write(self.changes[:1])
+                stream.close()
+                subprocess.run(["echo", "after"], check=True)
+        finally:
+            for fd, saved_fd in enumerate(saved, 1):
+                os.dup2(saved_fd, fd)
+                os.close(saved_fd)
+        with open(paths[0], "r", encoding="utf_8") as file:
+            record, after = file.read().splitlines()
+        self.assertEqual(json.loads(record)["kind"], "changed")
+        self.assertEqual(after, "after")
+        with open(paths[1], "r", encoding="utf_8") as file:
+            self.assertEqual(file.read(), "command output\n")
+
+    def test_change(self):
+        """Test the text of changes and the old path of moves"""
+        self.assertEqual(str(self.changes[0]), "changed /a/b.txt")
+        self.assertEqual(sorted(reversed(self.changes)), self.changes)
+        moved = file_status.Change("moved", "/a/c.txt", _STAT, _STAT, "/a/b.txt")
+        self.assertEqual(moved.to_json()["old_path"], "/a/b.txt")
+        self.assertNotIn("old_path", self.changes[0].to_json())
+
+
+if __name__ == "__main__":
+    unittest.main()
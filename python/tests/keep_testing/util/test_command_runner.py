@@ -0,0 +1,456 @@
+"""Tests command_runner module"""
+
+import os
+import threading
+import time
+import unittest
+
+import apps.keep_testing.util.command_runner as command_runner
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.result_cache as result_cache
+
+import tests.util.utils_tests_lib as utils
+
+Command = command_runner.Command
+
+
+class TestGraph(unittest.TestCase):
+    """Tests chain and graph functions"""
+
+    def test_chain(self):
+        """Test that each command depends on the previous one and names are unique"""
+        self.assertEqual(
+            command_runner.chain(["make", "make test", "make"]),
+            [
+                Command("make", "make"),
+                Command("make test", "make test", ("make",)),
+                Command("make (2)", "make", ("make test",)),
+            ],
+        )
+
+    def test_graph(self):
+        """Test that named commands come after their dependencies and after the chain"""
+        named = [
+            Command("test", "make test", ("build",)),
+            Command("lint", "pylint", ()),
+            Command("build", "make", ()),
+        ]
+        self.assertEqual(
+            command_runner.graph(["git pull"], named),
+            [
+                Command("git pull", "git pull"),
+                Command("build", "make", ("git pull",)),
+                Command("test", "make test", ("build",)),
+                Command("lint", "pylint", ("git pull",)),
+            ],
+        )
+        self.assertEqual(command_runner.graph([], named[1:]), named[1:])
+
+    def test_invalid_graph(self):
+        """Test that repeated names, unknown dependencies and cycles are errors"""
+        for named in [
+            [Command("make", "make")],
+            [Command("test", "make test", ("build",))],
+            [Command("a", "a", ("b",)), Command("b", "b", ("c",)), Command("c", "c", ("a",))],
+        ]:
+            with self.assertRaises(ValueError):
+                command_runner.graph(["make"], named)
+
+    def test_invalid_path(self):
+        """Test that invalid path patterns are errors"""
+        with self.assertRaises(ValueError):
+            command_runner.graph([], [Command("docs", "make docs", (), ("docs\\",))])
+
+
+class TestRouting(utils.TestWithTmpDir):
+    """Tests triggered and select functions"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.base = os.path.join(utils.TEST_DIR_PATH, "repo")
+        self.commands = [
+            Command("build", "make", (), ("src/", "Makefile")),
+            Command("test", "make test", ("build",), ("tests/**/*.py",)),
+            Command("lint", "pylint", ("build",), ("*.py", "!tests/**")),
+            Command("docs", "make docs", (), ("*.md",)),
+            Command("check", "true", ("test", "lint")),
+        ]
+
+    def _triggered(self, *paths):
+        paths = [os.path.normpath(os.path.join(self.base, path)) for path in paths]
+        return command_runner.triggered(self.commands, paths, self.base)
+
+    def test_triggered(self):
+        """Test that commands are triggered by changes in their paths (or any change)"""
+        self.assertEqual(self._triggered("README.md"), {"docs", "check"})
+        self.assertEqual(self._triggered("src/a/b.c"), {"build", "check"})
+        self.assertEqual(self._triggered("Makefile"), {"build", "check"})
+        self.assertEqual(self._triggered("tests/a/test_b.py"), {"test", "check"})
+        self.assertEqual(self._triggered("tools/x.py"), {"lint", "check"})
+        self.assertEqual(
+            self._triggered("README.md", "src/x.py"), {"build", "lint", "docs", "check"}
+        )
+        self.assertEqual(self._triggered("../outside/a.md"), {"check"})
+
+    def test_file_matcher(self):
+        """Test that the matcher remembering directories agrees with _matches"""
+        for command in self.commands[:4]:
+            rules = command_runner._rules(command, self.base)
+            matches = command_runner._file_matcher(rules)
+            for path in ["src/a/b.c", "tests/a/test_b.py", "tools/x.py", "README.md", "x.c"]:
+                path = os.path.join(self.base, path)
+                self.assertEqual(matches(path), command_runner._matches(rules, path, False))
+
+    def test_command_base(self):
+        """Test that the paths of a command are relative to its base (e.g. its TOML file)"""
+        command = Command("docs", "make docs", (), ("/docs/",), self.base)
+        path = os.path.join(self.base, "docs", "index.md")
+        self.assertEqual(command_runner.triggered([command], [path], "/elsewhere"), {"docs"})
+        self.assertEqual(command_runner.changed_paths(command, [path]), [path])
+        self.assertEqual(command_runner.triggered([command._replace(base="")], [path]), set())
+
+    def test_renamed_package(self):
+        """Test that a renamed directory triggers the commands of the files it moved"""
+        package = os.path.join(self.base, "src", "pkg")
+        os.makedirs(package)
+        for name in ["__init__.py", "a.py", "b.py"]:
+            open(os.path.join(package, name), "w", encoding="utf_8").close()
+        snapshot = file_status.DirsAndFiles([], [self.base], [])
+        os.rename(package, package + "2")
+        changed = snapshot.expand_moves(snapshot.apply_events([package, package + "2"]))
+        paths = [change.path for change in changed] + [change.old_path for change in changed]
+        self.assertEqual(
+            command_runner.triggered(self.commands[2:4], paths, self.base), {"lint"}
+        )
+        self.assertEqual(
+            command_runner.changed_paths(
+                self.commands[2], [change.path for change in changed], self.base
+            ),
+            [os.path.join(package + "2", name) for name in ["__init__.py", "a.py", "b.py"]],
+        )
+
+    def test_select(self):
+        """Test that the commands depending on the selected ones run again, not their
+        dependencies"""
+        self.assertEqual(
+            command_runner.select(self.commands, {"lint"}),
+            [
+                Command("lint", "pylint", (), ("*.py", "!tests/**")),
+                Command("check", "true", ("lint",)),
+            ],
+        )
+        self.assertEqual(
+            command_runner.select(self.commands, {"build"}),
+            self.commands[:3] + self.commands[4:],
+        )
+        self.assertEqual(command_runner.select(self.commands, {"docs"}), [self.commands[3]])
+        self.assertEqual(command_runner.select(self.commands, set()), [])
+
+    def test_changed_paths(self):
+        """Test that commands get the changed paths matching their paths (all without paths)"""
+        paths = [os.path.join(self.base, path) for path in ["src/a.c", "README.md"]]
+        self.assertEqual(
+            command_runner.changed_paths(self.commands[0], paths, self.base), paths[:1]
+        )
+        self.assertEqual(command_runner.changed_paths(self.commands[4], paths, self.base), paths)
+
+
+class TestInputKeys(utils.TestWithTmpDir):
+    """Tests input_keys function"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.base = utils.TEST_DIR_PATH
+        for path in ["src/a.c", "docs/a.md"]:
+            os.makedirs(os.path.join(self.base, os.path.dirname(path)), exist_ok=True)
+            with open(os.path.join(self.base, path), "w", encoding="utf_8") as file:
+                file.write(path)
+        self.snapshot = file_status.DirsAndFiles([], [self.base], [])
+        self.commands = [
+            Command("build", "make", (), ("src/",)),
+            Command("test", "make test {changed}", ("build",), ("tests/",)),
+            Command("docs", "make docs", (), ("*.md",)),
+            Command("all", "true"),
+        ]
+
+    def _keys(self, changed=()):
+        return command_runner.input_keys(self.commands, self.snapshot, changed, self.base)
+
+    def test_names(self):
+        """Test that only the keys of the given commands and their dependencies are computed"""
+        keys = self._keys()
+        self.assertEqual(
+            command_runner.input_keys(self.commands, self.snapshot, (), self.base, {"test"}),
+            {name: keys[name] for name in ["build", "test"]},
+        )
+
+    def _write(self, path, content):
+        with open(os.path.join(self.base, path), "w", encoding="utf_8") as file:
+            file.write(content)
+        self.snapshot.update()
+
+    def test_inputs(self):
+        """Test that keys change with the inputs of commands and of their dependencies"""
+        keys = self._keys()
+        self.assertEqual(len(set(keys.values())), 4)
+        self._write("src/a.c", "changed")
+        changed = self._keys()
+        self.assertEqual(
+            [name for name in keys if keys[name] != changed[name]], ["build", "test", "all"]
+        )
+        # back to the same contents
+        self._write("src/a.c", "src/a.c")
+        self.assertEqual(self._keys(), keys)
+
+    def test_changed(self):
+        """Test that the changed paths count only for commands using them"""
+        keys = self._keys()
+        changed = self._keys([os.path.join(self.base, "tests", "test_a.py")])
+        self.assertEqual([name for name in keys if keys[name] != changed[name]], ["test"])
+
+
+class TestCommandRunner(utils.TestWithTmpDir):
+    """Tests CommandRunner class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.log = os.path.join(utils.TEST_DIR_PATH, "log.txt")
+
+    def _lines(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log, encoding="utf_8") as file:
+            return file.read().split()
+
+    def _echo(self, text):
+        return f"echo {text} >> {self.log}"
+
+    def test_success(self):
+        """Test that all commands run in order and the done event is set"""
+        done = threading.Event()
+        runner = command_runner.CommandRunner(
+            command_runner.chain([self._echo("a"), self._echo("b")]), done
+        )
+        runner.start()
+        self.assertTrue(runner.wait())
+        self.assertTrue(done.is_set())
+        self.assertFalse(runner.running())
+        self.assertEqual(self._lines(), ["a", "b"])
+        self.assertEqual(
+            [state for state, _ in runner.states.values()], [command_runner.SUCCEEDED] * 2
+        )
+
+    def test_failure(self):
+        """Test that the chain stops at the first failed command"""
+        runner = command_runner.CommandRunner(
+            command_runner.chain([self._echo("a"), "exit 3", self._echo("b")])
+        )
+        runner.start()
+        self.assertFalse(runner.wait())
+        self.assertEqual(self._lines(), ["a"])
+        self.assertEqual(
+            {name: state for name, (state, _) in runner.states.items()},
+            {
+                self._echo("a"): command_runner.SUCCEEDED,
+                "exit 3": command_runner.FAILED,
+                self._echo("b"): command_runner.SKIPPED,
+            },
+        )
+
+    def test_parallel(self):
+        """Test that independent commands run at the same time, up to the number of workers"""
+        # each one waits for the others to start
+        others = "for other in a b c; do until grep -q $other {log}; do sleep 0.01; done; done"
+        commands = [
+            Command("build", self._echo("build")),
+            *[
+                Command(name, f"{self._echo(name)}; {others.format(log=self.log)}", ("build",))
+                for name in ["a", "b", "c"]
+            ],
+            Command("end", self._echo("end"), ("a", "b", "c")),
+        ]
+        runner = command_runner.CommandRunner(commands, workers=3)
+        runner.start()
+        self.assertTrue(runner.wait())
+        lines = self._lines()
+        self.assertEqual(
+            (lines[0], sorted(lines[1:4]), lines[4]), ("build", ["a", "b", "c"], "end")
+        )
+
+        # with 2 workers, the third one never starts
+        os.remove(self.log)
+        runner = command_runner.CommandRunner(commands, grace=0.1, workers=2)
+        runner.start()
+        while len(self._lines()) < 3:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEqual(len(self._lines()), 3)
+        runner.cancel()
+
+    def test_fail_fast_along_dependencies(self):
+        """Test that a failure skips the commands depending on it, not the others"""
+        runner = command_runner.CommandRunner(
+            [
+                Command("build", self._echo("build")),
+                Command("test", "exit 1", ("build",)),
+                Command("lint", self._echo("lint"), ("build",)),
+                Command("report", self._echo("report"), ("test",)),
+                Command("deploy", self._echo("deploy"), ("report", "lint")),
+            ],
+            workers=2,
+        )
+        runner.start()
+        self.assertFalse(runner.wait())
+        self.assertEqual(self._lines(), ["build", "lint"])
+        self.assertEqual(
+            {name: state for name, (state, _) in runner.states.items()},
+            {
+                "build": command_runner.SUCCEEDED,
+                "test": command_runner.FAILED,
+                "lint": command_runner.SUCCEEDED,
+                "report": command_runner.SKIPPED,
+                "deploy": command_runner.SKIPPED,
+            },
+        )
+
+    def test_wall_time(self):
+        """Test that the wall time of each command is recorded"""
+        runner = command_runner.CommandRunner(command_runner.chain(["sleep 0.2"]))
+        runner.start()
+        runner.wait()
+        state, seconds = runner.states["sleep 0.2"]
+        self.assertEqual(state, command_runner.SUCCEEDED)
+        self.assertGreaterEqual(seconds, 0.2)
+
+    def test_changed(self):
+        """Test that commands get the changed paths as arguments, in a variable and in a file"""
+        changed = [os.path.join(utils.TEST_DIR_PATH, name) for name in ["a b.py", "c.py"]]
+        env = f'"${command_runner.CHANGED_ENV}"'
+        commands = [
+            Command(
+                "args", f"for path in {command_runner.CHANGED}; do {self._echo('$path')}; done"
+            ),
+            Command("env", self._echo(env), ("args",)),
+            Command("file", f"cat {command_runner.CHANGED_FILE} >> {self.log}", ("env",)),
+            Command("file_env", f'cat "${command_runner.CHANGED_FILE_ENV}" >> {self.log}'),
+            # none of the changed paths matches
+            Command("none", self._echo(f"none:{env}"), (), ("*.c",)),
+        ]
+        runner = command_runner.CommandRunner(commands, changed=changed)
+        runner.start()
+        self.assertTrue(runner.wait())
+        with open(self.log, encoding="utf_8") as file:
+            lines = file.read().splitlines()
+        self.assertEqual(lines, changed * 4 + ["none:"])
+
+    def test_changed_env_too_long(self):
+        """Test that the variable is unset when its paths take too many bytes (not characters)"""
+        # 40k characters, 160 KiB (Linux refuses variables over 128 KiB)
+        changed = [
+            os.path.join(utils.TEST_DIR_PATH, str(index), "\U0001f600" * 10_000)
+            for index in range(4)
+        ]
+        runner = command_runner.CommandRunner(
+            command_runner.chain([self._echo(f'unset:"${command_runner.CHANGED_ENV}"')]),
+            changed=changed,
+        )
+        runner.start()
+        self.assertTrue(runner.wait())
+        self.assertEqual(self._lines(), ["unset:"])
+
+    def test_changed_file_removed(self):
+        """Test that the file of changed paths is removed after the command"""
+        runner = command_runner.CommandRunner(
+            command_runner.chain([f"echo {command_runner.CHANGED_FILE} > {self.log}"]),
+            changed=["a"],
+        )
+        runner.start()
+        self.assertTrue(runner.wait())
+        self.assertFalse(os.path.exists(self._lines()[0]))
+
+    def test_result_cache(self):
+        """Test that cached results are replayed instead of executing commands"""
+        cache = result_cache.ResultCache(os.path.join(utils.TEST_DIR_PATH, "results"), 10000)
+        commands = command_runner.chain([self._echo("a"), "echo output; exit 2"])
+        keys = {command.name: command.name.replace(" ", "_")[:8] for command in commands}
+
+        def run(reuse=True):
+            runner = command_runner.CommandRunner(commands, cache=cache, keys=keys, reuse=reuse)
+            runner.start()
+            self.assertFalse(runner.wait())
+            return {name: state for name, (state, _) in runner.states.items()}
+
+        states = {commands[0].name: command_runner.SUCCEEDED, "echo output; exit 2": "failed"}
+        self.assertEqual(run(), states)
+        self.assertEqual(run(), states)
+        self.assertEqual(self._lines(), ["a"])
+        self.assertEqual(cache.get(keys["echo output; exit 2"]).output, b"output\n")
+        self.assertEqual(cache.get(keys["echo output; exit 2"]).code, 2)
+
+        # executed again and stored
+        self.assertEqual(run(reuse=False), states)
+        self.assertEqual(self._lines(), ["a", "a"])
+
+    def test_invalid_workers(self):
+        """Test that at least one worker is needed"""
+        with self.assertRaises(ValueError):
+            command_runner.CommandRunner([], workers=0)
+
+    def test_own_process_group(self):
+        """Test that each command leads its own process group"""
+        runner = command_runner.CommandRunner(
+            command_runner.chain([f"ps -o pid=,pgid= -p $$ > {self.log}"])
+        )
+        runner.start()
+        self.assertTrue(runner.wait())
+        pid, pgid = self._lines()
+        self.assertEqual(pid, pgid)
+        self.assertNotEqual(int(pgid), os.getpgrp())
+
+    def test_cancel(self):
+        """Test that cancelling kills the running command with its children and skips the
+        next ones"""
+        done = threading.Event()
+        runner = command_runner.CommandRunner(
+            command_runner.chain(
+                [f"(sleep 30; {self._echo('child')}) & {self._echo('started')}; wait",
+                 self._echo("next")]
+            ),
+            done,
+        )
+        runner.start()
+        while self._lines() != ["started"]:
+            time.sleep(0.01)
+        begin = time.monotonic()
+        runner.cancel()
+        self.assertLess(time.monotonic() - begin, command_runner.DEFAULT_GRACE)
+        self.assertTrue(done.is_set())
+        self.assertIsNone(runner.result)
+        self.assertFalse(runner.running())
+        self.assertEqual(self._lines(), ["started"])
+
+    def test_kill(self):
+        """Test that a command ignoring SIGTERM is killed after the grace period"""
+        runner = command_runner.CommandRunner(
+            command_runner.chain([f"trap '' TERM; {self._echo('started')}; sleep 30"]),
+            grace=0.1,
+        )
+        runner.start()
+        while self._lines() != ["started"]:
+            time.sleep(0.01)
+        begin = time.monotonic()
+        runner.cancel()
+        self.assertLess(time.monotonic() - begin, 5)
+        self.assertIsNone(runner.wait())
+
+    def test_cancel_before_start(self):
+        """Test that a chain cancelled before it starts runs nothing"""
+        runner = command_runner.CommandRunner(command_runner.chain([self._echo("a")]))
+        runner.cancel()
+        runner.start()
+        self.assertIsNone(runner.wait())
+        self.assertEqual(self._lines(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
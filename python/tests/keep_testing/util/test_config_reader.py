@@ -5,6 +5,7 @@
 import os
 import unittest
 
+import apps.keep_testing.util.command_runner as command_runner
 import apps.keep_testing.util.config_reader as config_reader
 
 import tests.util.utils_tests_lib as utils
@@ -25,6 +26,7 @@ class TestConfigReader(utils.TestWithTmpDir):
             dirs = ["/path/to/dir1", "/path/to/dir2"]
             files = ["path/to/file1.txt", "/path/to/file2.txt"]
             ignores = [".*\\\\.git", ".*\\\\.idea"]
+            hash = "blake2b"
             """
         )
         reader = config_reader.ConfigReader(self.file_path)
@@ -32,23 +34,66 @@ class TestConfigReader(utils.TestWithTmpDir):
         self.assertEqual(reader.dirs(), ["/path/to/dir1", "/path/to/dir2"])
         self.assertEqual(reader.files(), ["path/to/file1.txt", "/path/to/file2.txt"])
         self.assertEqual(reader.ignores(), [".*\\.git", ".*\\.idea"])
+        self.assertEqual(reader.hash_algorithm(), "blake2b")
+
+    def test_commands(self):
+        """Test named commands with dependencies"""
+        self._fill_file(
+            """
+            [commands.build]
+            cmd = "make"
+
+            [commands.test]
+            cmd = "make test"
+            depends_on = ["build"]
+            paths = ["src/", "tests/"]
+            """
+        )
+        reader = config_reader.ConfigReader(self.file_path)
+        # paths are relative to the directory of the file
+        base = os.path.dirname(os.path.realpath(self.file_path))
+        self.assertEqual(
+            reader.commands(),
+            [
+                command_runner.Command("build", "make", base=base),
+                command_runner.Command(
+                    "test", "make test", ("build",), ("src/", "tests/"), base
+                ),
+            ],
+        )
+
+    def test_error_commands(self):
+        """Test named commands without command or with dependencies or paths that are not lists"""
+        for content in [
+            'commands = "make"',
+            "[commands.build]\ndepends_on = []",
+            '[commands.build]\ncmd = "make"\ndepends_on = "test"',
+            '[commands.build]\ncmd = "make"\npaths = "src"',
+        ]:
+            self._fill_file(content)
+            with self.assertRaises(ValueError):
+                config_reader.ConfigReader(self.file_path)
 
     def test_empty_file(self):
         """Test an empty toml file"""
         self._fill_file("")
         reader = config_reader.ConfigReader(self.file_path)
         self.assertEqual(reader.cmds(), [])
+        self.assertEqual(reader.commands(), [])
         self.assertEqual(reader.dirs(), [])
         self.assertEqual(reader.files(), [])
         self.assertEqual(reader.ignores(), [])
+        self.assertEqual(reader.hash_algorithm(), "")
 
     def test_no_file(self):
         """Test an empty toml file"""
         reader = config_reader.ConfigReader("")
         self.assertEqual(reader.cmds(), [])
+        self.assertEqual(reader.commands(), [])
         self.assertEqual(reader.dirs(), [])
         self.assertEqual(reader.files(), [])
         self.assertEqual(reader.ignores(), [])
+        self.assertEqual(reader.hash_algorithm(), "")
 
     def test_error_not_list(self):
         """Test a file with basic config"""
@@ -58,6 +103,12 @@ class TestConfigReader(utils.TestWithTmpDir):
             with self.assertRaises(ValueError):
                 config_reader.ConfigReader(self.file_path)
 
+    def test_error_not_string(self):
+        """Test a file with a list where a string is expected"""
+        self._fill_file('hash = ["sha1"]')
+        with self.assertRaises(ValueError):
+            config_reader.ConfigReader(self.file_path)
+
     def _fill_file(self, content: str) -> None:
         with open(self.file_path, "w", encoding="utf-8") as file:
             print(content, file=file)
@@ -4,11 +4,13 @@
 
 import itertools
 import os
+import re
 import time
 import shutil
 import unittest
 
 import apps.keep_testing.util.dir_watcher as dir_watcher
+import apps.keep_testing.util.inotify_observer as inotify_observer
 
 import tests.util.utils_tests_lib as utils
 
@@ -16,6 +18,11 @@ import tests.util.utils_tests_lib as utils
 class TestDirWatcher(utils.TestWithTmpDir):
     """Tests DirWatcher class"""
 
+    backend = dir_watcher.WATCHDOG
+
+    def _create_watcher(self, files, dirs, **kwargs):
+        return dir_watcher.DirWatcher(files, dirs, backend=self.backend, **kwargs)
+
     def setUp(self) -> None:
         super().setUp()
 
@@ -56,7 +63,7 @@ class TestDirWatcher(utils.TestWithTmpDir):
 
         time.sleep(0.2)
 
-        self.watcher = dir_watcher.DirWatcher(self.files, self.dirs)
+        self.watcher = self._create_watcher(self.files, self.dirs)
         self.watcher.start()
 
     def tearDown(self) -> None:
@@ -66,17 +73,62 @@ class TestDirWatcher(utils.TestWithTmpDir):
     def _changed(self) -> bool:
         return self.watcher.changed()
 
+    def test_unknown_backend(self):
+        """Test that an unknown backend is an error"""
+        with self.assertRaises(ValueError):
+            dir_watcher.DirWatcher(self.files, self.dirs, backend="other")
+
     def test_unify_dirs(self):
         """Test that unify_dirs creates a list with directories without repetition"""
-        unique_dirs = dir_watcher.DirWatcher._unify_dirs(self.files, self.dirs)
-        expect_dirs = [
-            os.path.join(utils.TEST_DIR_PATH, "bin"),
-            os.path.join(utils.TEST_DIR_PATH, "build"),
-            os.path.join(utils.TEST_DIR_PATH, "lib"),
-            os.path.join(utils.TEST_DIR_PATH, "src"),
-            os.path.join(utils.TEST_DIR_PATH, "usr"),
-        ]
-        self.assertEqual(unique_dirs, expect_dirs)
+        recursive, file_dirs = dir_watcher.DirWatcher._unify_dirs(self.files, self.dirs)
+        self.assertEqual(
+            recursive,
+            [
+                os.path.join(utils.TEST_DIR_PATH, "bin"),
+                os.path.join(utils.TEST_DIR_PATH, "lib"),
+                os.path.join(utils.TEST_DIR_PATH, "usr"),
+            ],
+        )
+        self.assertEqual(
+            file_dirs,
+            [
+                os.path.join(utils.TEST_DIR_PATH, "build"),
+                os.path.join(utils.TEST_DIR_PATH, "src"),
+                os.path.join(utils.TEST_DIR_PATH, "src", "app"),
+            ],
+        )
+
+    def test_unify_dirs_components(self):
+        """Test that a directory does not contain another one with the same prefix"""
+        recursive, file_dirs = dir_watcher.DirWatcher._unify_dirs(
+            ["/a/bc/file", "/a/b/c/file"], ["/a/b", "/a/bc/d", "/a/b/c"]
+        )
+        self.assertEqual(recursive, ["/a/b", "/a/bc/d"])
+        self.assertEqual(file_dirs, ["/a/bc"])
+
+    def test_unify_dirs_siblings_between(self):
+        """Test that a sibling sorting between a directory and its subdirectory is not a parent"""
+        recursive, _ = dir_watcher.DirWatcher._unify_dirs(
+            [], ["/a/b", "/a/b.d", "/a/b/c", "/a/b-e"]
+        )
+        self.assertEqual(recursive, ["/a/b", "/a/b-e", "/a/b.d"])
+
+    def test_file_siblings(self):
+        """Test that only the watched files are reported in their directories"""
+        watched = [file for file in self.files if "/build/" in file]
+        sibling = os.path.join(os.path.dirname(watched[0]), "sibling.txt")
+        utils.create_file(sibling)
+        new_dir = os.path.join(os.path.dirname(watched[0]), "new_dir")
+        utils.create_dir(new_dir)
+        utils.create_file(os.path.join(new_dir, "file.txt"))
+        self.assertFalse(self._changed())
+
+        moved = os.path.join(os.path.dirname(watched[0]), "moved.txt")
+        os.rename(sibling, watched[0])
+        os.rename(watched[1], moved)
+        time.sleep(0.2)
+        self.assertTrue(self._changed())
+        self.assertEqual(self.watcher.pop_events(), {watched[0], watched[1]})
 
     def test_no_change(self):
         """Test that when nothing is changed returns False"""
@@ -98,6 +150,124 @@ class TestDirWatcher(utils.TestWithTmpDir):
             self.assertTrue(self._changed(), msg=file)
             self.assertFalse(self._changed(), msg=file)
 
+    def test_pop_events(self):
+        """Test that the paths of change events are accumulated until popped"""
+        for file in self.files[:3]:
+            utils.change_file(file)
+        new_dir = os.path.join(self.dirs[0], "new_dir")
+        utils.create_dir(new_dir)
+        utils.change_file(self.file_not_watched)
+
+        events = self.watcher.pop_events()
+        self.assertEqual(events, set(self.files[:3] + [new_dir]))
+        self.assertEqual(self.watcher.pop_events(), set())
+
+    def test_pop_events_moved(self):
+        """Test that both paths of a move are reported"""
+        moved = os.path.join(os.path.dirname(self.files[0]), "moved.txt")
+        os.rename(self.files[0], moved)
+        time.sleep(0.2)
+
+        events = self.watcher.pop_events()
+        self.assertIn(self.files[0], events)
+        self.assertIn(moved, events)
+
+    def test_wakeup(self):
+        """Test that change events set the wakeup event"""
+        self.watcher.wakeup.clear()
+        self.assertFalse(self.watcher.wakeup.wait(0.1))
+        with open(self.files[0], "a", encoding="utf_8") as file:
+            print("more content", file=file)
+        self.assertTrue(self.watcher.wakeup.wait(5))
+
+    def _burst(self, debounce, max_wait, duration):
+        """Writes a file every 50ms during `duration` seconds with a debouncing watcher
+
+        Returns:
+            bool: if the wakeup event was set before the end of the burst
+        """
+        self.watcher.stop()
+        self.watcher = self._create_watcher(
+            self.files, self.dirs, debounce=debounce, max_wait=max_wait
+        )
+        self.watcher.start()
+        end = time.monotonic() + duration
+        while time.monotonic() < end:
+            with open(self.files[0], "a", encoding="utf_8") as file:
+                print("more content", file=file)
+            time.sleep(0.05)
+        return self.watcher.wakeup.is_set()
+
+    def test_debounce(self):
+        """Test that a burst of events sets the wakeup event once, when it ends"""
+        self.assertFalse(self._burst(0.4, 10, 0.8))
+        self.assertTrue(self.watcher.in_burst())
+        self.assertTrue(self.watcher.wakeup.wait(5))
+        self.assertFalse(self.watcher.in_burst())
+        self.assertEqual(self.watcher.pop_events(), {self.files[0]})
+
+    def test_debounce_max_wait(self):
+        """Test that a long burst sets the wakeup event after the maximum wait"""
+        self.assertTrue(self._burst(0.4, 0.3, 1.0))
+
+    def test_ignore(self):
+        """Test that events on ignored paths and inside ignored directories are dropped"""
+        self.watcher.stop()
+        self.watcher = self._create_watcher(
+            self.files, self.dirs, ignore=[re.compile(r".*/build"), re.compile(r".*\.pyc")]
+        )
+        self.watcher.start()
+        lib = self.dirs[1]
+        utils.create_dir(os.path.join(lib, "build"))
+        utils.create_dir(os.path.join(lib, "build", "sub"))
+        utils.create_file(os.path.join(lib, "build", "sub", "file.txt"))
+        utils.create_file(os.path.join(lib, "file.pyc"))
+        self.assertFalse(self._changed())
+        self.assertEqual(self.watcher.pop_events(), set())
+
+        # watched files are not ignored, even in ignored directories
+        watched = [file for file in self.files if "/build/" in file][0]
+        utils.change_file(watched)
+        new_file = os.path.join(lib, "file.txt")
+        utils.create_file(new_file)
+        self.assertTrue(self._changed())
+        self.assertEqual(self.watcher.pop_events(), {watched, new_file})
+
+    def test_watch_budget(self):
+        """Test that subtrees beyond the watch budget are polled"""
+        self.watcher.stop()
+        with self.assertLogs(level="WARNING"):
+            self.watcher = self._create_watcher(
+                [], self.dirs, max_watches=len(self.dirs) - 1, poll_interval=0.01
+            )
+        self.watcher.start()
+        exe = self.dirs[3]
+        self.assertEqual(self.watcher._poller.subtrees, [exe])
+        new_file = os.path.join(exe, "new_file.txt")
+        utils.create_file(new_file)
+        time.sleep(0.1)
+        self.assertTrue(self._changed())
+        self.assertEqual(self.watcher.pop_events(), {exe})
+
+    def test_watch_budget_new_dir(self):
+        """Test that directories created in a directory watched without its subtree are polled"""
+        self.watcher.stop()
+        root = os.path.join(utils.TEST_DIR_PATH, "tree")
+        for parent, child in itertools.product("abcd", "1234"):
+            os.makedirs(os.path.join(root, parent, child))
+        with self.assertLogs(level="WARNING"):
+            self.watcher = self._create_watcher([], [root], max_watches=6, poll_interval=0.01)
+        self.watcher.start()
+        new_dir = os.path.join(root, "new")
+        utils.create_dir(new_dir)
+        self.assertTrue(self._changed())
+        self.assertEqual(self.watcher.pop_events(), {new_dir})
+        new_file = os.path.join(new_dir, "f.txt")
+        utils.create_file(new_file)
+        time.sleep(0.1)
+        self.assertTrue(self._changed())
+        self.assertEqual(self.watcher.pop_events(), {new_dir})
+
     def test_create_file(self):
         """Test that when a file is created returns True"""
         for adir in self.dirs:
@@ -134,7 +304,7 @@ class TestDirWatcher(utils.TestWithTmpDir):
         utils.remove_file(self.file_not_watched)
 
         self.watcher.stop()  # will create it differently
-        self.watcher = dir_watcher.DirWatcher([], self.dirs)
+        self.watcher = self._create_watcher([], self.dirs)
         self.watcher.start()
 
         for adir in sorted(self.dirs, reverse=True):
@@ -147,7 +317,7 @@ class TestDirWatcher(utils.TestWithTmpDir):
     def test_create_file_in_created_dir(self):
         """Test that when a file is created under a created dir returns True"""
         self.watcher.stop()  # will create it differently
-        self.watcher = dir_watcher.DirWatcher([], self.dirs)
+        self.watcher = self._create_watcher([], self.dirs)
         self.watcher.start()
 
         for adir in self.dirs:
@@ -167,7 +337,7 @@ class TestDirWatcher(utils.TestWithTmpDir):
     def test_create_dir_in_created_dir(self):
         """Test that when a dir is created under a created dir returns True"""
         self.watcher.stop()  # will create it differently
-        self.watcher = dir_watcher.DirWatcher([], self.dirs)
+        self.watcher = self._create_watcher([], self.dirs)
         self.watcher.start()
 
         for adir in self.dirs:
@@ -186,5 +356,44 @@ class TestDirWatcher(utils.TestWithTmpDir):
         self.assertFalse(self._changed())
 
 
+class TestDirWatcherInotify(TestDirWatcher):
+    """Tests DirWatcher class with the inotify backend"""
+
+    backend = dir_watcher.INOTIFY
+
+    def test_ignored_dirs_not_watched(self):
+        """Test that ignored directories get no watches"""
+        self.watcher.stop()
+        self.watcher = self._create_watcher(
+            [], self.dirs, ignore=[re.compile(r".*/exe")]
+        )
+        self.assertEqual(self.watcher._observer.watches, len(self.dirs) - 1)
+        self.watcher.start()
+        new_dir = os.path.join(self.dirs[0], "new_dir")
+        utils.create_dir(new_dir)
+        utils.create_dir(os.path.join(new_dir, "exe"))
+        self.assertEqual(self.watcher._observer.watches, len(self.dirs))
+
+    def test_moved_dir(self):
+        """Test that a moved directory is watched at its new path"""
+        self.watcher.stop()
+        self.watcher = self._create_watcher([], self.dirs)
+        self.watcher.start()
+        moved = os.path.join(self.dirs[0], "moved")
+        os.rename(self.dirs[3], moved)
+        time.sleep(0.2)
+        self.watcher.pop_events()
+        new_file = os.path.join(moved, "new_file.txt")
+        utils.create_file(new_file)
+        self.assertEqual(self.watcher.pop_events(), {new_file})
+
+    def test_overflow(self):
+        """Test that lost events result in checking all watched directories"""
+        data = inotify_observer._HEADER.pack(-1, inotify_observer.flags.IN_Q_OVERFLOW, 0, 0)
+        with self.assertLogs(level="WARNING"):
+            events = self.watcher._observer._parse(data)
+        self.assertEqual(events, [(adir, True) for adir in self.watcher._observer._roots])
+
+
 if __name__ == "__main__":
     unittest.main()
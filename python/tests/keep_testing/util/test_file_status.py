@@ -7,13 +7,21 @@ import itertools
 import os
 import random
 import re
+import shutil
+import time
 import unittest
+from unittest import mock
 
 import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.hashers as hashers
 
 import tests.util.utils_tests_lib as utils
 
 
+def _texts(changes):
+    return [str(change) for change in changes]
+
+
 class TestFileInfo(utils.TestWithTmpDir):
     """Tests FileInfo class"""
 
@@ -27,19 +35,20 @@ class TestFileInfo(utils.TestWithTmpDir):
             print(self.file1_content, file=file)
         with open(self.file2_path, "w") as file:
             print(self.file2_content, file=file)
+        utils.backdate(self.file1_path, self.file2_path)
 
     def test_hash(self):
         """Test that hash function calculates sha1"""
         hasher = hashlib.sha1()
         hasher.update(str.encode(f"{self.file1_content}\n"))
-        expected_hash = hasher.hexdigest()
+        expected_hash = hasher.digest()
         self.assertEqual(
             file_status.FileInfo._calculate_hash(self.file1_path), expected_hash
         )
 
         hasher = hashlib.sha1()
         hasher.update(str.encode(f"{self.file2_content}\n"))
-        expected_hash = hasher.hexdigest()
+        expected_hash = hasher.digest()
         self.assertEqual(
             file_status.FileInfo._calculate_hash(self.file2_path), expected_hash
         )
@@ -59,7 +68,7 @@ class TestFileInfo(utils.TestWithTmpDir):
     def test_create_non_existent(self):
         """Test creation of FileInfo with non-existent file"""
         file_info = file_status.FileInfo("non-existent")
-        self.assertEqual(file_info._hash, "")
+        self.assertEqual(file_info._hash, b"")
 
     def test_comparison(self):
         """Test comparisons of FileInfo's"""
@@ -76,6 +85,77 @@ class TestFileInfo(utils.TestWithTmpDir):
         self.assertNotEqual(file1_info, non_existent)
         self.assertNotEqual(file2_info, non_existent)
 
+    def test_compact(self):
+        """Test FileInfo has no __dict__ and keeps raw digest and packed stat"""
+        file_info = file_status.FileInfo(self.file1_path)
+        self.assertFalse(hasattr(file_info, "__dict__"))
+        self.assertEqual(len(file_info._stat), 32)
+        self.assertEqual(
+            file_info.digest, hashlib.sha1(f"{self.file1_content}\n".encode()).digest()
+        )
+
+    def test_stat(self):
+        """Test that FileInfo keeps size, mtime, inode and device"""
+        stat = os.stat(self.file1_path)
+        file_info = file_status.FileInfo(self.file1_path)
+        self.assertEqual(
+            file_info.stat,
+            (stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_dev),
+        )
+        self.assertEqual(file_status.FileInfo("non-existent").stat, ())
+        self.assertEqual(file_status.FileInfo(utils.TEST_DIR_PATH).stat, ())
+
+    def test_hash_reused_when_stat_unchanged(self):
+        """Test that the hash is not calculated again if stat did not change"""
+        previous = file_status.FileInfo(self.file1_path)
+        with mock.patch.object(file_status.FileInfo, "_calculate_hash") as calculate:
+            file_info = file_status.FileInfo(self.file1_path, previous=previous)
+        calculate.assert_not_called()
+        self.assertEqual(file_info, previous)
+        self.assertEqual(file_info.stat, previous.stat)
+
+    def test_racy_hash_not_reused(self):
+        """Test that a file rewritten within its timestamp tick after it was hashed is hashed
+        again (its hash is not saved either)"""
+        stat = os.stat(self.file1_path)
+        os.utime(self.file1_path, ns=(stat.st_atime_ns, time.time_ns()))
+        stat = os.stat(self.file1_path)
+        previous = file_status.FileInfo(self.file1_path)
+        self.assertTrue(previous.racy)
+        # same size and modification time
+        with open(self.file1_path, "r+", encoding="utf_8") as file:
+            file.write("X")
+        os.utime(self.file1_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        file_info = file_status.FileInfo(self.file1_path, previous=previous)
+        self.assertEqual(file_info.stat, previous.stat)
+        self.assertNotEqual(file_info, previous)
+
+        self.assertFalse(file_status.FileInfo(self.file2_path).racy)
+
+    def test_touch_is_not_a_change(self):
+        """Test that a new mtime leads to a new hash but same content is equal"""
+        previous = file_status.FileInfo(self.file1_path)
+        stat = os.stat(self.file1_path)
+        os.utime(self.file1_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        with mock.patch.object(
+            file_status.FileInfo,
+            "_calculate_hash",
+            wraps=file_status.FileInfo._calculate_hash,
+        ) as calculate:
+            file_info = file_status.FileInfo(self.file1_path, previous=previous)
+        calculate.assert_called_once_with(self.file1_path, hashers.DEFAULT)
+        self.assertNotEqual(file_info.stat, previous.stat)
+        self.assertEqual(file_info, previous)
+
+    def test_same_size_change(self):
+        """Test that a change keeping the size is detected"""
+        previous = file_status.FileInfo(self.file1_path)
+        with open(self.file1_path, "r+") as file:
+            file.write("X")
+        stat = os.stat(self.file1_path)
+        os.utime(self.file1_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertNotEqual(file_status.FileInfo(self.file1_path, previous=previous), previous)
+
 
 class TestDirInfo(utils.TestWithTmpDir):
     """Tests FileInfo class"""
@@ -102,7 +182,7 @@ class TestDirInfo(utils.TestWithTmpDir):
         dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
         self.assertEqual(dir_info._path, utils.TEST_DIR_PATH)
         expected_files = {file: file_status.FileInfo(file) for file in self.files}
-        self.assertEqual(dir_info._files, expected_files)
+        self.assertEqual(dir_info.files, expected_files)
 
     def test_create_with_ignore(self):
         """Test creation of DirInfo with ignore."""
@@ -125,7 +205,7 @@ class TestDirInfo(utils.TestWithTmpDir):
         )
 
         expected_files = {file: file_status.FileInfo(file) for file in filtered}
-        self.assertEqual(dir_info._files, expected_files)
+        self.assertEqual(dir_info.files, expected_files)
         # dirs[1] is build that is ignored
         self.assertEqual(dir_info._dirs, [self.dirs[0], self.dirs[2]])
 
@@ -151,6 +231,208 @@ class TestDirInfo(utils.TestWithTmpDir):
 
         self.assertEqual(dir_info_0, dir_info_1)
 
+    def test_create_with_hash_workers(self):
+        """Test that hashing with threads gives the same result"""
+        dir_info = file_status.DirInfo(
+            utils.TEST_DIR_PATH, [], hasher=hashers.Hasher(workers=4)
+        )
+        self.assertEqual(dir_info, file_status.DirInfo(utils.TEST_DIR_PATH, []))
+        self.assertEqual(
+            list(dir_info.files.items()),
+            list(file_status.DirInfo(utils.TEST_DIR_PATH, []).files.items()),
+        )
+
+    def test_hash_pending(self):
+        """Test that pending hashes are calculated in order and vanished files are empty"""
+        pending = []
+        file_infos = [
+            file_status.FileInfo(file, pending=pending) for file in self.files
+        ]
+        self.assertEqual(len(pending), len(self.files))
+        self.assertEqual([info._hash for info in file_infos], [b""] * len(self.files))
+        os.remove(self.files[0])
+
+        file_status.hash_pending(pending, hashers.Hasher(workers=3))
+        self.assertEqual(file_infos[0]._hash, b"")
+        self.assertEqual(file_infos[0].stat, ())
+        self.assertEqual(
+            file_infos[1:], [file_status.FileInfo(file) for file in self.files[1:]]
+        )
+
+    def _assert_same_as_scan(self, dir_info, ignore):
+        fresh = file_status.DirInfo(utils.TEST_DIR_PATH, ignore)
+        self.assertEqual(dir_info.files, fresh.files)
+        self.assertEqual(dir_info.dirs, fresh.dirs)
+        self.assertEqual(dir_info, fresh)
+
+    def test_apply_event_change_file(self):
+        """Test that a file event only looks at that file"""
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        utils.change_file(self.files[0])
+        with mock.patch.object(
+            file_status.tree_scanner, "scan_tree"
+        ) as scan_tree, mock.patch.object(
+            file_status.FileInfo,
+            "_calculate_hash",
+            wraps=file_status.FileInfo._calculate_hash,
+        ) as calculate:
+            self.assertEqual(
+                _texts(dir_info.apply_event(self.files[0], [])), [f"changed {self.files[0]}"]
+            )
+        scan_tree.assert_not_called()
+        calculate.assert_called_once_with(self.files[0], hashers.DEFAULT)
+        self._assert_same_as_scan(dir_info, [])
+
+    def test_apply_event_create_delete_file(self):
+        """Test creation and removal of a file"""
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        new_file = os.path.join(self.dirs[2], "new_file.txt")
+        utils.create_file(new_file)
+        self.assertEqual(_texts(dir_info.apply_event(new_file, [])), [f"created {new_file}"])
+        self._assert_same_as_scan(dir_info, [])
+        utils.remove_file(new_file)
+        self.assertEqual(_texts(dir_info.apply_event(new_file, [])), [f"deleted {new_file}"])
+        self.assertEqual(dir_info.apply_event(new_file, []), [])
+        self._assert_same_as_scan(dir_info, [])
+
+    def test_apply_event_create_delete_tree(self):
+        """Test that a created directory is scanned and a removed one is dropped"""
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        new_dir = os.path.join(self.dirs[0], "new_dir")
+        os.makedirs(os.path.join(new_dir, "sub_dir"))
+        new_files = [
+            os.path.join(new_dir, "file.txt"),
+            os.path.join(new_dir, "sub_dir", "file.txt"),
+        ]
+        for new_file in new_files:
+            utils.create_file(new_file)
+
+        self.assertEqual(
+            sorted(_texts(dir_info.apply_event(new_dir, []))),
+            sorted(
+                [f"created {new_dir}", f"created {os.path.join(new_dir, 'sub_dir')}"]
+                + [f"created {new_file}" for new_file in new_files]
+            ),
+        )
+        self._assert_same_as_scan(dir_info, [])
+        # contents were scanned with the directory
+        self.assertEqual(dir_info.apply_event(new_files[1], []), [])
+
+        shutil.rmtree(new_dir)
+        self.assertEqual(len(dir_info.apply_event(new_dir, [])), 4)
+        self._assert_same_as_scan(dir_info, [])
+
+    def test_apply_event_file_replaced_by_dir(self):
+        """Test that a file replaced by a directory is reported"""
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        os.remove(self.files[0])
+        os.mkdir(self.files[0])
+        self.assertEqual(
+            sorted(_texts(dir_info.apply_event(self.files[0], []))),
+            [f"created {self.files[0]}", f"deleted {self.files[0]}"],
+        )
+        self._assert_same_as_scan(dir_info, [])
+
+    def test_apply_event_ignored(self):
+        """Test that events on ignored paths are discarded"""
+        ignore = [re.compile(r".*/build")]
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, ignore)
+        ignored_file = os.path.join(self.dirs[1], "file1.txt")
+        utils.change_file(ignored_file)
+        self.assertEqual(dir_info.apply_event(ignored_file, ignore), [])
+        self.assertEqual(dir_info.apply_event(self.dirs[1], ignore), [])
+        self._assert_same_as_scan(dir_info, ignore)
+
+    def test_digest(self):
+        """Test that only the digests of a changed file's directory and its parents change"""
+        os.makedirs(os.path.join(self.dirs[2], "app", "lib"))
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        digests = {adir: dir_info.digest(adir) for adir in dir_info.tree}
+        self.assertEqual(dir_info.digest(), digests[utils.TEST_DIR_PATH])
+
+        new_file = os.path.join(self.dirs[2], "app", "new_file.txt")
+        utils.create_file(new_file)
+        dir_info.apply_event(new_file, [])
+        changed = [adir for adir in dir_info.tree if dir_info.digest(adir) != digests[adir]]
+        self.assertEqual(
+            sorted(changed),
+            [utils.TEST_DIR_PATH, self.dirs[2], os.path.join(self.dirs[2], "app")],
+        )
+        self._assert_same_as_scan(dir_info, [])
+
+    def test_digests_reused_from_previous_info(self):
+        """Test that only the directories that changed since the previous scan are digested"""
+        files = [
+            os.path.join(self.dirs[2], *path)
+            for path in [("app", "lib", "file.txt"), ("util", "x", "file.txt")]
+        ]
+        for file in files:
+            os.makedirs(os.path.dirname(file))
+            utils.create_file(file)
+        utils.backdate(*self.files, *files)
+        before = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        utils.change_file(self.files[0])
+        os.rename(self.files[4], os.path.join(self.dirs[1], "renamed.txt"))
+        lib = os.path.join(self.dirs[2], "app", "lib")
+        os.rename(lib, lib + "2")
+
+        with mock.patch.object(file_status, "_digest", wraps=file_status._digest) as digest:
+            after = file_status.DirInfo(
+                utils.TEST_DIR_PATH, [], before.tree, previous_info=before
+            )
+        # bin, build, src/app/lib2, src/app, src and the root
+        self.assertEqual(digest.call_count, 6)
+        fresh = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        self.assertEqual(
+            {adir: after.digest(adir) for adir in after.tree},
+            {adir: fresh.digest(adir) for adir in fresh.tree},
+        )
+        util = os.path.join(self.dirs[2], "util")
+        for adir in [util, os.path.join(util, "x")]:
+            self.assertEqual(after.digest(adir), before.digest(adir))
+        self.assertNotEqual(after.digest(), before.digest())
+
+    def test_changed_descends_into_different_digests(self):
+        """Test that comparing snapshots only looks into subtrees with different digests"""
+        dir_info = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        dir_info.digest()
+        new_dir = os.path.join(self.dirs[0], "new_dir")
+        os.makedirs(os.path.join(new_dir, "sub_dir"))
+        utils.create_file(os.path.join(new_dir, "sub_dir", "file.txt"))
+        shutil.rmtree(self.dirs[1])
+        utils.change_file(self.files[-1])
+        fresh = file_status.DirInfo(utils.TEST_DIR_PATH, [])
+        fresh.digest()
+        listed = []
+        children_of = file_status.DirInfo._children_of
+
+        def _children_of(info, adir):
+            listed.append(adir)
+            return children_of(info, adir)
+
+        with mock.patch.object(file_status.DirInfo, "_children_of", _children_of):
+            self.assertEqual(
+                sorted(_texts(dir_info.changed(fresh))),
+                sorted(
+                    [
+                        f"created {new_dir}",
+                        f"created {os.path.join(new_dir, 'sub_dir')}",
+                        f"created {os.path.join(new_dir, 'sub_dir', 'file.txt')}",
+                        f"deleted {self.dirs[1]}",
+                        f"changed {self.files[-1]}",
+                    ]
+                    + [f"deleted {file}" for file in self.files if "/build/" in file]
+                ),
+            )
+        # not the created and deleted trees nor the unchanged directories
+        self.assertEqual(set(listed), {utils.TEST_DIR_PATH, self.dirs[0], self.dirs[2]})
+        self.assertEqual(dir_info.changed(dir_info), [])
+        self.assertNotEqual(dir_info, fresh)
+
+        for path in [new_dir, self.dirs[1], self.files[-1]]:
+            dir_info.apply_event(path, [])
+        self.assertEqual(dir_info, fresh)
+
 
 class TestDirsAndFilesInfo(utils.TestWithTmpDir):
     """Tests DirsAndFilesInfo class"""
@@ -179,6 +461,64 @@ class TestDirsAndFilesInfo(utils.TestWithTmpDir):
             with open(file_path, "w", encoding="utf_8") as file:
                 print(file_path, file=file)
 
+    def test_digest(self):
+        """Test that the digest of the watched files changes with their contents only"""
+        dirs_files = file_status.DirsAndFiles(self.files[:2], self.dirs, self.ignores)
+        lib_file = os.path.join(self.dirs[1], "file.txt")
+
+        def in_lib(path):
+            return path.startswith(os.path.join(self.dirs[1], ""))
+
+        digest, lib_digest = dirs_files.digest(), dirs_files.digest(in_lib)
+        self.assertNotEqual(digest, lib_digest)
+
+        utils.create_file(lib_file)
+        dirs_files.update()
+        self.assertNotEqual(dirs_files.digest(), digest)
+        self.assertNotEqual(dirs_files.digest(in_lib), lib_digest)
+        os.remove(lib_file)
+        utils.change_file(self.files[0])
+        dirs_files.update()
+        self.assertEqual(dirs_files.digest(in_lib), lib_digest)
+        self.assertNotEqual(dirs_files.digest(), digest)
+
+        # same contents, new stats
+        with open(self.files[0], "w", encoding="utf_8") as file:
+            print(self.files[0], file=file)
+        dirs_files.update()
+        self.assertEqual(dirs_files.digest(), digest)
+
+    def test_digest_reuses_unchanged_subtrees(self):
+        """Test that only the files of changed directories are matched again for a key"""
+        files = [os.path.join(self.dirs[1], name, "x.py") for name in ["a", "b", "c"]]
+        for file_path in files:
+            os.makedirs(os.path.dirname(file_path))
+            utils.create_file(file_path)
+        dirs_files = file_status.DirsAndFiles([], self.dirs, self.ignores)
+        matched = []
+
+        def python(path):
+            matched.append(path)
+            return path.endswith(".py")
+
+        digest = dirs_files.digest(python, "python")
+        self.assertEqual(sorted(matched), files)
+        self.assertEqual(dirs_files.digest(python, "python"), digest)
+        self.assertEqual(sorted(matched), files)
+
+        # the files of directories a and b are matched again, not the ones of c
+        utils.change_file(files[1])
+        utils.create_file(os.path.join(self.dirs[1], "a", "z.txt"))
+        dirs_files.update()
+        matched.clear()
+        changed = dirs_files.digest(python, "python")
+        self.assertEqual(
+            sorted(matched), [files[0], os.path.join(self.dirs[1], "a", "z.txt"), files[1]]
+        )
+        self.assertNotEqual(changed, digest)
+        # same as matching everything again
+        self.assertEqual(dirs_files.digest(python), changed)
+
     def test_create_file_infos(self):
         """Test create_file_infos create FileInfo dict"""
         file_infos = file_status.DirsAndFiles._create_file_infos(self.files)
@@ -211,6 +551,155 @@ class TestDirsAndFilesInfo(utils.TestWithTmpDir):
             # subsequent calls always return False
             self.assertFalse(dirs_and_files.update())
 
+    def test_update_does_not_hash_unchanged_files(self):
+        """Test that an update of an unchanged tree only reads stats"""
+        utils.create_file(os.path.join(self.dirs[1], "some-file"))
+        utils.backdate(os.path.join(self.dirs[1], "some-file"), *self.files)
+        dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        with mock.patch.object(file_status.FileInfo, "_calculate_hash") as calculate:
+            self.assertFalse(dirs_and_files.update())
+        calculate.assert_not_called()
+
+    def test_update_reuses_digests(self):
+        """Test that an update of an unchanged tree does not digest its directories again"""
+        some_file = os.path.join(self.dirs[1], "some-file")
+        utils.create_file(some_file)
+        utils.backdate(some_file, *self.files)
+        dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        with mock.patch.object(file_status, "_digest", wraps=file_status._digest) as digest:
+            self.assertFalse(dirs_and_files.update())
+            digest.assert_not_called()
+            utils.change_file(some_file)
+            self.assertEqual(_texts(dirs_and_files.update()), [f"changed {some_file}"])
+            digest.assert_called_once()
+
+    def test_create_with_hash_workers(self):
+        """Test that hashing with threads gives the same snapshot"""
+        utils.create_file(os.path.join(self.dirs[1], "some-file"))
+        dirs_and_files = file_status.DirsAndFiles(
+            self.files, self.dirs, self.ignores, hasher=hashers.Hasher(workers=4)
+        )
+        self.assertEqual(
+            dirs_and_files.snapshot(),
+            file_status.DirsAndFiles(self.files, self.dirs, self.ignores).snapshot(),
+        )
+        utils.change_file(self.files[0])
+        self.assertEqual(_texts(dirs_and_files.update()), [f"changed {self.files[0]}"])
+
+    def test_stat_only(self):
+        """Test that with hash 'none' files are compared by stat"""
+        hasher = hashers.Hasher(hashers.NONE)
+        dirs_and_files = file_status.DirsAndFiles(
+            self.files, self.dirs, self.ignores, hasher=hasher
+        )
+        with mock.patch.object(hashers.Hasher, "hash_file") as hash_file:
+            stat = os.stat(self.files[0])
+            os.utime(self.files[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            self.assertEqual(_texts(dirs_and_files.update()), [f"changed {self.files[0]}"])
+            self.assertEqual(dirs_and_files.update(), [])
+        hash_file.assert_not_called()
+
+    def test_cache_key_depends_on_algorithm(self):
+        """Test that a cache saved with an algorithm is not used with another one"""
+        self.assertNotEqual(
+            file_status.cache_key(self.files, self.dirs, self.ignores, "sha1"),
+            file_status.cache_key(self.files, self.dirs, self.ignores, "crc32"),
+        )
+
+    def test_snapshot(self):
+        """Test snapshot contains watched files and files in watched dirs"""
+        lib_file = os.path.join(self.dirs[1], "some-file")
+        utils.create_file(lib_file)
+        dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        expected = {adir: {} for adir in self.dirs}
+        for file in self.files + [lib_file]:
+            adir, name = os.path.split(file)
+            expected.setdefault(adir, {})[name] = file_status.FileInfo(file)
+        self.assertEqual(dirs_and_files.snapshot(), expected)
+
+    def test_dirs(self):
+        """Test dirs contains watched dirs and the dirs found in them"""
+        sub_dirs = [os.path.join(self.dirs[1], "sub"), os.path.join(self.dirs[1], "sub", "x")]
+        os.makedirs(sub_dirs[1])
+        os.makedirs(os.path.join(self.dirs[1], "ignored"))
+        dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        self.assertEqual(dirs_and_files.dirs, sorted(self.dirs + sub_dirs))
+
+    def test_save_and_load(self):
+        """Test that a loaded snapshot only hashes files whose stat changed"""
+        cache_file = os.path.join(utils.TEST_DIR_PATH, "cache", "snapshot.cache")
+        utils.create_file(os.path.join(self.dirs[1], "some-file"))
+        utils.backdate(os.path.join(self.dirs[1], "some-file"), *self.files)
+        saved = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        saved.save(cache_file)
+
+        utils.change_file(self.files[0])
+        with mock.patch.object(
+            file_status.FileInfo,
+            "_calculate_hash",
+            wraps=file_status.FileInfo._calculate_hash,
+        ) as calculate:
+            loaded = file_status.DirsAndFiles.load(
+                cache_file, self.files, self.dirs, self.ignores
+            )
+        calculate.assert_called_once_with(self.files[0], hashers.DEFAULT)
+        self.assertEqual(
+            loaded.snapshot(),
+            file_status.DirsAndFiles(self.files, self.dirs, self.ignores).snapshot(),
+        )
+        self.assertFalse(loaded.update())
+
+    def test_load_with_other_settings(self):
+        """Test that a cache saved for other roots or ignores is not used"""
+        cache_file = os.path.join(utils.TEST_DIR_PATH, "snapshot.cache")
+        file_status.DirsAndFiles(self.files, self.dirs, self.ignores).save(cache_file)
+        with mock.patch.object(
+            file_status.FileInfo,
+            "_calculate_hash",
+            wraps=file_status.FileInfo._calculate_hash,
+        ) as calculate:
+            file_status.DirsAndFiles.load(cache_file, self.files, self.dirs, [])
+        self.assertEqual(calculate.call_count, len(self.files))
+
+    def test_load_invalid_cache(self):
+        """Test that missing or corrupted caches are ignored"""
+        cache_file = os.path.join(utils.TEST_DIR_PATH, "snapshot.cache")
+        expected = file_status.DirsAndFiles(self.files, self.dirs, self.ignores).snapshot()
+        loaded = file_status.DirsAndFiles.load(
+            cache_file, self.files, self.dirs, self.ignores
+        )
+        self.assertEqual(loaded.snapshot(), expected)
+        with open(cache_file, "wb") as file:
+            file.write(b"garbage")
+        loaded = file_status.DirsAndFiles.load(
+            cache_file, self.files, self.dirs, self.ignores
+        )
+        self.assertEqual(loaded.snapshot(), expected)
+
+    def test_apply_events(self):
+        """Test that events update the snapshot as a full update would"""
+        dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        new_file = os.path.join(self.dirs[1], "some-file")
+        ignored_file = os.path.join(self.dirs[0], "some-file")
+        utils.create_file(new_file)
+        utils.create_file(ignored_file)
+        utils.change_file(self.files[0])
+
+        changed = dirs_and_files.apply_events(
+            [new_file, ignored_file, self.files[0], self.files[0]]
+        )
+        self.assertEqual(_texts(changed), [f"changed {self.files[0]}", f"created {new_file}"])
+        self.assertEqual(dirs_and_files.apply_events([]), [])
+        self.assertFalse(dirs_and_files.update())
+
+    def test_apply_events_unknown_paths(self):
+        """Test that events outside watched paths are discarded"""
+        dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
+        self.assertEqual(
+            dirs_and_files.apply_events([os.path.join(utils.TEST_DIR_PATH, "libx", "a")]),
+            [],
+        )
+
     def test_change_in_ignored_files(self):
         """Test change in ignored files/dirs are reported as False"""
         dirs_and_files = file_status.DirsAndFiles(self.files, self.dirs, self.ignores)
@@ -238,5 +727,104 @@ class TestDirsAndFilesInfo(utils.TestWithTmpDir):
         self.assertTrue(dirs_and_files.update())
 
 
+class TestMoves(utils.TestWithTmpDir):
+    """Tests detection of moved files and directories"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.root = os.path.join(utils.TEST_DIR_PATH, "root")
+        self.old = os.path.join(self.root, "old")
+        os.makedirs(os.path.join(self.old, "sub"))
+        self.files = [
+            os.path.join(self.old, name) for name in ["a.txt", "b.txt", "sub/c.txt", "empty"]
+        ]
+        for path in self.files:
+            with open(path, "w", encoding="utf_8") as file:
+                file.write("" if path.endswith("empty") else path)
+        self.dirs_and_files = file_status.DirsAndFiles([], [self.root], [])
+
+    def test_rename_file(self):
+        """Test that a renamed file is a move (with update and with events)"""
+        new = os.path.join(self.root, "a.txt")
+        os.rename(self.files[0], new)
+        changed = self.dirs_and_files.update()
+        self.assertEqual(_texts(changed), [f"moved {self.files[0]} to {new}"])
+        self.assertEqual(changed[0].old, changed[0].new)
+        self.assertTrue(changed[0].digest)
+
+        os.rename(new, self.files[0])
+        self.assertEqual(
+            _texts(self.dirs_and_files.apply_events([new, self.files[0]])),
+            [f"moved {new} to {self.files[0]}"],
+        )
+
+    def test_rename_dir(self):
+        """Test that a renamed directory is a single move"""
+        new = os.path.join(self.root, "new")
+        os.rename(self.old, new)
+        self.assertEqual(
+            _texts(self.dirs_and_files.apply_events([self.old, new])),
+            [f"moved {self.old} to {new}"],
+        )
+        os.rename(new, self.old)
+        self.assertEqual(_texts(self.dirs_and_files.update()), [f"moved {new} to {self.old}"])
+
+    def test_expand_moves(self):
+        """Test that the moves of the files in a moved directory can be listed"""
+        new = os.path.join(self.root, "new")
+        os.rename(self.old, new)
+        changed = self.dirs_and_files.apply_events([self.old, new])
+        self.assertEqual(
+            _texts(self.dirs_and_files.expand_moves(changed)),
+            [f"moved {self.old} to {new}"]
+            + sorted(f"moved {path} to {path.replace(self.old, new)}" for path in self.files),
+        )
+        # a moved file is left as it is
+        os.rename(os.path.join(new, "a.txt"), os.path.join(self.root, "a.txt"))
+        changed = self.dirs_and_files.update()
+        self.assertEqual(len(changed), 1)
+        self.assertEqual(self.dirs_and_files.expand_moves(changed), changed)
+
+    def test_rename_dir_with_changes(self):
+        """Test that a directory is not a single move if its contents changed"""
+        new = os.path.join(self.root, "new")
+        os.rename(self.old, new)
+        with open(os.path.join(new, "sub", "c.txt"), "a", encoding="utf_8") as file:
+            file.write("more")
+        self.assertEqual(
+            sorted(_texts(self.dirs_and_files.update())),
+            sorted(
+                [
+                    f"created {new}",
+                    f"created {os.path.join(new, 'sub')}",
+                    f"created {os.path.join(new, 'sub', 'c.txt')}",
+                    f"deleted {self.old}",
+                    f"deleted {os.path.join(self.old, 'sub')}",
+                    f"deleted {self.files[2]}",
+                ]
+                + [
+                    f"moved {path} to {path.replace(self.old, new)}"
+                    for path in [self.files[0], self.files[1], self.files[3]]
+                ]
+            ),
+        )
+
+    def test_same_content(self):
+        """Test that a file rewritten elsewhere is a move unless it is empty"""
+        new = os.path.join(self.root, "copy.txt")
+        shutil.copy(self.files[1], new)
+        os.remove(self.files[1])
+        open(os.path.join(self.root, "new_empty"), "w", encoding="utf_8").close()
+        os.remove(self.files[3])
+        self.assertEqual(
+            _texts(self.dirs_and_files.update()),
+            [
+                f"created {os.path.join(self.root, 'new_empty')}",
+                f"deleted {self.files[3]}",
+                f"moved {self.files[1]} to {new}",
+            ],
+        )
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,168 @@
+"""Tests gitignore module"""
+
+# pylint: disable=protected-access
+
+import os
+import re
+import unittest
+
+import apps.keep_testing.util.file_status as file_status
+import apps.keep_testing.util.gitignore as gitignore
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+import tests.util.utils_tests_lib as utils
+
+
+def _texts(changes):
+    return [str(change) for change in changes]
+
+
+def _write(path, *lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf_8") as file:
+        file.writelines(f"{line}\n" for line in lines)
+
+
+class TestParseLine(unittest.TestCase):
+    """Tests parse_line function"""
+
+    def _matches(self, line, path, is_dir=False):
+        regex, negated, only_dirs = gitignore.parse_line("/base", line)
+        self.assertFalse(negated)
+        return bool(regex.fullmatch(path)) and (is_dir or not only_dirs)
+
+    def test_ignored_lines(self):
+        """Test that blank lines, comments and invalid lines have no rules"""
+        for line in ["", "   ", "# comment", "!", "/", "trailing\\"]:
+            self.assertIsNone(gitignore.parse_line("/base", line), line)
+
+    def test_name(self):
+        """Test that patterns without slashes match names at any level"""
+        self.assertTrue(self._matches("*.o", "/base/a.o"))
+        self.assertTrue(self._matches("*.o", "/base/x/y/a.o"))
+        self.assertFalse(self._matches("*.o", "/base/a.c"))
+        self.assertFalse(self._matches("*.o", "/other/a.o"))
+        self.assertTrue(self._matches("file?.txt", "/base/x/file1.txt"))
+        self.assertFalse(self._matches("file?.txt", "/base/file/.txt"))
+        self.assertTrue(self._matches("file[0-9].txt", "/base/file1.txt"))
+        self.assertFalse(self._matches("file[!0-9].txt", "/base/file1.txt"))
+        self.assertTrue(self._matches("file[!0-9].txt", "/base/fileA.txt"))
+
+    def test_anchored(self):
+        """Test that patterns with slashes are relative to the directory of the file"""
+        self.assertTrue(self._matches("/build", "/base/build"))
+        self.assertFalse(self._matches("/build", "/base/x/build"))
+        self.assertTrue(self._matches("doc/*.html", "/base/doc/a.html"))
+        self.assertFalse(self._matches("doc/*.html", "/base/doc/x/a.html"))
+        self.assertFalse(self._matches("doc/*.html", "/base/x/doc/a.html"))
+
+    def test_double_asterisk(self):
+        """Test `**` in leading, trailing and middle positions"""
+        self.assertTrue(self._matches("**/foo", "/base/foo"))
+        self.assertTrue(self._matches("**/foo", "/base/x/y/foo"))
+        self.assertTrue(self._matches("foo/**", "/base/foo/x/y"))
+        self.assertFalse(self._matches("foo/**", "/base/foo"))
+        self.assertTrue(self._matches("a/**/b", "/base/a/b"))
+        self.assertTrue(self._matches("a/**/b", "/base/a/x/y/b"))
+        self.assertFalse(self._matches("a/**b", "/base/a/x/b"))
+
+    def test_only_dirs_and_negation(self):
+        """Test trailing slash, negation and escapes"""
+        self.assertTrue(self._matches("out/", "/base/x/out", is_dir=True))
+        self.assertFalse(self._matches("out/", "/base/x/out"))
+        _, negated, _ = gitignore.parse_line("/base", "!keep.o")
+        self.assertTrue(negated)
+        self.assertTrue(self._matches("\\!keep.o", "/base/!keep.o"))
+        self.assertTrue(self._matches("\\#file", "/base/#file"))
+        self.assertTrue(self._matches("name\\ ", "/base/name "))
+        self.assertTrue(self._matches("name  ", "/base/name"))
+
+
+class TestGitignoreMatcher(utils.TestWithTmpDir):
+    """Tests GitignoreMatcher class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.root = os.path.join(utils.TEST_DIR_PATH, "repo")
+        os.makedirs(os.path.join(self.root, ".git", "info"))
+        _write(os.path.join(self.root, ".git", "info", "exclude"), "*.swp")
+        _write(os.path.join(self.root, ".gitignore"), "*.o", "build/", "!keep.o")
+        _write(os.path.join(self.root, "src", ".gitignore"), "gen", "*.tmp")
+        _write(os.path.join(self.root, "src", ".ignore"), "!important.tmp")
+        self.files = [
+            "a.c", "a.o", "keep.o", "a.swp", "build/x.c", "src/b.c", "src/b.o", "src/gen/g.c",
+            "src/a.tmp", "src/important.tmp", "lib/gen/g.c", "lib/build", "lib/build2/x.c",
+        ]
+        for file in self.files:
+            _write(os.path.join(self.root, file), file)
+
+    def _scan(self, matcher, root=None):
+        entries, _ = tree_scanner.scan_tree(root or self.root, matcher)
+        return sorted(os.path.relpath(entry.path, self.root) for entry in entries)
+
+    def test_scan(self):
+        """Test that rules of all levels are applied and ignored directories are pruned"""
+        matcher = gitignore.GitignoreMatcher([re.compile(r".*/a\.c")], [self.root])
+        self.assertEqual(
+            self._scan(matcher),
+            [
+                ".gitignore", "keep.o", "lib/build", "lib/build2/x.c", "lib/gen/g.c",
+                "src/.gitignore", "src/.ignore", "src/b.c", "src/important.tmp",
+            ],
+        )
+        self.assertNotIn(os.path.join(self.root, "src", "gen"), matcher._dir_rules)
+
+    def test_rules_shared(self):
+        """Test that directories without ignore files reuse the rules of their parent"""
+        matcher = gitignore.GitignoreMatcher([], [self.root])
+        self._scan(matcher)
+        self.assertIs(
+            matcher._dir_rules[os.path.join(self.root, "lib")], matcher._dir_rules[self.root]
+        )
+        self.assertIsNot(
+            matcher._dir_rules[os.path.join(self.root, "src")], matcher._dir_rules[self.root]
+        )
+
+    def test_parents_of_root(self):
+        """Test that a watched subdirectory uses the rules of its repository"""
+        src = os.path.join(self.root, "src")
+        matcher = gitignore.GitignoreMatcher([], [src])
+        self.assertEqual(self._scan(matcher, src), ["src/.gitignore", "src/.ignore", "src/b.c",
+                                                    "src/important.tmp"])
+
+    def test_refresh(self):
+        """Test that a changed ignore file is read again"""
+        matcher = gitignore.GitignoreMatcher([], [self.root])
+        self._scan(matcher)
+        src = os.path.join(self.root, "src")
+        _write(os.path.join(src, ".gitignore"), "*.c")
+        self.assertIsNone(matcher.refresh(os.path.join(src, "b.c")))
+        self.assertIn("src/b.c", self._scan(matcher))
+        self.assertEqual(matcher.refresh(os.path.join(src, ".gitignore")), src)
+        files = self._scan(matcher)
+        self.assertNotIn("src/b.c", files)
+        self.assertIn("src/a.tmp", files)
+
+    def test_apply_events(self):
+        """Test that a changed ignore file updates the entries of its directory"""
+        dirs_and_files = file_status.DirsAndFiles(
+            [], [self.root], gitignore.GitignoreMatcher([], [self.root])
+        )
+        src = os.path.join(self.root, "src")
+        _write(os.path.join(src, ".gitignore"), "*.c")
+        changed = _texts(dirs_and_files.apply_events([os.path.join(src, ".gitignore")]))
+        self.assertIn(f"changed {os.path.join(src, '.gitignore')}", changed)
+        self.assertIn(f"deleted {os.path.join(src, 'b.c')}", changed)
+        self.assertIn(f"created {os.path.join(src, 'gen')}", changed)
+        self.assertEqual(dirs_and_files.update(), [])
+
+    def test_cache_key(self):
+        """Test that the cache key depends on the use of ignore files"""
+        self.assertNotEqual(
+            file_status.cache_key([], [self.root], []),
+            file_status.cache_key([], [self.root], gitignore.GitignoreMatcher([], [self.root])),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
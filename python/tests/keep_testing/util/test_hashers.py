@@ -0,0 +1,107 @@
+"""Tests hashers module"""
+
+# pylint: disable=protected-access
+
+import hashlib
+import os
+import unittest
+from unittest import mock
+import zlib
+
+import apps.keep_testing.util.hashers as hashers
+
+import tests.util.utils_tests_lib as utils
+
+
+class TestHasher(utils.TestWithTmpDir):
+    """Tests Hasher class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.file_path = os.path.join(utils.TEST_DIR_PATH, "file.bin")
+        self.content = os.urandom(200000)
+        with open(self.file_path, "wb") as file:
+            file.write(self.content)
+
+    def test_algorithms(self):
+        """Test the registered algorithms"""
+        self.assertEqual(hashers.algorithms(), ["blake2b", "crc32", "none", "sha1"])
+        self.assertEqual(hashers.DEFAULT.algorithm, "sha1")
+        self.assertEqual(hashers.DEFAULT.workers, 1)
+
+    def test_sha1(self):
+        """Test sha1 hashes the content"""
+        self.assertEqual(
+            hashers.Hasher("sha1").hash_file(self.file_path),
+            hashlib.sha1(self.content).digest(),
+        )
+
+    def test_blake2b(self):
+        """Test blake2b hashes the content"""
+        self.assertEqual(
+            hashers.Hasher("blake2b").hash_file(self.file_path),
+            hashlib.blake2b(self.content, digest_size=20).digest(),
+        )
+
+    def test_crc32(self):
+        """Test crc32 hashes the content"""
+        self.assertEqual(
+            hashers.Hasher("crc32").hash_file(self.file_path),
+            zlib.crc32(self.content).to_bytes(4, "big"),
+        )
+
+    def test_large_files(self):
+        """Test files hashed with the reusable buffer and with hashlib.file_digest"""
+        with mock.patch.object(hashers, "_LARGE_FILE_SIZE", 1000), mock.patch.object(
+            hashers, "_BUFFER_SIZE", 4096
+        ):
+            self.assertEqual(
+                hashers.Hasher("crc32").hash_file(self.file_path),
+                zlib.crc32(self.content).to_bytes(4, "big"),
+            )
+            self.assertEqual(
+                hashers.Hasher("sha1").hash_file(self.file_path),
+                hashlib.sha1(self.content).digest(),
+            )
+            with mock.patch.object(hashers, "hashlib", wraps=hashlib) as no_file_digest:
+                del no_file_digest.file_digest
+                self.assertEqual(
+                    hashers._hashlib_file(hashlib.sha1)(self.file_path),
+                    hashlib.sha1(self.content).digest(),
+                )
+
+    def test_empty_file(self):
+        """Test hashing an empty file"""
+        empty = os.path.join(utils.TEST_DIR_PATH, "empty")
+        with open(empty, "wb"):
+            pass
+        self.assertEqual(
+            hashers.Hasher("sha1").hash_file(empty), hashlib.sha1(b"").digest()
+        )
+        self.assertEqual(hashers.Hasher("crc32").hash_file(empty), bytes(4))
+
+    def test_none(self):
+        """Test none does not read the content"""
+        hasher = hashers.Hasher(hashers.NONE)
+        self.assertFalse(hasher.content)
+        self.assertEqual(hasher.hash_file("non-existent"), b"")
+        self.assertTrue(hashers.Hasher("sha1").content)
+
+    def test_invalid(self):
+        """Test unknown algorithms and invalid number of workers"""
+        with self.assertRaises(ValueError):
+            hashers.Hasher("md4")
+        with self.assertRaises(ValueError):
+            hashers.Hasher("sha1", 0)
+
+    def test_register(self):
+        """Test registering a new algorithm"""
+        hashers.register("size", lambda path: str(os.path.getsize(path)).encode())
+        try:
+            self.assertEqual(hashers.Hasher("size").hash_file(self.file_path), b"200000")
+        finally:
+            del hashers._ALGORITHMS["size"]
+
+
+if __name__ == "__main__":
+    unittest.main()
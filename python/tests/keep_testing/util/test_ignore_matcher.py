@@ -0,0 +1,92 @@
+"""Tests ignore_matcher module"""
+
+# pylint: disable=protected-access
+
+import re
+import unittest
+
+import apps.keep_testing.util.ignore_matcher as ignore_matcher
+
+_RULES = [
+    r".*\.o",
+    r".*/build",
+    r"/src/gen.*",
+    r".*/node_modules/.*",
+    r"/a/exact\.txt",
+    r".*/tmp[0-9]+",
+    r".*/(dist|out)",
+]
+
+_PATHS = [
+    "/a/file.o",
+    "/a/file.c",
+    "/a/build",
+    "/a/build/file.c",
+    "/src/generated/file.c",
+    "/other/src/gen",
+    "/a/node_modules/pkg/index.js",
+    "/a/node_modules",
+    "/a/exact.txt",
+    "/a/exact_txt",
+    "/a/tmp12",
+    "/a/tmp",
+    "/a/dist",
+    "/a/out/file",
+    "/a/new\nline.o",
+]
+
+
+class TestIgnoreMatcher(unittest.TestCase):
+    """Tests IgnoreMatcher class"""
+
+    def _check_same_as_regexes(self, rules):
+        regexes = [re.compile(rule) for rule in rules]
+        matcher = ignore_matcher.IgnoreMatcher(regexes)
+        for path in _PATHS:
+            expected = any(regex.fullmatch(path) for regex in regexes)
+            self.assertEqual(matcher.matches(path), expected, path)
+            self.assertEqual(matcher.matches(path, is_dir=True), expected, path)
+
+    def test_same_as_regexes(self):
+        """Test that results are the same as checking every regex"""
+        self._check_same_as_regexes(_RULES)
+        self._check_same_as_regexes([])
+        self._check_same_as_regexes([r".*"])
+        self._check_same_as_regexes([r".*.*", r"(?i).*\.O", r".*/(a)/\1"])
+
+    def test_rules_classified(self):
+        """Test that literal rules do not use regexes and the others are fused"""
+        matcher = ignore_matcher.IgnoreMatcher([re.compile(rule) for rule in _RULES])
+        self.assertEqual(matcher._exact, {"/a/exact.txt"})
+        self.assertEqual(matcher._suffixes, (".o", "/build"))
+        self.assertEqual(matcher._prefixes, ("/src/gen",))
+        self.assertEqual(matcher._contains, ["/node_modules/"])
+        self.assertEqual(len(matcher._regexes), 1)
+
+    def test_not_fused(self):
+        """Test that rules with flags or backreferences are kept apart"""
+        rules = [re.compile(r".*/[ab]"), re.compile(r".*/(x)\1"), re.compile(r".*\.C", re.I)]
+        matcher = ignore_matcher.IgnoreMatcher(rules)
+        self.assertEqual(len(matcher._regexes), 3)
+        self.assertTrue(matcher.matches("/d/xx"))
+        self.assertTrue(matcher.matches("/d/file.c"))
+        self.assertFalse(matcher.matches("/d/xy"))
+
+    def test_dirs_cached(self):
+        """Test that results for directories are cached"""
+        matcher = ignore_matcher.IgnoreMatcher([re.compile(r".*/build")])
+        self.assertTrue(matcher.matches("/a/build", is_dir=True))
+        self.assertEqual(matcher._dir_cache, {"/a/build": True})
+        self.assertFalse(matcher.matches("/a/file.c"))
+        self.assertEqual(matcher._dir_cache, {"/a/build": True})
+
+    def test_create(self):
+        """Test that a matcher is reused and rules are compiled in a matcher"""
+        rules = [re.compile(r".*\.o")]
+        matcher = ignore_matcher.create(rules)
+        self.assertEqual(matcher.rules, rules)
+        self.assertIs(ignore_matcher.create(matcher), matcher)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Tests poll_watcher module"""
+
+# pylint: disable=protected-access
+
+import os
+import re
+import unittest
+
+import apps.keep_testing.util.poll_watcher as poll_watcher
+
+import tests.util.utils_tests_lib as utils
+
+
+def _texts(changes):
+    return [str(change) for change in changes]
+
+
+class TestPollWatcher(utils.TestWithTmpDir):
+    """Tests PollWatcher class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.dirs = [os.path.join(utils.TEST_DIR_PATH, adir) for adir in ["hot", "cold"]]
+        for adir in self.dirs:
+            os.mkdir(adir)
+            utils.create_file(os.path.join(adir, "file.txt"))
+        self.file = os.path.join(utils.TEST_DIR_PATH, "file.txt")
+        utils.create_file(self.file)
+        self.watcher = poll_watcher.PollWatcher(
+            [self.file], self.dirs, ignore=[re.compile(r".*\.o")], target_cpu=1.0,
+            min_interval=0.01, max_interval=0.1,
+        )
+
+    def test_invalid_target(self):
+        """Test that the share of time spent scanning must be positive"""
+        with self.assertRaises(ValueError):
+            poll_watcher.PollWatcher([], self.dirs, target_cpu=0)
+
+    def test_scan_all(self):
+        """Test that full scans find changes and back off while nothing changes"""
+        self.assertEqual(self.watcher.scan_all(), [])
+        self.assertEqual(self.watcher._full_interval, 0.02)
+        self.assertEqual(self.watcher.scan_all(), [])
+        self.assertEqual(self.watcher._full_interval, 0.04)
+        for _ in range(5):
+            self.watcher.scan_all()
+        self.assertEqual(self.watcher._full_interval, 0.1)
+
+        new_file = os.path.join(self.dirs[0], "new.txt")
+        utils.create_file(new_file)
+        utils.create_file(os.path.join(self.dirs[0], "ignored.o"))
+        self.assertEqual(_texts(self.watcher.scan_all()), [f"created {new_file}"])
+        self.assertLess(self.watcher._full_interval, 0.1)
+        self.assertIn(self.dirs[0], self.watcher._hot)
+        self.assertTrue(self.watcher.changed())
+        self.assertEqual(self.watcher.pop_events(), {new_file})
+        self.assertTrue(self.watcher.wakeup.is_set())
+
+    def test_scan_hot(self):
+        """Test that only recently changed directories and watched files are rescanned"""
+        hot, cold = self.dirs
+        utils.create_file(os.path.join(hot, "new.txt"))
+        self.watcher.scan_all()
+        self.watcher.pop_events()
+
+        utils.change_file(os.path.join(hot, "file.txt"))
+        utils.change_file(os.path.join(cold, "file.txt"))
+        utils.change_file(self.file)
+        self.assertEqual(
+            _texts(self.watcher.scan_hot()),
+            sorted([f"changed {os.path.join(hot, 'file.txt')}", f"changed {self.file}"]),
+        )
+        self.assertEqual(
+            _texts(self.watcher.scan_all()), [f"changed {os.path.join(cold, 'file.txt')}"]
+        )
+
+    def test_thread(self):
+        """Test that the polling thread sets the wakeup event on changes"""
+        self.watcher.start()
+        try:
+            utils.create_file(os.path.join(self.dirs[1], "new.txt"))
+            self.assertTrue(self.watcher.wakeup.wait(5))
+        finally:
+            self.watcher.stop()
+        self.assertFalse(self.watcher.in_burst())
+        self.assertEqual(
+            self.watcher.pop_events(), {os.path.join(self.dirs[1], "new.txt")}
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
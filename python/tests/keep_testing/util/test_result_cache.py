@@ -0,0 +1,98 @@
+"""Tests result_cache module"""
+
+import os
+import unittest
+from unittest import mock
+
+import apps.keep_testing.util.result_cache as result_cache
+
+import tests.util.utils_tests_lib as utils
+
+Result = result_cache.Result
+
+
+class TestResultCache(utils.TestWithTmpDir):
+    """Tests ResultCache class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.directory = os.path.join(utils.TEST_DIR_PATH, "results")
+        self.cache = result_cache.ResultCache(self.directory, 1000)
+
+    def test_get_put(self):
+        """Test that stored results are found (and persist)"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", Result(3, b"output\n", 12.5))
+        self.assertEqual(self.cache.get("a"), Result(3, b"output\n", 12.5))
+        self.assertEqual(
+            result_cache.ResultCache(self.directory, 1000).get("a"), Result(3, b"output\n", 12.5)
+        )
+        # stored now if not set
+        self.cache.put("b", Result(0, b""))
+        self.assertGreater(self.cache.get("b").time, 0)
+
+    def test_invalid_size(self):
+        """Test that the maximum size must be positive"""
+        with self.assertRaises(ValueError):
+            result_cache.ResultCache(self.directory, 0)
+
+    def test_evict_least_recently_used(self):
+        """Test that the least recently used results are removed over the maximum size"""
+        output = os.urandom(300)
+        for key in "abc":
+            self.cache.put(key, Result(0, output))
+        self.assertIsNotNone(self.cache.get("a"))
+        self.cache.put("d", Result(0, output))
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual([key for key in "acd" if self.cache.get(key)], ["a", "c", "d"])
+        self.assertLessEqual(self.cache.size, 1000)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+    def test_order_persists(self):
+        """Test that the order of use is kept between instances"""
+        output = os.urandom(300)
+        for key in "abc":
+            self.cache.put(key, Result(0, output))
+            # modification times are the order of use
+            os.utime(os.path.join(self.directory, f"{key}.result"), ns=(0, ord(key)))
+        cache = result_cache.ResultCache(self.directory, 1000)
+        self.assertEqual(cache.size, self.cache.size)
+        cache.put("d", Result(0, output))
+        self.assertEqual([key for key in "abcd" if cache.get(key)], ["b", "c", "d"])
+
+    def test_evicted_while_opening(self):
+        """Test that results removed by another process while the cache opens are skipped"""
+        output = os.urandom(300)
+        for key in "ab":
+            self.cache.put(key, Result(0, output))
+        scandir = os.scandir
+
+        def _scandir(directory):
+            entries = list(scandir(directory))
+            for entry in entries:
+                if entry.name == "a.result":
+                    os.remove(entry.path)
+            return iter(entries)
+
+        with mock.patch.object(result_cache.os, "scandir", _scandir):
+            cache = result_cache.ResultCache(self.directory, 1000)
+        self.assertEqual(cache.size, os.path.getsize(os.path.join(self.directory, "b.result")))
+        self.assertIsNone(cache.get("a"))
+        self.assertIsNotNone(cache.get("b"))
+
+    def test_too_large(self):
+        """Test that results larger than the cache are not stored"""
+        self.cache.put("a", Result(0, os.urandom(2000)))
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.size, 0)
+
+    def test_invalid_file(self):
+        """Test that an invalid file is a miss"""
+        os.makedirs(self.directory)
+        with open(os.path.join(self.directory, "a.result"), "wb") as file:
+            file.write(b"invalid")
+        self.assertIsNone(self.cache.get("a"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+"""Tests tree_scanner module"""
+
+# pylint: disable=protected-access
+
+import itertools
+import os
+import re
+import unittest
+from unittest import mock
+
+import apps.keep_testing.util.tree_scanner as tree_scanner
+
+import tests.util.utils_tests_lib as utils
+
+
+class TestScanTree(utils.TestWithTmpDir):
+    """Tests scan_tree function"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        dirs = ["bin", "build", "build/obj", "src", "src/app", "src/app/deep"]
+        files = ["file1.txt", "file2.txt"]
+        self.dirs = [os.path.join(utils.TEST_DIR_PATH, adir) for adir in dirs]
+        self.files = [
+            os.path.join(*element) for element in itertools.product(self.dirs, files)
+        ]
+        for subdir in self.dirs:
+            os.mkdir(subdir)
+        for file_path in self.files:
+            with open(file_path, "w", encoding="utf_8") as file:
+                print(file_path, file=file)
+
+    def _scan(self, ignore):
+        entries, dirs = tree_scanner.scan_tree(utils.TEST_DIR_PATH, ignore)
+        return sorted(entry.path for entry in entries), dirs
+
+    def test_scan_no_ignore(self):
+        """Test that all files and directories are found"""
+        files, dirs = self._scan([])
+        self.assertEqual(files, sorted(self.files))
+        self.assertEqual(dirs, sorted(self.dirs))
+
+    def test_scan_visits_once(self):
+        """Test that each directory is listed exactly once"""
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            self._scan([])
+        listed = [call.args[0] for call in scandir.call_args_list]
+        self.assertEqual(sorted(listed), sorted([utils.TEST_DIR_PATH] + self.dirs))
+
+    def test_scan_prunes_ignored_dirs(self):
+        """Test that ignored directories are neither reported nor listed"""
+        ignore = [re.compile(r".*/build"), re.compile(r".*2\.txt")]
+        with mock.patch("os.scandir", wraps=os.scandir) as scandir:
+            files, dirs = self._scan(ignore)
+        listed = [call.args[0] for call in scandir.call_args_list]
+        self.assertFalse([adir for adir in listed if "build" in adir])
+        self.assertEqual(
+            files,
+            sorted(
+                file
+                for file in self.files
+                if "build" not in file and file.endswith("1.txt")
+            ),
+        )
+        self.assertEqual(dirs, sorted(adir for adir in self.dirs if "build" not in adir))
+
+    def test_scan_does_not_follow_links(self):
+        """Test that symbolic links to directories are reported but not followed"""
+        link = os.path.join(utils.TEST_DIR_PATH, "link")
+        os.symlink(self.dirs[0], link)
+        files, dirs = self._scan([])
+        self.assertEqual(files, sorted(self.files))
+        self.assertEqual(dirs, sorted(self.dirs + [link]))
+
+    def test_scan_non_existent(self):
+        """Test that a vanished directory results in an empty scan"""
+        entries, dirs = tree_scanner.scan_tree(
+            os.path.join(utils.TEST_DIR_PATH, "non-existent"), []
+        )
+        self.assertEqual(entries, [])
+        self.assertEqual(dirs, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""Tests watch_budget module"""
+
+import os
+import re
+import unittest
+from unittest import mock
+
+import apps.keep_testing.util.watch_budget as watch_budget
+
+import tests.util.utils_tests_lib as utils
+
+
+class TestPlan(utils.TestWithTmpDir):
+    """Tests plan function"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.root = utils.TEST_DIR_PATH
+        # hot: 1 directory, warm: 3 directories, cold: 4 directories
+        for adir in ["hot", "warm/a", "warm/b", "cold/a/x", "cold/b", "ignored/a"]:
+            os.makedirs(os.path.join(self.root, adir))
+        for mtime, adir in enumerate(
+            ["cold/a/x", "cold/a", "cold/b", "cold", "warm/a", "warm/b", "warm", "hot"]
+        ):
+            os.utime(os.path.join(self.root, adir), ns=(mtime, mtime))
+        self.ignore = [re.compile(r".*/ignored")]
+
+    def _path(self, *paths):
+        return [os.path.join(self.root, path) if path else self.root for path in paths]
+
+    def test_no_budget(self):
+        """Test that without budget all roots are watched with subdirectories"""
+        result = watch_budget.plan([self.root], self.ignore, None)
+        self.assertEqual(result.recursive, [self.root])
+        self.assertEqual((result.single, result.polled), ([], []))
+
+    def test_fits(self):
+        """Test that roots are watched with subdirectories when all directories fit"""
+        result = watch_budget.plan([self.root], self.ignore, 9)
+        self.assertEqual(result.recursive, [self.root])
+        self.assertEqual(result.watches, 9)
+        self.assertEqual((result.single, result.polled), ([], []))
+
+    def test_coldest_polled(self):
+        """Test that the most recently changed subtrees are watched and the others polled"""
+        result = watch_budget.plan([self.root], self.ignore, 5)
+        self.assertEqual(result.single, self._path(""))
+        self.assertEqual(result.recursive, self._path("hot", "warm"))
+        self.assertEqual(result.polled, self._path("cold"))
+        self.assertEqual(result.watches, 5)
+
+    def test_split(self):
+        """Test that a subtree that does not fit is split"""
+        result = watch_budget.plan([self.root], self.ignore, 7)
+        self.assertEqual(result.single, self._path("", "cold"))
+        self.assertEqual(result.recursive, self._path("cold/b", "hot", "warm"))
+        self.assertEqual(result.polled, self._path("cold/a"))
+        self.assertEqual(result.watches, 7)
+
+    def test_known_dirs(self):
+        """Test that known directories are used instead of scanning the tree"""
+        known = self._path("hot", "warm", "warm/a", "cold")
+        with mock.patch.object(watch_budget.tree_scanner, "scan_tree") as scan_tree:
+            result = watch_budget.plan([self.root], self.ignore, 5, known)
+        scan_tree.assert_not_called()
+        self.assertEqual(result.recursive, [self.root])
+        self.assertEqual(result.watches, 5)
+        self.assertEqual((result.single, result.polled), ([], []))
+
+
+class TestPoller(utils.TestWithTmpDir):
+    """Tests Poller class"""
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.subtrees = [os.path.join(utils.TEST_DIR_PATH, adir) for adir in ["a", "b"]]
+        for subtree in self.subtrees:
+            os.makedirs(os.path.join(subtree, "sub"))
+            utils.create_file(os.path.join(subtree, "sub", "file.txt"))
+        self.poller = watch_budget.Poller(
+            self.subtrees, 0.01, [re.compile(r".*\.o")], mock.Mock()
+        )
+
+    def test_poll(self):
+        """Test that changed subtrees are reported once"""
+        self.assertEqual(self.poller.poll(), [])
+        utils.change_file(os.path.join(self.subtrees[1], "sub", "file.txt"))
+        utils.create_file(os.path.join(self.subtrees[0], "ignored.o"))
+        self.assertEqual(self.poller.poll(), [self.subtrees[1]])
+        self.assertEqual(self.poller.poll(), [])
+
+    def test_deleted(self):
+        """Test that a deleted subtree is a change"""
+        utils.remove_file(os.path.join(self.subtrees[0], "sub", "file.txt"))
+        self.assertEqual(self.poller.poll(), [self.subtrees[0]])
+
+    def test_add(self):
+        """Test that an added subtree is reported with the files it already has"""
+        subtree = os.path.join(utils.TEST_DIR_PATH, "new")
+        utils.create_dir(subtree)
+        utils.create_file(os.path.join(subtree, "file.txt"))
+        self.poller.add(subtree)
+        self.assertEqual(self.poller.subtrees, self.subtrees + [subtree])
+        self.assertEqual(self.poller.poll(), [subtree])
+        self.assertEqual(self.poller.poll(), [])
+
+    def test_thread(self):
+        """Test that the polling thread passes changed subtrees to the callback"""
+        changes = []
+        poller = watch_budget.Poller(self.subtrees, 0.01, [], changes.extend)
+        poller.start()
+        utils.create_file(os.path.join(self.subtrees[0], "new.txt"))
+        poller.stop()
+        self.assertEqual(changes, [(self.subtrees[0], True)])
+
+
+if __name__ == "__main__":
+    unittest.main()
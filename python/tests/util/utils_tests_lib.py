@@ -39,6 +39,13 @@ def change_file(filename: str):
     time.sleep(_SLEEP_SIZE)
 
 
+def backdate(*filenames: str):
+    """Sets the modification time of files one minute in the past (as if written long ago)"""
+    past = time.time() - 60
+    for filename in filenames:
+        os.utime(filename, (past, past))
+
+
 def remove_file(filename: str):
     """Remove file"""
     os.remove(filename)